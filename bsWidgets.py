@@ -15,6 +15,7 @@ import datetime
 import locale
 import sys
 import time
+import unicodedata
 
 import npyscreen
 from npyscreen import fmForm
@@ -24,6 +25,8 @@ from npyscreen import wgtextbox as textbox
 from npyscreen import wgwidget as widget
 
 import config
+import prefixIndex
+import typeAhead
 #import inspect
 from config import SCREENWIDTH as WIDTH
 
@@ -32,6 +35,9 @@ EXITED_UP    = -1
 RAISEERROR   = 'RAISEERROR'
 EXITED_ESCAPE= 127
 
+FITTED_CACHE = 10000    # strings whose fitted part MyTextfield keeps
+_fitted = {}            # (string, maximum_string_length, left_margin) -> MyTextfield.fit() of it
+
 
 def notify_ok_cancel(message, title="", form_color='CURSOR_INVERSE', wrap=True, editw = 0,):
     "Display a question message. Returns True if OK button pressed, False if Cancel button pressed."
@@ -108,6 +114,9 @@ class MyFixedText(textbox.FixedText):
 
 class MyTextfield(textbox.TextfieldBase):
     "My own TextfieldBase, to support Windows/unicode."
+    _shown = None   # shown_state() of the last update()
+    _mark = None    # what the pad had at the mark, after the last update()
+    _mark_x = 0
     def __init__(self, screen, value='', highlight_color='CURSOR', highlight_whole_widget=False, invert_highlight_color=True, fixed_length=True, **keywords):
        
         super().__init__(screen, value, highlight_color, highlight_whole_widget, invert_highlight_color, **keywords)    # to TextfieldBase -> Widget
@@ -327,8 +336,55 @@ class MyTextfield(textbox.TextfieldBase):
 
         return string_to_print
 
+    def update(self, clear=True, cursor=True):
+        """ TextfieldBase.update(), but a field that would print the same as the last time, in the same place,
+        and is still on screen (its mark, see _print(), is there), isn't printed again.
+        """
+        shown = self.shown_state()
+        if shown is not None and shown == self._shown and \
+            self.parent.curses_pad.inch(self.rely, self._mark_x) == self._mark:
+            return
+        super().update(clear, cursor)
+        self._shown = shown
+        self._mark = self.parent.curses_pad.inch(self.rely, self._mark_x)
+
+    def shown_state(self):
+        "All that makes the field look as it does, None if it can't be told (it is being edited)."
+        if self.editing or self.hidden or self.syntax_highlighting:
+            return None
+        return (self.value, self.highlight, self.show_bold, self.important, self.highlight_whole_widget, self.color, \
+            self.highlight_color, self.begin_at, self.left_margin, self.relx, self.rely, self.width, self.maximum_string_length)
+
+    def fit(self, string_to_print):
+        """ (the start of the string that fits in the field, the screen columns it takes, True if all its
+        characters take one column on screen). Cached by string.
+        """
+        key = (string_to_print, self.maximum_string_length, self.left_margin)
+        fitted = _fitted.get(key)
+        if fitted is None:
+            if len(_fitted) >= FITTED_CACHE:
+                _fitted.clear()
+            column = 0
+            place_in_string = 0
+            for ch in string_to_print:
+                if column > (self.maximum_string_length - self.left_margin):
+                    break
+                width_of_char_to_print = self.find_width_of_char(ch)
+                if column - 1 + width_of_char_to_print > self.maximum_string_length:
+                    break
+                column += width_of_char_to_print
+                place_in_string += 1
+            run = string_to_print[:place_in_string]
+            narrow = run.isascii() or not any(unicodedata.east_asian_width(ch) in "WF" or unicodedata.combining(ch) \
+                for ch in run)
+            fitted = _fitted[key] = (run, column, narrow)
+        return fitted
+
     def _print(self):
-        "Adaptation of _print() from TextfieldBase."
+        """ Adaptation of _print() from TextfieldBase. The string is written with one addstr() per attribute run,
+        not one per character. The field's mark is its first non-blank position, read back by update().
+        """
+        self._mark_x = self.relx + self.left_margin
 
         string_to_print = self._get_string_to_print()
 
@@ -346,30 +402,37 @@ class MyTextfield(textbox.TextfieldBase):
             else:
                 return None
 
-        string_to_print = string_to_print[self.begin_at:self.maximum_string_length + self.begin_at - self.left_margin]
-        
         string_to_print = self.display_value(self.value)[self.begin_at:self.maximum_string_length+self.begin_at-self.left_margin]
-        
-        column = 0
-        place_in_string = 0
+
+        run, columns, narrow = self.fit(string_to_print)
+        blanks = len(run) - len(run.lstrip(" "))
+        if blanks < len(run):
+            self._mark_x += blanks
+
         if self.syntax_highlighting:
             self.update_highlighting(start=self.begin_at, end=self.maximum_string_length+self.begin_at-self.left_margin)
-            while column <= (self.maximum_string_length - self.left_margin):
-                if not string_to_print or place_in_string > len(string_to_print)-1:
-                    break
-                width_of_char_to_print = self.find_width_of_char(string_to_print[place_in_string])
-                if column - 1 + width_of_char_to_print > self.maximum_string_length:
-                    break 
+            column = 0
+            place_in_string = 0
+            while place_in_string < len(run):   # runs of characters with the same highlight
                 try:
                     highlight = self._highlightingdata[self.begin_at+place_in_string]
                 except:
-                    highlight = curses.A_NORMAL                
-                self.parent.curses_pad.addstr(self.rely,self.relx+column+self.left_margin, 
-                    self._print_unicode_char(string_to_print[place_in_string]), 
+                    highlight = curses.A_NORMAL
+                end = place_in_string + 1
+                while end < len(run):
+                    try:
+                        if self._highlightingdata[self.begin_at+end] != highlight:
+                            break
+                    except:
+                        if highlight != curses.A_NORMAL:
+                            break
+                    end += 1
+                self.parent.curses_pad.addstr(self.rely,self.relx+column+self.left_margin,
+                    self._print_unicode_char(run[place_in_string:end]),
                     highlight
                     )
-                column += self.find_width_of_char(string_to_print[place_in_string])
-                place_in_string += 1
+                column += sum(self.find_width_of_char(ch) for ch in run[place_in_string:end])
+                place_in_string = end
         else:
             if self.do_colors():
                 if self.show_bold and self.color == 'DEFAULT':
@@ -386,33 +449,27 @@ class MyTextfield(textbox.TextfieldBase):
                 else:
                     color = curses.A_NORMAL
 
-            while column <= (self.maximum_string_length - self.left_margin):
-                if not string_to_print or place_in_string > len(string_to_print)-1:
-                    if self.highlight_whole_widget:
-                        if (self.relx+column+self.left_margin < WIDTH):    # DV: modified
-                            self.parent.curses_pad.addstr(self.rely,self.relx+column+self.left_margin, 
-                                ' ', 
-                                color
-                                )
-                        column += width_of_char_to_print
-                        place_in_string += 1
-                        continue
-                    else:
-                        break
-
-                width_of_char_to_print = self.find_width_of_char(string_to_print[place_in_string])
-                if column - 1 + width_of_char_to_print > self.maximum_string_length:
-                    break
-
-                self.parent.curses_pad.addstr(self.rely,self.relx+column+self.left_margin,
-                    self._print_unicode_char(string_to_print[place_in_string]), 
-                    color
-                    )
+            blanks = ""
+            if self.highlight_whole_widget and len(run) == len(string_to_print):  # the rest of the field, in blanks
+                # up to the field's end, but never on the screen's last column  DV: modified
+                blanks = " " * max(0, min(self.maximum_string_length - self.left_margin - columns + 1, \
+                    WIDTH - (self.relx + columns + self.left_margin)))
+            if narrow:  # one run
+                pieces = [(0, run + blanks)]
+            else:       # wide or combining characters: one by one, every one where its width says
+                pieces = []
+                column = 0
+                for ch in run:
+                    pieces.append((column, ch))
+                    column += self.find_width_of_char(ch)
+                pieces.append((columns, blanks))
+            for column, text in pieces:
+                if text:
+                    self.parent.curses_pad.addstr(self.rely,self.relx+column+self.left_margin,
+                        self._print_unicode_char(text),
+                        color
+                        )
 
-                column += width_of_char_to_print
-                place_in_string += 1
-            pass
-        
 
     ###########################################################################################
     # Handlers and methods
@@ -784,16 +841,24 @@ class MyGridColTitles(grid.SimpleGrid):
         else:
             self.col_titles = []
         self.col_margin = col_margin    # DV: modified
+        self._painted = {}          # cell widget -> what it shows on screen, see _print_cell()
+        self._painted_view = None   # (first column, cell layout) of the cells in _painted
         super(MyGridColTitles, self).__init__(screen, col_margin=self.col_margin, *args, **keywords)  # DV: modified: va a SimpleGrid.__init__()
     
     def update(self, clear=True):
-        "From SimpleGrid, adapted to a righthand screen with a wide-screen notes/description column."
-        if clear == True:
-            self.clear()
+        """ From SimpleGrid, adapted to a righthand screen with a wide-screen notes/description column.
+        Only the cells that show something else than in the last update are printed: the grid is only cleared,
+        and printed whole, when the form has erased it, or when its columns have moved. 'clear' is ignored.
+        """
         if self.begin_col_display_at < 0:
             self.begin_col_display_at = 0
         if self.begin_row_display_at < 0:
             self.begin_row_display_at = 0
+        view = (self.begin_col_display_at, self.cell_layout())
+        if self.pad_erased() or view != self._painted_view:
+            self.clear()
+            self._painted = {}
+            self._painted_view = view
         if (self.editing or self.always_show_cursor) and not self.edit_cell:
             self.edit_cell = [0,0]
         row_indexer = self.begin_row_display_at
@@ -808,6 +873,55 @@ class MyGridColTitles(grid.SimpleGrid):
                 column_indexer += 1
             row_indexer += 1
 
+    def _print_cell(self, cell):
+        "From SimpleGrid, but the cell is only printed if its text, highlight or place have changed since it was."
+        row_indexer, column_indexer = cell.grid_current_value_index
+        try:
+            cell_value = self.display_value(self.values[row_indexer][column_indexer])
+        except (IndexError, TypeError):     # past the last row, or no values yet
+            cell_value = self.on_empty_display
+            cell.grid_current_value_index = -1
+        self._cell_widget_show_value(cell, cell_value)
+
+        if self.value:
+            if cell.grid_current_value_index in self.value or cell.grid_current_value_index == self.value:
+                self._cell_widget_show_value_selected(cell, True)
+            else:
+                self._cell_widget_show_value_selected(cell, False)
+        else:
+            self._cell_widget_show_value_selected(cell, False)
+
+        if (self.editing or self.always_show_cursor) and cell.grid_current_value_index != -1:
+            if self.select_whole_line:
+                if (self.edit_cell[0] == cell.grid_current_value_index[0]):
+                    self._cell_show_cursor(cell, True)
+                    cell.highlight_whole_widget = True
+                else:
+                    self._cell_show_cursor(cell, False)
+            elif ((self.edit_cell[0] == cell.grid_current_value_index[0]) and (self.edit_cell[1] == cell.grid_current_value_index[1])):
+                self._cell_show_cursor(cell, True)
+            else:
+                self._cell_show_cursor(cell, False)
+        else:
+            self._cell_show_cursor(cell, False)
+
+        self.custom_print_cell(cell, cell_value)
+
+        shown = (cell.value, cell.highlight, cell.show_bold, cell.highlight_whole_widget, cell.relx, cell.maximum_string_length)
+        if self._painted.get(cell) != shown:    # what's on screen
+            cell.update()
+            self._painted[cell] = shown
+
+    def cell_layout(self):
+        "Where the cells of a row are, and how long: the right screen moves some."
+        if not self._my_widgets:
+            return ()
+        return tuple((cell.relx, cell.maximum_string_length) for cell in self._my_widgets[0])
+
+    def pad_erased(self):
+        "True if what update() printed may be gone from the form's pad. MyGrid can tell."
+        return True
+
 
 class MyGrid(MyGridColTitles):
     "My GridColTitles version."
@@ -820,8 +934,17 @@ class MyGrid(MyGridColTitles):
         super().__init__(screen, col_titles, col_margin, *args, **keywords)     # go to MyGridColTitles.__init__  
     
     def make_contained_widgets(self):
-        "Adapted from GridColTitles+SimpleGrid to accept specified column width. Parameter col_widths is optional."
-        
+        """ Adapted from GridColTitles+SimpleGrid to accept specified column width. Parameter col_widths is optional.
+        The cell widgets are made once for a grid size and column widths, and then reused: they show whatever rows
+        and columns are on display.
+        """
+        size = (self.relx, self.rely, self.width, self.height, tuple(self.col_widths))
+        if size == getattr(self, "_widgets_size", None):
+            self.restore_cell_layout()
+            return
+        self._widgets_size = size
+        self._painted = {}
+
         if len(self.col_widths) == 0:     # first time in empty initialization, or non-specified col_widths
             if self.column_width_requested:
                 # don't need a margin for the final column
@@ -889,6 +1012,20 @@ class MyGrid(MyGridColTitles):
                         relx = self.relx + x_offset + self.additional_x_offset, width=column_width, height=self.row_height))
                     x_offset += (column_width + self.col_margin)
                 self._my_widgets.append(row)
+        for row in self._my_widgets:
+            for cell in row:
+                cell.home = (cell.relx, cell.maximum_string_length)    # for restore_cell_layout()
+
+    def restore_cell_layout(self):
+        "Puts the cells back where make_contained_widgets() made them: the right screen moves some."
+        for row in self._my_widgets:
+            for cell in row:
+                cell.relx, cell.maximum_string_length = cell.home
+
+    def pad_erased(self):
+        "True if the form has erased its pad since the last update() (Form.display() does): the rule under the titles is gone."
+        ch = self.parent.curses_pad.inch(self.rely+1, self.relx) & curses.A_CHARTEXT
+        return ch != curses.ACS_HLINE & curses.A_CHARTEXT
 
     def h_scroll_left(self, inpt):
         "Adapted to full-line selection and bi-screen."
@@ -901,7 +1038,7 @@ class MyGrid(MyGridColTitles):
         self.form.right_screen = False    # meaning the screen on the right hand
 
         # Hacking grid column sizes
-        self.make_contained_widgets()   # refresh screen
+        self.restore_cell_layout()   # the left screen ones
         self.on_select(inpt)
 
     def h_scroll_right(self, inpt):
@@ -962,7 +1099,8 @@ class MyGrid(MyGridColTitles):
         self.editing = False    # exit from grid
         self.how_exited = True  # self.find_next_editable, # A default value
         try:
-            config.currentRow = config.fileRows[self.edit_cell[0]][1]
+            rowSet = self.form.rowSet
+            rowSet.currentRow = rowSet.rows[self.edit_cell[0]][1]
         except IndexError:  # there are no rows in the table
             pass
 
@@ -1002,8 +1140,10 @@ class MyGrid(MyGridColTitles):
                 title_text = self.col_titles[self.begin_col_display_at+_title_counter]
             except IndexError:
                 title_text = None
-            title_cell.value = title_text
-            title_cell.update()
+            title_cell.value = title_text or ""
+            if self._painted.get(title_cell) != (title_text, title_cell.relx):     # not on screen yet
+                title_cell.update()
+                self._painted[title_cell] = (title_text, title_cell.relx)
             _title_counter += 1
             
         self.parent.curses_pad.hline(self.rely+1, self.relx, curses.ACS_HLINE, self.width)
@@ -1017,29 +1157,28 @@ class MyGrid(MyGridColTitles):
     
     def set_highlight_row(self, row_reference):
         "Searchs and highlights current grid row."
-        config.screenRow = 0
+        rowSet = self.form.rowSet   # the selector's rows and selected row
+        rowSet.screenRow = 0
         if row_reference != None:
-            filerows = config.fileRows
-            for row in filerows:     # (it's already updated)
-                if row[1] == row_reference:
-                    self.edit_cell = [config.screenRow, 0]  # highlight selected row
-                    config.currentRow = row_reference
-                    # If the searched index is greater than the first index displayed on screen
-                    if config.screenRow > self.begin_row_display_at:
-                        self.ensure_cursor_on_display_down_right(None)
-                    else:   # # If the searched index is smaller than the first displayed index
-                        self.ensure_cursor_on_display_up(None)
-                    break
-                config.screenRow += 1
+            position = rowSet.rows.position_of_key(row_reference)     # (it's already updated)
+            if position is not None:
+                rowSet.screenRow = position
+                self.edit_cell = [rowSet.screenRow, 0]  # highlight selected row
+                rowSet.currentRow = row_reference
+                # If the searched index is greater than the first index displayed on screen
+                if rowSet.screenRow > self.begin_row_display_at:
+                    self.ensure_cursor_on_display_down_right(None)
+                else:   # # If the searched index is smaller than the first displayed index
+                    self.ensure_cursor_on_display_up(None)
         elif row_reference == None:
             self.edit_cell = [0, 0] # the first one
-            config.currentRow = ""
+            rowSet.currentRow = ""
             try:
-                filerows = config.fileRows
+                filerows = rowSet.rows
                 if filerows[self.edit_cell[0]]:  # if there is a row...
-                    config.currentRow = filerows[self.edit_cell[0]][1]    # ...get the row reference
+                    rowSet.currentRow = filerows[self.edit_cell[0]][1]    # ...get the row reference
                 # If the searched index is greater than the first index displayed on screen
-                if config.screenRow > self.begin_row_display_at:
+                if rowSet.screenRow > self.begin_row_display_at:
                     self.ensure_cursor_on_display_down_right(None)
                 else:   # If the searched index is smaller than the first index displayed on screen
                     self.ensure_cursor_on_display_up(None)
@@ -1228,9 +1367,7 @@ class DetailField(MyTextfield):
                     form = self.form
                     #form.formTitle.value = form.form_title
                     grid = form.grid
-                    config.fileRows = form.readDBTable()        # it's a list of lists
-                    self.screenFileRows = form.getRowListForScreen(config.fileRows)     # it's a list of lists
-                    grid.values = self.screenFileRows
+                    form.fill_grid()    # the full set kept by rowSetCache, or read again
                     grid.set_highlight_row(None)  # First row
         elif ch == curses.ascii.ESC:
             self.editing = False
@@ -1679,6 +1816,7 @@ class MyMultiLineEdit(npyscreen.MultiLineEdit):
 
 class MyAutocomplete(textbox.Textfield):
     "From wgautocomplete.Autocomplete, adjusted for different keys."
+    valueSource = None  # see Chooser
 
     def display(self):
         """Do an update of the object AND refresh the screen"""
@@ -2028,6 +2166,8 @@ class MyAutocomplete(textbox.Textfield):
 
     def get_choice(self):
         "popup_chooser() asks for a list of values"
+        if self.valueSource is not None:    # the values from the field's one on, from the DB
+            self.load_values(self.valueSource.from_value(self.value))
         # Pop-up window is displayed
         if self.popupType == "wide":
             tmp_window = MyPopupWide(self.parent, name=self.name, framed=True, show_atx=0, show_aty=0, columns=WIDTH, lines=15, shortcut_len=4)
@@ -2053,29 +2193,18 @@ class MyAutocomplete(textbox.Textfield):
             pass
 
         if field_val not in ["", None]:         # so there's a single item in the field
+            index = prefixIndex.of(self.values)
             if self.chooserType == "simple":    
-                selector.value = self.values.index(self.value)
+                selector.value = index.position(self.value) or 0
 
             elif self.chooserType == "complex":
-                found = False
-                for v in self.values:
-                    # Here, v can be either:
-                    #   2052       2052-Literal
-                    #    01         01-Literal
-                    #   Literal
-                    try:
-                        pos = v.index("-")  # can be variable length
-                        # there's a hyphen
-                        if v[:pos] == self.value[:pos]:
-                            selector.value = self.values.index(v)
-                            found = True    # it can be a multi-value field, then it simply finds the first
-                            break
-                    except ValueError:  # no hyphen
-                        if v == self.value:
-                            selector.value = self.values.index(v)
-                            found = True
-                            break
-                if not found:
+                # The values can be either:
+                #   2052       2052-Literal
+                #    01         01-Literal
+                #   Literal
+                # it can be a multi-value field, then it simply finds the first
+                selector.value = index.find(self.value)
+                if selector.value is None:
                     notify_OK("\n  Chooser: value '" + self.value + "' not found","Error")
                     return None      # not found
             self.cursor_position = 0
@@ -2116,6 +2245,8 @@ class MyAutocomplete(textbox.Textfield):
                 self.update(clear=True)
                 #self.parent.push_a_tab()    Beware the back-tab!
         elif self.chooserType == "complex":
+            if self.valueSource is not None and self.key_pending():
+                return      # typing on: the lookup waits for the last key
             try:
                 self.value = self.parent.scan_value_in_list(widget=self)    # Hook for book.py and rxorderListing.py
                 self.current_value = self.value
@@ -2126,22 +2257,32 @@ class MyAutocomplete(textbox.Textfield):
 
             self.update(clear=True)
 
+    def key_pending(self):
+        "True if another key is pressed within typeAhead.DELAY ms. It stays in the input queue."
+        self.parent.curses_pad.timeout(typeAhead.DELAY)
+        ch = self.parent.curses_pad.getch()
+        self.parent.curses_pad.timeout(-1) # back to blocking mode
+        if ch == -1:
+            return False
+        curses.ungetch(ch)
+        return True
+
     def find_value_literal(self, value):
         "Returns a literal from an initial code or from the first characters."
-        try:
-            pos = self.values[0].index("-")    # there's a hyphen (and a numeric value) So, first value can never sport a hyphen!
-            for val in self.values:
-                pos = val.index("-")
-                if val[:pos] == value:
-                    return val
-            return False   # not found
-        except ValueError:      # no hyphen, no numeric value
-            for val in self.values:
-                if val[:self.cursor_position].lower() == value[:self.cursor_position].lower():
-                    return val
-        except IndexError:      # values is empty
+        if self.valueSource is not None:    # the values that start with them, from the DB
+            self.load_values(self.valueSource.starting_with(value[:self.cursor_position]))
+        if not self.values:     # values is empty
             return False
-
+        index = prefixIndex.of(self.values)
+        if "-" in self.values[0]:   # there's a hyphen (and a numeric value) So, first value can never sport a hyphen!
+            position = index.code_position(value)
+            if position is None:
+                return False   # not found
+            return self.values[position]
+        # no hyphen, no numeric value
+        position = index.first(value[:self.cursor_position])
+        if position is not None:
+            return self.values[position]
         return value
 
 
@@ -2151,13 +2292,17 @@ class Chooser(MyAutocomplete):
     # Shortcut-codes before '-' can be of variable length. Don't use a "-" in chooser literal values.
     # There can't be a value = 0
 
-    def __init__(self, screen, value='', values='', highlight_color='CURSOR', popupType=None, \
+    def __init__(self, screen, value='', values='', highlight_color='CURSOR', popupType=None, valueSource=None, \
         highlight_whole_widget=False, invert_highlight_color=True, **keywords):
         
         super().__init__(screen, value, highlight_color, highlight_whole_widget, invert_highlight_color, **keywords)
 
         self.popupType = popupType
+        self.valueSource = valueSource  # a typeAhead.QueryValues: the values are read as you type, not all at once
 
+        self.loaded_values = None   # the list load_values() was given last
+        if valueSource is not None:
+            values = valueSource.from_value("")
         self.load_values(values)    # Load the values into the chooser
 
         self.current_value = None
@@ -2181,7 +2326,10 @@ class Chooser(MyAutocomplete):
             self.value = self.values[chosen_value]
 
     def load_values(self, values):
-        "Load the values into the chooser."
+        "Load the values into the chooser. The same list again (see valueLists.py) is already loaded."
+        if values is self.loaded_values and values:
+            return
+        self.loaded_values = values
         final_values = []
         try:
             if isinstance(values[0], str):    # it's a list of string values: will add a number before
@@ -2304,32 +2452,28 @@ class MyPopup(fmForm.Form):
     def select_option(self):
         "Simply points to the entered shortcut line."
         multiline = self._widgets__[0]
-        try:
-            pos = multiline.values[0].index("-")   # hyphen, so numbered list
-            for v in multiline.values:
-                pos = v.index("-")
-                if v[:pos] == self.shortcut:
-                    index = multiline.values.index(v)
-                    multiline.cursor_line = index
-                    break
-        except ValueError:  # no hyphen, so non-numbered list
-            found = False
-            for v in multiline.values:
-                if v[:len(self.shortcut)].lower() == self.shortcut.lower():
-                    index = multiline.values.index(v)
-                    multiline.cursor_line = index
-                    found = True
-                    break
-            # not found: back to text field value
-            if not found:
-                try:
-                    index = multiline.values.index(self.parentField.value)
-                    multiline.cursor_line = index
+        if not multiline.values:    # empty values list
+            return
+        index = prefixIndex.of(multiline.values)
+        if "-" in multiline.values[0]:  # hyphen, so numbered list
+            position = index.code_position(self.shortcut)
+            if position is not None:
+                multiline.cursor_line = position
+        else:   # no hyphen, so non-numbered list
+            chooser = getattr(self.parentField, "entry_widget", None)
+            if getattr(chooser, "valueSource", None) is not None:   # the values that start with it, from the DB
+                values = chooser.valueSource.starting_with(self.shortcut)
+                if values:
+                    chooser.load_values(values)
+                    multiline.values = chooser.values
+                    index = prefixIndex.of(multiline.values)
+            position = index.first(self.shortcut)
+            if position is None:    # not found: back to text field value
+                position = index.position(self.parentField.value)
+                if position is not None:
                     self.shortcut = ""
-                except ValueError:
-                    pass
-        except IndexError:  # empty values list
-            pass
+            if position is not None:
+                multiline.cursor_line = position
 
 
 class MyPopupWide(MyPopup):
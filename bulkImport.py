@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     bulkImport.py - Bulk loading of records from CSV and JSON Lines files
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# For loading years of records at once: python -m optidrome import ...
+# The file is read one row at a time. Every row goes through the record rules
+# of the forms (records.RULES). Uniqueness and references are checked
+# against sets of keys loaded once at the start and grown with every
+# accepted row, instead of querying per row. Accepted rows are inserted in
+# batches of BATCH_SIZE: one prepared INSERT run by executemany() in one
+# write transaction per batch. A row refused by the schema's own constraints
+# is rejected and the batch goes on from the next row. For a first load, the
+# table's secondary indexes can be dropped and built once at the end.
+# Rejected rows are written as they come, with their row number and error,
+# into <file>.rejected.csv (or .jsonl), ready to be fixed and imported again.
+##############################################################################
+
+import csv
+import json
+import operator
+import os
+import sqlite3
+
+import dbLocking
+import records
+
+BATCH_SIZE = 20000      # rows per write transaction
+CACHE_KB = 262144       # page cache of the import connection, for the index B-trees
+
+
+def read_rows(filename):
+    "The rows of a CSV (with header) or JSON Lines file, as dicts, one at a time."
+    with open(filename, newline="", encoding="utf-8") as f:
+        if filename.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            reader = csv.reader(f)      # a csv.DictReader without its per-row checks
+            header = next(reader, [])
+            for row in reader:
+                if row:
+                    yield dict(zip(header, row))
+
+def rejects_filename(filename):
+    base, extension = os.path.splitext(filename)
+    return base + ".rejected" + (".jsonl" if extension == ".jsonl" else ".csv")
+
+
+class RejectsFile:
+    "The rejected rows, with 'row' and 'error' in front, in the format of the imported file. Created on first use."
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = None
+        self.count = 0
+
+    def write(self, number, values, message):
+        row = dict({"row": number, "error": message}, **values)
+        if self.f is None:
+            self.f = open(self.filename, "w", newline="", encoding="utf-8")
+            if not self.filename.endswith(".jsonl"):
+                self.writer = csv.DictWriter(self.f, fieldnames=list(row), extrasaction="ignore")
+                self.writer.writeheader()
+        if self.filename.endswith(".jsonl"):
+            self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            self.writer.writerow(row)
+        self.count += 1
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+def existing_keys(conn, entity):
+    "{column: set of values} of the entity's UNIQUE columns, as their checks compare them."
+    tablename = records.ENTITIES[entity][0]
+    keys = {}
+    for column, type, label, message in records.UNIQUE[entity]:
+        keys[column] = {type(value) for value, in conn.execute("SELECT " + column + " FROM " + tablename) if value is not None}
+    return keys
+
+def patient_names(conn):
+    "{mrn: (name, name_key)} of all the patients: the orders' and prescriptions' reference check and name copy."
+    return {mrn: (name, name_key) for mrn, name, name_key in conn.execute("SELECT mrn, name, name_key FROM " + records.PATIENT)}
+
+
+class Importer:
+    "Checks and shapes the rows of one kind of record into INSERT parameters."
+    def __init__(self, conn, entity):
+        self.conn = conn
+        self.entity = entity
+        self.tablename = records.ENTITIES[entity][0]
+        self.rules = records.RULES[entity]
+        keys = existing_keys(conn, entity)
+        self.unique = [(column, type, label, message, keys[column]) for column, type, label, message in records.UNIQUE[entity]]
+        self.references = []    # (column, set of existing keys, label, message)
+        self.names = None
+        for column, tablename, keyColumn, label, message in records.REFERENCES.get(entity, []):
+            if tablename == records.PATIENT:
+                self.names = patient_names(conn)
+                self.references.append((column, self.names, label, message))
+            else:
+                self.references.append((column, {int(value) for value, in conn.execute( \
+                    "SELECT " + keyColumn + " FROM " + tablename) if value is not None}, label, message))
+        self.columns = None     # the INSERT columns, from the first row
+
+    def set_columns(self, values):
+        "The INSERT statement, from the first row's columns."
+        if self.entity == "patient":
+            self.columns = list(records.patient_values(values))
+        elif self.entity == "user":
+            self.columns = records.USER_COLUMNS
+        else:
+            records.known_columns(self.conn, self.entity, values)
+            self.columns = list(records.with_patient_name(self.tablename, values, ""))
+        self.sqlQuery = "INSERT INTO " + self.tablename + " (" + ",".join(self.columns) + ") VALUES (" + \
+            ",".join("?" * len(self.columns)) + ")"
+        self.getter = operator.itemgetter(*self.columns)
+        self.columnSet = set(self.columns)
+
+    def parameters(self, values):
+        "The INSERT parameters of a row; raises ValidationError like the forms do."
+        self.rules(values)
+        for column, type, label, message, keys in self.unique:
+            if type(values[column]) in keys:
+                raise records.ValidationError(label, message)
+        for column, existing, label, message in self.references:
+            if int(values[column]) not in existing:
+                raise records.ValidationError(label, message)
+        if self.entity == "patient":
+            row = records.patient_values(values)
+        elif self.entity == "user":
+            row = records.user_values(values)
+        else:
+            if not values.keys() <= self.columnSet:
+                records.known_columns(self.conn, self.entity, values)
+                raise records.ValidationError("", "Error: Columns differ from the first row")
+            row = records.with_patient_name(self.tablename, values, *self.names[int(values["patient_mrn"])])
+        for column, type, label, message, keys in self.unique:
+            keys.add(type(values[column]))      # the next rows can't take it
+        try:
+            return self.getter(row)
+        except KeyError:    # a row without some of the columns
+            return tuple(row.get(column) for column in self.columns)
+
+    def forget(self, values):
+        "A row refused by the database after all: its keys are free again."
+        for column, type, label, message, keys in self.unique:
+            keys.discard(type(values[column]))
+
+
+def insert_batch(conn, importer, batch, sources, rejects):
+    """ one write transaction for the batch: INSERT parameters, and their (row number, values). Returns the rows inserted.
+    A row refused by the schema's constraints stops executemany() after the rows before it, which stay:
+    it is rejected and the rest of the batch goes on, in the same transaction.
+    """
+    cur = conn.cursor()
+    inserted = 0
+    with dbLocking.write_transaction(conn, interactive=False):
+        while batch:
+            parameters = iter(batch)    # executemany() takes them one by one: the ones left tell where it stopped
+            try:
+                cur.executemany(importer.sqlQuery, parameters)
+                inserted += len(batch)
+                break
+            except sqlite3.IntegrityError as e:     # only the failed statement is undone
+                done = len(batch) - operator.length_hint(parameters) - 1    # not total_changes: triggers count there too
+                number, values = sources[done]
+                importer.forget(values)
+                rejects.write(number, values, "Error: " + str(e))
+                inserted += done
+                batch, sources = batch[done + 1:], sources[done + 1:]
+    return inserted
+
+def drop_secondary_indexes(conn, tablename):
+    "Drops the table's non-UNIQUE indexes. Returns their CREATE statements."
+    indexes = conn.execute("SELECT name, sql FROM sqlite_schema WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL " + \
+        "AND sql NOT LIKE 'CREATE UNIQUE%'", (tablename.strip("'"),)).fetchall()
+    with dbLocking.write_transaction(conn, interactive=False):
+        for name, sql in indexes:
+            conn.execute('DROP INDEX "' + name + '"')
+    return [sql for name, sql in indexes]
+
+def create_indexes(conn, statements):
+    with dbLocking.write_transaction(conn, interactive=False):
+        for sql in statements:
+            conn.execute(sql)
+
+def import_file(conn, entity, filename, rows=None, batch_size=BATCH_SIZE, defer_indexes=False):
+    """ creates records from a CSV or JSON Lines file, in batched transactions
+    :param rows: the file's rows, if they come through some transformation; read_rows(filename) by default
+    :param defer_indexes: for first loads: the secondary indexes are dropped, and built once at the end
+    :return: (rows inserted, rows rejected, rejects file name or None)
+    """
+    importer = Importer(conn, entity)
+    rejects = RejectsFile(rejects_filename(filename))
+    inserted = 0
+    batch, sources = [], []
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute("PRAGMA cache_size = " + str(-CACHE_KB))
+    indexes = drop_secondary_indexes(conn, importer.tablename) if defer_indexes else []
+    try:
+        if rows is None:
+            rows = read_rows(filename)
+        for number, values in enumerate(rows, 1):
+            try:
+                if importer.columns is None:
+                    importer.set_columns(values)
+                batch.append(importer.parameters(values))
+            except records.ValidationError as e:
+                rejects.write(number, values, e.message)
+                continue
+            sources.append((number, values))
+            if len(batch) == batch_size:
+                inserted += insert_batch(conn, importer, batch, sources, rejects)
+                batch, sources = [], []
+        if batch:
+            inserted += insert_batch(conn, importer, batch, sources, rejects)
+    finally:
+        rejects.close()
+        create_indexes(conn, indexes)
+        conn.execute("PRAGMA cache_size = " + str(cache_size))
+    return inserted, rejects.count, rejects.filename if rejects.count else None
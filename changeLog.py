@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     changeLog.py - The log of the record changes, fed by triggers
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Every INSERT, UPDATE and DELETE of the tables the selectors show writes a
+# line into 'optidrome.change_log', by triggers, whatever terminal or program
+# (forms, batch mode, bulk import) made it: the table, the record id and key,
+# and "I", "U" or "D". A key change is logged as a "D" of the old key and an
+# "I" of the new one, as the row moves in the grid. The selectors keep the
+# log position of their row sets (rowSetCache.py) and apply just the lines
+# after it, instead of reading their table again.
+# The log is pruned at startup to its last KEEP lines; a row set older than
+# the log is read again.
+##############################################################################
+
+import config
+
+CHANGE_LOG = "'optidrome.change_log'"
+KEEP = config.CHANGE_LOG_KEEP   # lines kept by prune()
+
+# Logged tables and their key column, the selectors' order
+KEYS = {"'optidrome.patient'": "mrn",
+        "'optidrome.rxorder'": "job",
+        "'optidrome.prescription'": "rx_num",
+        "'optidrome.user'": "numeral"
+        }
+
+
+def table_columns(conn, tablename):
+    return [row[1] for row in conn.execute("PRAGMA table_info(" + tablename + ")")]
+
+def create(conn):
+    """ the change log table and the triggers of the logged tables (a schema migration)
+    :param conn: Connection object
+    :return:
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS " + CHANGE_LOG + " (seq INTEGER PRIMARY KEY AUTOINCREMENT, " \
+        "tablename TEXT NOT NULL, row_id INTEGER NOT NULL, row_key, op TEXT NOT NULL)")
+    for tablename, key in KEYS.items():
+        if key not in table_columns(conn, tablename):
+            continue
+        name = tablename.strip("'")
+        prefix = '"' + name + "_log"
+        insert = "INSERT INTO " + CHANGE_LOG + " (tablename, row_id, row_key, op) VALUES ('" + name + "', "
+        conn.execute("CREATE TRIGGER IF NOT EXISTS " + prefix + '_ai"' + " AFTER INSERT ON " + tablename + " BEGIN " + \
+            insert + "new.id, new." + key + ", 'I'); END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS " + prefix + '_ad"' + " AFTER DELETE ON " + tablename + " BEGIN " + \
+            insert + "old.id, old." + key + ", 'D'); END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS " + prefix + '_au"' + " AFTER UPDATE ON " + tablename + \
+            " WHEN old." + key + " IS new." + key + " BEGIN " + insert + "new.id, new." + key + ", 'U'); END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS " + prefix + '_ak"' + " AFTER UPDATE ON " + tablename + \
+            " WHEN old." + key + " IS NOT new." + key + " BEGIN " + insert + "old.id, old." + key + ", 'D'); " + \
+            insert + "new.id, new." + key + ", 'I'); END")
+
+def last_seq(conn):
+    "The position of the last line, 0 if there's none."
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM " + CHANGE_LOG).fetchone()[0]
+
+def changes(conn, tablenames, since):
+    """ the lines of some tables after a position
+    :return: [(seq, tablename, op, id, key)] in order, None if the log has been pruned past 'since'
+    """
+    first = conn.execute("SELECT MIN(seq) FROM " + CHANGE_LOG).fetchone()[0]
+    if first is not None and first > since + 1:
+        return None
+    names = [tablename.strip("'") for tablename in tablenames]
+    return [(seq, "'" + name + "'", op, id, key) for seq, name, op, id, key in conn.execute( \
+        "SELECT seq, tablename, op, row_id, row_key FROM " + CHANGE_LOG + " WHERE seq > ? AND tablename IN (" + \
+        ",".join("?" * len(names)) + ") ORDER BY seq", [since] + names)]
+
+def prunable(conn, keep=KEEP):
+    "True if prune() would delete something: the log holds more than 'keep' lines."
+    first, last = conn.execute("SELECT MIN(seq), MAX(seq) FROM " + CHANGE_LOG).fetchone()
+    return first is not None and first <= last - max(keep, 1)
+
+def prune(conn, keep=KEEP):
+    "Deletes all but the last 'keep' lines (one at least, to keep the position). Returns the lines deleted."
+    cur = conn.execute("DELETE FROM " + CHANGE_LOG + " WHERE seq <= (SELECT MAX(seq) FROM " + CHANGE_LOG + ") - ?", \
+        (max(keep, 1),))
+    return cur.rowcount
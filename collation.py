@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     collation.py - ICU sort keys stored in the database
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Sortable names get a BLOB column with their ICU sort key (dbInitialize
+# migration 4), indexed, so "ORDER BY name_key" is locale-aware and served
+# straight from the index. The program computes the key on every write;
+# fill_missing() at startup catches the rows written by other tools.
+# Keys depend on config.COLLATION_LOCALE, a fixed locale and not each
+# terminal's own, since they share the indexed column: after changing it, run
+#     python collation.py
+# to rebuild them all.
+# The type-ahead choosers' names also get a folded TEXT column (migration 6,
+# FOLD_KEYS): lowercase, without accents, so the names that start with a
+# prefix are a range of its index (see typeAhead.py). It is written and
+# filled in the same way.
+##############################################################################
+
+import sqlite3
+
+# We need PyICU (=icu) to order unicode strings in Spanish, Catalan, French...
+import icu
+
+import config
+import dbLocking
+import prefixIndex
+
+# Table -> [(text column, its sort key column)]
+SORT_KEYS = {
+    "'optidrome.patient'": [("name", "name_key")],
+    "'optidrome.rxorder'": [("patient_name", "patient_name_key")],
+}
+
+# Table -> [(text column, its folded column)]
+FOLD_KEYS = {
+    "'optidrome.patient'": [("name", "name_fold")],
+}
+
+_collator = None
+
+
+def collator():
+    "The ICU collator of the stored keys, created once."
+    global _collator
+    if _collator is None:
+        _collator = icu.Collator.createInstance(icu.Locale(config.COLLATION_LOCALE))
+    return _collator
+
+def sort_key(text):
+    "ICU sort key of a text, as stored in the key columns. None for None."
+    if text is None:
+        return None
+    return collator().getSortKey(text)
+
+def fold_key(text):
+    "The folded form of a text, as stored in the folded columns. None for None."
+    if text is None:
+        return None
+    return prefixIndex.fold(text)
+
+def register(conn):
+    "SQL functions icu_sort_key(text) and fold_key(text) on this connection, for the key updates and for ad hoc orderings."
+    conn.create_function("icu_sort_key", 1, sort_key, deterministic=True)
+    conn.create_function("fold_key", 1, fold_key, deterministic=True)
+
+def fill_missing(conn, rebuild=False):
+    """ computes the keys that are NULL (all of them if rebuild). Returns the number of rows updated.
+    Without rebuild, nothing is locked if no key is missing, and a locked or read-only database is
+    left alone: its keys are filled on a later start.
+    """
+    register(conn)
+    keys = [(tablename, columns, "icu_sort_key") for tablename, columns in SORT_KEYS.items()] + \
+        [(tablename, columns, "fold_key") for tablename, columns in FOLD_KEYS.items()]
+    count = 0
+    try:
+        updates = []
+        for tablename, columns, function in keys:
+            table_columns = [row[1] for row in conn.execute("PRAGMA table_info(" + tablename + ")")]
+            for column, key_column in columns:
+                if column not in table_columns or key_column not in table_columns:  # an older table without the column
+                    continue
+                sqlQuery = "UPDATE " + tablename + " SET " + key_column + " = " + function + "(" + column + ")"
+                if not rebuild:
+                    sqlWhere = " WHERE " + key_column + " IS NULL AND " + column + " IS NOT NULL"
+                    if not conn.execute("SELECT EXISTS ( SELECT id FROM " + tablename + sqlWhere + " )").fetchone()[0]:
+                        continue
+                    sqlQuery += sqlWhere
+                updates.append(sqlQuery)
+        if updates:
+            with dbLocking.write_transaction(conn, interactive=False):
+                for sqlQuery in updates:
+                    count += conn.execute(sqlQuery).rowcount
+    except sqlite3.OperationalError as e:
+        if rebuild or not any(reason in str(e) for reason in ("locked", "busy", "readonly")):
+            raise
+        return 0    # locked for longer than BUSY_TIMEOUT, or read only
+    return count
+
+
+def main():
+    conn = sqlite3.connect(config.dataPath + config.dbname)
+    count = fill_missing(conn, rebuild=True)
+    conn.close()
+    print("Sort keys rebuilt for locale " + config.COLLATION_LOCALE + ": " + str(count) + " rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,8 +14,6 @@
 import json
 import os
 import platform
-import subprocess
-import sys
 
 SCREENWIDTH = 80        # Intended/enforced screen width
 AUTHENTICATE = True    # Ask for user identification at program startup.  
@@ -35,38 +33,29 @@ elif system == "Linux":
 pname = "optidrome"     # program name
 dbname = pname + ".db"
 
-# Program version: from git cmd or previously created json file
-try:
-    program_version = subprocess.run(["git", "describe", "--tags", "--abbrev=0"], \
-        capture_output=True, text=True).stdout.strip('\n')[:4]
-except FileNotFoundError:
-    program_version = ""
-
-filename = dataPath + "program.json"
-if program_version != "":   # it's a git repository
-    data = {'program': [ {'version' : program_version} ] }
-    json_string = json.dumps( data )
-    try:
-        with open(filename, 'w') as outfile:
-            outfile.write(json_string)  # we'll write the json now
-    except Exception as e:
-        print("\n" + pname + ": " + str(e) ,"Error")
-        sys.exit()                
-else:   # it's not a git repository, so we read from the json file   
-    try:
-        with open(filename) as json_file:
-            data = json.load(json_file)
-            program_version = data['program'][0]['version']
-    except FileNotFoundError:
-        print("\n " + pname + ": " + filename + " was not found.\n")
-        sys.exit()                
+# Program version: written into this json file at build/install time by programVersion.py,
+# read the first time config.program_version is used (see __getattr__ below)
+versionFilename = dataPath + "program.json"
+_program_version = None
+
+def __getattr__(name):
+    "Module attributes computed on first use: program_version."
+    global _program_version
+    if name != "program_version":
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    if _program_version is None:
+        try:
+            with open(versionFilename) as json_file:
+                _program_version = json.load(json_file)['program'][0]['version']
+        except FileNotFoundError:   # a working copy where programVersion.py wasn't run: ask git, don't write
+            import programVersion
+            _program_version = programVersion.git_version()
+    return _program_version
 
 parentApp = None        # It's the npyscreen.NPSAppManaged in memory
 conn = None             # DB Connection
-fileRows = None         # DB record-row list, includes id
-fileRow = None          # Current record-row, includes id; same structure as fileRows
-currentRow = 0          # Currently selected record-row Numeral field
-screenRow = None        # Selected row number/index in the grid
+
+# The selectors' rows and selected records are in their row sets (see rowSetCache.py)
 
 dateFormat = "mm/dd/yy"             # currently accepted format (accepted formats below)
 dateTimeFormat = "mm-dd-yy hh:MM"   # currently accepted format
@@ -78,7 +67,6 @@ datetimeAcceptedFormats = ["dd-mm-yy hh:MM", "dd/mm/yy hh:MM", "dd-mm-yyyy hh:MM
                         "mm-dd-yy hh:MM", "mm/dd/yy hh:MM", "mm-dd-yyyy hh:MM", "mm/dd/yyyy hh:MM"]
 timeAcceptedFormats = ["hh:MM:ss"]
 
-last_table = None       # to read table when entering from main menu
 last_operation = None
 
 decimal_symbol = "."    # can be "." or ","
@@ -108,8 +96,23 @@ orderPaymentStatusList = ["Paid", "Unpaid", "Refunded", "Other"]
 #            "Hardcover with dust jacket"]
 
 REMEMBER_SUBSET = True  # remember the last found subset
+ROW_SET_CACHE = 8       # Find subsets the selectors keep between visits (rowSetCache.py)
+CHANGE_LOG_KEEP = 100000    # record changes kept in the change log at startup (changeLog.py)
+VALUE_LIST_CACHE = 2000000  # chooser values kept between record forms, all the lists together (valueLists.py)
+PREFIX_INDEX_CACHE = 8  # chooser value lists whose prefix index is kept (prefixIndex.py)
+TYPE_AHEAD_LIMIT = 100  # names a type-ahead chooser reads per lookup (typeAhead.py)
+TYPE_AHEAD_DELAY = 150  # ms a type-ahead chooser waits for the next key before a lookup
+GRID_POLL = 20          # tenths of a second idle before a selector shows other terminals' changes; None = never
 REMEMBER_FILTERS = False  # remember the last listing filter subset
 
+GRID_PAGE_SIZE = 200    # selector grids read the full set from the DB in pages of these rows...
+GRID_MAX_PAGES = 10     # ...and keep only this many pages in memory
+WAL_MODE = True         # WAL journal + short Save transactions; False = EXCLUSIVE lock while a record form is open
+BUSY_TIMEOUT = 10       # seconds a DB access waits for another terminal's write before "Database is locked"
+FTS_FIND = True         # selectors' Find through an FTS5 full-text index, when SQLite has it
+COLLATION_LOCALE = "en_US"   # ICU locale of the names' stored sort keys: the same for every terminal, not the system one
+PREWARM_FORMS = True    # forms are built on first use; True = build the likely next ones while the main menu is idle
+
 gender_neutral_pronoun = "(S)he"   # (S)he , She/he, He/She , They, Ze, Zir
 
 normal_exit_message = "Program exited normally."
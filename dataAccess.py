@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     dataAccess.py - One class per DB table: its statements and its rows
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# A table object builds its SQL strings once, when it is created, so every
+# query of a selector or form is the very same string every time and
+# sqlite3 reuses its compiled statement from the connection's statement
+# cache (dbLocking.STATEMENT_CACHE) instead of parsing it again.
+# Rows come as namedtuples: no copies into lists, indexed like the old
+# tuples (row[1]) and by column name (row.mrn). The row type is made from
+# the query's columns the first time it runs.
+#   patients = dataAccess.PatientTable()                  # SELECT * rows
+#   grid = dataAccess.PatientTable(["id", "mrn", "name"]) # only those columns
+#   row = patients.by_key(1042)
+##############################################################################
+
+import sqlite3
+from collections import namedtuple
+
+import bsWidgets as bs
+import config
+
+
+class Table():
+    "The statements and row type of a table, or of some of its columns."
+    tablename = None    # like "'optidrome.patient'"
+    key = None          # unique key column, like "mrn": the selectors' order
+
+    def __init__(self, columns=None):
+        self.columns = columns     # None = all of them, in table order
+        key, tablename = self.key, self.tablename
+        self.select = "SELECT " + ("*" if columns is None else ", ".join(columns)) + " FROM " + tablename
+        self.sqlByKey = self.select + " WHERE " + key + " = ?"
+        self.sqlById = self.select + " WHERE id = ?"
+        self.sqlCount = "SELECT COUNT(*) FROM " + tablename
+        # Keyset pages, for rowSource.PagedRowSource
+        self.sqlFirstPage = self.select + " ORDER BY " + key + " LIMIT ?"
+        self.sqlPageAfter = self.select + " WHERE " + key + " > ? ORDER BY " + key + " LIMIT ?"
+        self.sqlPageFrom = self.select + " WHERE " + key + " >= ? ORDER BY " + key + " LIMIT ?"
+        self.sqlPageBefore = self.select + " WHERE " + key + " < ? ORDER BY " + key + " DESC LIMIT ?"
+        self.sqlLastPage = self.select + " ORDER BY " + key + " DESC LIMIT ?"
+        self.sqlKeyAt = "SELECT " + key + " FROM " + tablename + " ORDER BY " + key + " LIMIT 1 OFFSET ?"
+        # Positions, for rowSource.PagedRowSource: the keys at every n-th position ("fences"), in one pass of the key
+        # index, and the rows between a fence and a key, if the key exists
+        self.sqlFences = "SELECT " + key + " FROM (SELECT " + key + ", ROW_NUMBER() OVER (ORDER BY " + key + ") - 1 AS position " + \
+            "FROM " + tablename + ") WHERE position % ? = 0"
+        self.sqlPositionFrom = "SELECT (SELECT COUNT(*) FROM " + tablename + " WHERE " + key + " >= ? AND " + key + " < ?) FROM " + \
+            tablename + " WHERE " + key + " = ?"
+        self.sqlKeyOfKey = "SELECT " + key + " FROM " + tablename + " WHERE " + key + " = ?"
+        self.sqlKeyOfId = "SELECT " + key + " FROM " + tablename + " WHERE id = ?"
+        self.Row = None     # the namedtuple of the rows, made by the first query
+
+    def row_factory(self, cursor, row):
+        "sqlite3 row factory: the row as a Row namedtuple."
+        if self.Row is None or len(row) != len(self.Row._fields):   # first query, or the table got new columns
+            name = type(self).__name__.replace("Table", "") + "Row"
+            self.Row = namedtuple(name, [description[0] for description in cursor.description], rename=True)
+            self.make_row = self.Row._make
+        return self.make_row(row)
+
+    def execute(self, sqlQuery, values=(), rows=True):
+        "Runs a query with the usual multiuser DB locking loop. Returns a cursor, of Rows if rows."
+        cur = config.conn.cursor()
+        if rows:
+            cur.row_factory = self.row_factory
+        while True:     # multiuser DB locking loop
+            try:
+                cur.execute(sqlQuery, values)
+                return cur
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):     # a wrong query, like a Find literal
+                    raise
+                bs.notify_OK("\n    Database is locked, please wait.", "Message")
+
+    def fetch(self, sqlQuery, values=()):
+        "All the Rows of a query."
+        return self.execute(sqlQuery, values).fetchall()
+
+    def scalar(self, sqlQuery, values=()):
+        "The first value of the first row, None if there's no row."
+        row = self.execute(sqlQuery, values, rows=False).fetchone()
+        return None if row is None else row[0]
+
+    def find(self, whereStr, values=()):
+        "The Rows of a selector Find: whereStr goes after WHERE (and may end with ORDER BY)."
+        return self.fetch(self.select + " WHERE " + whereStr, values)
+
+    def by_key(self, key):
+        "The Row of a key, None if it doesn't exist."
+        return self.execute(self.sqlByKey, (key,)).fetchone()
+
+    def by_id(self, id):
+        return self.execute(self.sqlById, (id,)).fetchone()
+
+    def count(self):
+        return self.scalar(self.sqlCount)
+
+
+class UserTable(Table):
+    tablename = "'optidrome.user'"
+    key = "numeral"
+
+class PatientTable(Table):
+    tablename = "'optidrome.patient'"
+    key = "mrn"
+
+class PrescriptionTable(Table):
+    tablename = "'optidrome.prescription'"
+    key = "rx_num"
+
+class VendorTable(Table):
+    tablename = "'optidrome.vendor'"
+    key = "vendor_num"
+
+class FrameTable(Table):
+    tablename = "'optidrome.frame'"
+    key = "sku"
+
+class LensTable(Table):
+    tablename = "'optidrome.lens'"
+    key = "sku"
+
+class RxOrderTable(Table):
+    tablename = "'optidrome.rxorder'"
+    key = "job"
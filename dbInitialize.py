@@ -9,15 +9,27 @@
 # Licensed under the New BSD License
 # (http://www.freebsd.org/copyright/freebsd-license.html)
 ##############################################################################
+# The schema is versioned: PRAGMA user_version holds the number of the last
+# migration applied to a database, and migrate() applies the missing ones in
+# order, each one in its own transaction. The program calls migrate() at
+# startup, so an old Data/optidrome.db catches up on its own.
+#   python dbInitialize.py            -> build a new database
+#   python dbInitialize.py --migrate  -> bring an existing database up to date
+#   python dbInitialize.py --plans    -> query plans of the program's queries,
+#                                        before and after the migrations
+##############################################################################
 
+import argparse
 import datetime
 import sqlite3
 from sqlite3 import Error
+import sys
 import time
 
 import base64
 
 import bsWidgets as bs
+import changeLog
 import config
 
 DATEFORMAT = "%Y-%m-%d %H:%M:%S"
@@ -43,11 +55,8 @@ def create_table(conn, create_table_sql):
     :param create_table_sql: a CREATE TABLE statement
     :return:
     """
-    try:
-        c = conn.cursor()
-        c.execute(create_table_sql)
-    except Error as e:
-        print(e)
+    c = conn.cursor()
+    c.execute(create_table_sql)     # errors go up: the migration is rolled back
 
 
 def create_user(conn):
@@ -57,20 +66,16 @@ def create_user(conn):
     :param user:
     :return: user id
     """
-    try:
-        raw_password = '1234'
-        password = base64.b64encode(raw_password.encode('utf-8')).decode('utf-8')
-        numeral = 1
-        user_name = 'Admin'
-        user = 'admin'
-        user_level = 1
-        creation_date = datetime.datetime.now().strftime(DATEFORMAT)
-        user_data = [(numeral, user, user_name, user_level, creation_date, password)]
-        c = conn.cursor()
-        c.executemany('INSERT INTO "optidrome.user" (numeral,user,user_name,user_level,creation_date,password) VALUES (?,?,?,?,?,?) ', user_data)
-        conn.commit()
-    except Error as e:
-        print(e)
+    raw_password = '1234'
+    password = base64.b64encode(raw_password.encode('utf-8')).decode('utf-8')
+    numeral = 1
+    user_name = 'Admin'
+    user = 'admin'
+    user_level = 1
+    creation_date = datetime.datetime.now().strftime(DATEFORMAT)
+    user_data = [(numeral, user, user_name, user_level, creation_date, password)]
+    c = conn.cursor()
+    c.executemany('INSERT INTO "optidrome.user" (numeral,user,user_name,user_level,creation_date,password) VALUES (?,?,?,?,?,?) ', user_data)
 
 
 def create_patient(conn):
@@ -80,20 +85,16 @@ def create_patient(conn):
     :param patient:
     :return: patient id
     """
-    try:
-        mrn = 1
-        name = 'John Doe'
-        dob = '1970-01-01'
-        phone = '123-456-7890'
-        email = 'johndoe@notmail.co'
-        address = '123 Main St'
-        notes = 'None'
-        patient_data = [(mrn, name, dob, phone, email, address, notes)]
-        c = conn.cursor()
-        c.executemany('INSERT INTO "optidrome.patient" (mrn,name,dob,phone,email,address,notes) VALUES (?,?,?,?,?,?,?) ', patient_data)
-        conn.commit()
-    except Error as e:
-        print(e)
+    mrn = 1
+    name = 'John Doe'
+    dob = '1970-01-01'
+    phone = '123-456-7890'
+    email = 'johndoe@notmail.co'
+    address = '123 Main St'
+    notes = 'None'
+    patient_data = [(mrn, name, dob, phone, email, address, notes)]
+    c = conn.cursor()
+    c.executemany('INSERT INTO "optidrome.patient" (mrn,name,dob,phone,email,address,notes) VALUES (?,?,?,?,?,?,?) ', patient_data)
 
 
 def create_rxorder(conn):
@@ -103,23 +104,22 @@ def create_rxorder(conn):
     :param rxorder:
     :return: rxorder id
     """
-    try:
-        job = 1
-        patient_mrn = 1
-        patient_name = 'John Doe'
-        creation_date = datetime.datetime.now().strftime(DATEFORMAT)
-        rxorder_data = [(job, patient_mrn, patient_name, creation_date)]
-        c = conn.cursor()
-        c.executemany('INSERT INTO "optidrome.rxorder" (job, patient_mrn, patient_name, creation_date) VALUES (?,?,?,?) ', rxorder_data)
-        conn.commit()
-    except Error as e:
-        print(e)
-
+    job = 1
+    patient_mrn = 1
+    patient_name = 'John Doe'
+    creation_date = datetime.datetime.now().strftime(DATEFORMAT)
+    rxorder_data = [(job, patient_mrn, patient_name, creation_date)]
+    c = conn.cursor()
+    c.executemany('INSERT INTO "optidrome.rxorder" (job, patient_mrn, patient_name, creation_date) VALUES (?,?,?,?) ', rxorder_data)
 
-def main():
 
+def create_tables(conn):
+    """ create the tables of a new database, if they don't exist
+    :param conn: Connection object
+    :return:
+    """
     sql_create_user_table = """
-    CREATE TABLE "optidrome.user" (
+    CREATE TABLE IF NOT EXISTS "optidrome.user" (
         "id"	INTEGER NOT NULL UNIQUE,
         "numeral"	INTEGER NOT NULL UNIQUE,
         "user"	TEXT NOT NULL UNIQUE,
@@ -274,22 +274,189 @@ def main():
         FOREIGN KEY ("origin_lab") REFERENCES "optidrome.lens"("origin_lab_num")
     ); """
 
+    create_table(conn, sql_create_user_table)
+    create_table(conn, sql_create_patient_table)
+    create_table(conn, sql_create_prescription_table)
+    create_table(conn, sql_create_vendor_table)
+    create_table(conn, sql_create_frame_table)
+    create_table(conn, sql_create_lens_table)
+    create_table(conn, sql_create_rxorder_table)
+
+
+def table_columns(conn, tablename):
+    """ column names of a table, [] if it doesn't exist """
+    return [row[1] for row in conn.execute("PRAGMA table_info(" + tablename + ")")]
+
+
+def status_column(conn):
+    """ the order status column: "status" in new databases, "order_status" in older ones """
+    if "status" in table_columns(conn, "'optidrome.rxorder'"):
+        return "status"
+    return "order_status"
+
+
+def create_indexes(conn):
+    """ secondary indexes for the columns the program filters and sorts on
+    :param conn: Connection object
+    :return:
+    """
+    indexes = [ ("optidrome.patient_name", "'optidrome.patient'", "name"),
+                ("optidrome.rxorder_patient_mrn", "'optidrome.rxorder'", "patient_mrn"),
+                ("optidrome.rxorder_creation_date", "'optidrome.rxorder'", "creation_date"),
+                ("optidrome.rxorder_status", "'optidrome.rxorder'", status_column(conn)),
+                ("optidrome.prescription_patient_mrn", "'optidrome.prescription'", "patient_mrn")
+                ]
+    for index_name, tablename, column in indexes:
+        if column in table_columns(conn, tablename):
+            conn.execute('CREATE INDEX IF NOT EXISTS "' + index_name + '" ON ' + tablename + ' ("' + column + '")')
+
+
+def add_row_versions(conn):
+    """ row_version column for the optimistic Updates of the record forms
+    :param conn: Connection object
+    :return:
+    """
+    for tablename in ("'optidrome.user'", "'optidrome.patient'", "'optidrome.prescription'", "'optidrome.rxorder'"):
+        columns = table_columns(conn, tablename)
+        if columns and "row_version" not in columns:
+            conn.execute("ALTER TABLE " + tablename + ' ADD COLUMN "row_version" INTEGER NOT NULL DEFAULT 0')
+
+
+def add_sort_keys(conn):
+    """ indexed ICU sort key columns for the sortable names (see collation.py)
+    :param conn: Connection object
+    :return:
+    """
+    keys = [("'optidrome.patient'", "name_key", "optidrome.patient_name_key"),
+            ("'optidrome.rxorder'", "patient_name_key", "optidrome.rxorder_patient_name_key")
+            ]
+    for tablename, key_column, index_name in keys:
+        columns = table_columns(conn, tablename)
+        if columns and key_column not in columns:
+            conn.execute("ALTER TABLE " + tablename + ' ADD COLUMN "' + key_column + '" BLOB')
+        if columns:
+            conn.execute('CREATE INDEX IF NOT EXISTS "' + index_name + '" ON ' + tablename + ' ("' + key_column + '")')
+
+
+def add_fold_keys(conn):
+    """ folded name column for the type-ahead choosers, indexed with the sort key (see collation.py, typeAhead.py)
+    :param conn: Connection object
+    :return:
+    """
+    columns = table_columns(conn, "'optidrome.patient'")
+    if columns and "name_fold" not in columns:
+        conn.execute("ALTER TABLE 'optidrome.patient' ADD COLUMN \"name_fold\" TEXT")
+    if columns:
+        conn.execute('CREATE INDEX IF NOT EXISTS "optidrome.patient_name_fold" ON \'optidrome.patient\' ("name_fold", "name_key")')
+
+
+# Schema migrations: (user_version, description, function). Append only, never renumber.
+MIGRATIONS = [  (1, "Base tables", create_tables),
+                (2, "Secondary indexes", create_indexes),
+                (3, "Row versions", add_row_versions),
+                (4, "Sort keys", add_sort_keys),
+                (5, "Change log", changeLog.create),
+                (6, "Type-ahead keys", add_fold_keys)
+                ]
+
+
+def schema_version(conn):
+    """ the last migration applied to the database """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """ apply the missing migrations, each one in a transaction
+    :param conn: Connection object
+    :return: list of the applied migration numbers
+    """
+    applied = []
+    for version, description, function in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            function(conn)
+            conn.execute("PRAGMA user_version = " + str(int(version)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def app_queries(conn):
+    """ the program's hot queries, for the query plan report """
+    return [("Patient grid page", "SELECT * FROM 'optidrome.patient' WHERE mrn > ? ORDER BY mrn LIMIT ?"),
+            ("Order grid page", "SELECT * FROM 'optidrome.rxorder' WHERE job > ? ORDER BY job LIMIT ?"),
+            ("Patient by name", "SELECT id, mrn, name FROM 'optidrome.patient' WHERE name=?"),
+            ("Orders of a patient", "SELECT id FROM 'optidrome.rxorder' WHERE patient_mrn = ?"),
+            ("Patient MRN change", "UPDATE 'optidrome.rxorder' SET patient_mrn=? WHERE patient_mrn=?"),
+            ("Orders since a date", "SELECT * FROM 'optidrome.rxorder' WHERE creation_date >= ? ORDER BY creation_date"),
+            ("Orders by status", "SELECT * FROM 'optidrome.rxorder' WHERE " + status_column(conn) + " = ?"),
+            ("Patients by name", "SELECT name FROM 'optidrome.patient' ORDER BY name_key"),
+            ("Patient names by prefix", "SELECT name FROM 'optidrome.patient' WHERE name_fold >= ? AND name_fold < ? " \
+                "ORDER BY name_fold, name_key LIMIT ?"),
+            ("Prescriptions of a patient", "SELECT * FROM 'optidrome.prescription' WHERE patient_mrn = ?")
+            ]
+
+
+def query_plans(conn):
+    """ EXPLAIN QUERY PLAN of every app query, as report lines """
+    lines = []
+    for title, sqlQuery in app_queries(conn):
+        lines.append("  " + title + ":  " + sqlQuery)
+        try:
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sqlQuery, (None,) * sqlQuery.count("?")):
+                lines.append("      " + row[3])
+        except sqlite3.OperationalError as e:   # like a table missing in this database
+            lines.append("      " + str(e))
+    return lines
+
+
+def query_plan_report(conn):
+    """ query plans before and after the migrations, on an in-memory copy of the database """
+    copy = sqlite3.connect(":memory:")
+    conn.backup(copy)
+    report = ["Query plans - schema version " + str(schema_version(copy))]
+    report += query_plans(copy)
+    applied = migrate(copy)
+    report.append("")
+    report.append("Query plans - schema version " + str(schema_version(copy)) + \
+        " (migrations applied: " + (", ".join(str(n) for n in applied) or "none") + ")")
+    report += query_plans(copy)
+    copy.close()
+    return "\n".join(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or migrate the " + config.pname + " database.")
+    parser.add_argument("--migrate", action="store_true", help="bring an existing database up to date")
+    parser.add_argument("--plans", action="store_true", help="print the query plans before and after the migrations")
+    args = parser.parse_args()
+
     conn = create_connection(db_file)
+    if conn is None:
+        print("Error! cannot create the database connection.")
+        sys.exit(1)
 
-    if conn is not None:
-        create_table(conn, sql_create_user_table)
-        create_table(conn, sql_create_patient_table)
-        create_table(conn, sql_create_prescription_table)
-        create_table(conn, sql_create_vendor_table)
-        create_table(conn, sql_create_frame_table)
-        create_table(conn, sql_create_lens_table)
-        create_table(conn, sql_create_rxorder_table)
-        create_user(conn)
-        create_patient(conn)
-        create_rxorder(conn)
-        conn.close()
+    if args.plans:
+        print(query_plan_report(conn))
+    elif args.migrate:
+        applied = migrate(conn)
+        print("Schema version " + str(schema_version(conn)) + ", applied: " + (", ".join(str(n) for n in applied) or "none"))
     else:
-        print("Error! cannot create the database connection.")
+        migrate(conn)
+        for create_sample in (create_user, create_patient, create_rxorder):
+            try:
+                with conn:      # each sample record in its own transaction
+                    create_sample(conn)
+            except sqlite3.IntegrityError as e:     # like one already there
+                print(create_sample.__name__ + ": sample record not added: " + str(e))
+    conn.close()
 
 
 if __name__ == '__main__':
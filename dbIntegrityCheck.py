@@ -12,28 +12,28 @@
 
 
 import curses
+import os
+import sqlite3
+import subprocess
+
 import npyscreen
 from npyscreen import wgwidget as widget
 import config
 import bsWidgets as bs
+import integrityCheck
 
-TAB = "\t"
-CR = "\n"
+CR = chr(curses.ascii.CR)
+LF = chr(curses.ascii.LF)
 
 helpText =  "Check database referential integrity:\n\n" \
-        "   1.For each book:\n" \
-        "       author must exist\n" \
-        "       publisher must exist\n" \
-        "       warehouse must exist\n" \
-        "   2.For each book_author:\n" \
-        "       book must exist\n" \
-        "       author must exist\n" \
-        "   3.For each book_warehouse:\n" \
-        "       book must exist\n" \
-        "       warehouse must exist\n" \
-        "   4.Check book_author duplicates\n" \
-        "   5.Check book_warehouse duplicates\n\n" \
-        " (Foreign keys' 'ON UPDATE' and 'ON DELETE' actions are disabled)"
+        "   1.Every order's patient, frame and lens must exist\n" \
+        "   2.Every prescription's order and patient must exist\n" \
+        "   3.Every frame's vendor and lens' lab must exist\n" \
+        "   4.Patient names copied into orders and prescriptions\n" \
+        "     must match the patient's\n\n" \
+        " Findings are written into a report in the /Reports folder;\n" \
+        " nothing is changed in the database.\n" \
+        " Also from the command line: python integrityCheck.py --help"
 
 
 class DBintegrityCheckForm(npyscreen.FormBaseNew):
@@ -81,161 +81,25 @@ class DBintegrityCheckForm(npyscreen.FormBaseNew):
         curses.beep()
 
     def checkIntegrity(self):
-        "Check database referential integrity."
-        """ 1.For each book:
-                author must exist
-                publisher must exist
-                warehouses must exist
-            2.For each book_author:
-                book must exist
-                author must exist
-            3.For each book_warehouse:
-                book must exist
-                warehouse must exist
-            4.Check book_author duplicates
-            5.Check book_warehouse duplicates
-        """
-        message = "   Do you want to check database now?\n   (it can take some time to complete)\n"
-        if not bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
-            return      # to the utilities menu
-
-        # 1.Check book -> book_author -> author
-        #       book -> publisher
-        #       book -> book_warehouse -> warehouse
-        bs.notify("\n    Checking book -> book_author -> author\n" +
-                    "    Checking book -> publisher...\n", title="Message", form_color='STANDOUT', wrap=True, wide=False,)
-        conn = config.conn
-        cur = conn.cursor()
-        sqlQuery = "SELECT numeral, publisher_num FROM 'bookstore.book' ORDER BY id"
-        cur.execute(sqlQuery)
-        books = cur.fetchall()
-        for book in books:
-            sqlQuery = "SELECT author_num FROM 'bookstore.book_author' WHERE book_num=?"
-            try:
-                cur.execute(sqlQuery, (book[0],) )
-                authnum = cur.fetchone()[0]
-            except TypeError:
-                bs.notify_OK("\n     Book with numeral " + str(book[0]) + " has no assigned author. ", "Message")
-                continue
-            sqlQuery = "SELECT numeral, name FROM 'bookstore.author' WHERE numeral=?"
-            try:
-                cur.execute(sqlQuery, (authnum,) )
-                authnum = cur.fetchone()[0]
-            except TypeError:
-                bs.notify_OK("\n     Author of book with numeral " + str(book[0]) + " was not found. ", "Message")
-                continue
-            sqlQuery = "SELECT numeral, name FROM 'bookstore.publisher' WHERE numeral=?"
-            try:
-                cur.execute(sqlQuery, (book[1],) )
-                publnum = cur.fetchone()[0]
-            except TypeError:
-                bs.notify_OK("\n     Publisher of book with numeral " + str(book[0]) + " was not found. ", "Message")
-                continue
-        bs.notify("\n  Checking book -> book_warehouse -> warehouse...", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        for book in books:
-            sqlQuery = "SELECT warehouse_num FROM 'bookstore.book_warehouse' WHERE book_num=?"
-            cur.execute(sqlQuery, (book[0],) )
-            warehouses_book = cur.fetchall()
-            if len(warehouses_book) == 0:
-                bs.notify_OK("\n  Book with numeral " + str(book[0]) + " has no assigned warehouse. ", "Message")
-                continue
-            for warehouse_book in warehouses_book:
-                sqlQuery = "SELECT numeral, code FROM 'bookstore.warehouse' WHERE numeral=?"
-                try:
-                    cur.execute(sqlQuery, (warehouse_book[0],) )
-                    whnum = cur.fetchone()[0]
-                except TypeError:
-                    bs.notify_OK("\n Warehouse of book with numeral " + str(book[0]) + " was not found. ", "Message")
-                    continue
-        # 2.Check book_author -> book
-        #         book_author -> author
-        bs.notify("\n  Checking book_author -> book\n" + 
-                    "  Checking book_author -> author...", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        sqlQuery = "SELECT id, book_num, author_num FROM 'bookstore.book_author' ORDER BY id"
-        cur.execute(sqlQuery)
-        books_authors = cur.fetchall()
-        for book_author in books_authors:
-            sqlQuery = "SELECT numeral FROM 'bookstore.book' WHERE numeral=?"
-            try:
-                cur.execute(sqlQuery, (book_author[1],) )
-                bknum = cur.fetchone()[0]
-            except TypeError:
-                bs.notify_OK("\n  Book in book_author with id=" + str(book_author[0]) + " was not found. ", "Message")
-                continue
-            sqlQuery = "SELECT numeral FROM 'bookstore.author' WHERE numeral=?"
-            try:
-                cur.execute(sqlQuery, (book_author[2],) )
-                authnum = cur.fetchone()[0]
-            except TypeError:
-                bs.notify_OK("\n  Author in book_author with id=" + str(book_author[0]) + " was not found. ", "Message")
-                continue
-        # 3.Check book_warehouse -> book
-        #         book_warehouse -> warehouse
-        bs.notify("\n  Checking book_warehouse -> book\n" + 
-                    "  Checking book_warehouse -> warehouse...", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        sqlQuery = "SELECT id, book_num, warehouse_num FROM 'bookstore.book_warehouse' ORDER BY id"
-        cur.execute(sqlQuery)
-        books_warehouses = cur.fetchall()
-        for book_warehouse in books_warehouses:
-            sqlQuery = "SELECT numeral FROM 'bookstore.book' WHERE numeral=?"
-            try:
-                cur.execute(sqlQuery, (book_warehouse[1],) )
-                bknum = cur.fetchone()[0]
-            except TypeError:
-                bs.notify_OK("\n  Book in book_warehouse with id=" + str(book_author[0]) + " was not found. ", "Message")
-                continue
-            sqlQuery = "SELECT numeral FROM 'bookstore.warehouse' WHERE numeral=?"
-            try:
-                cur.execute(sqlQuery, (book_warehouse[2],) )
-                whnum = cur.fetchone()[0]
-            except TypeError:
-                bs.notify_OK("\n  Warehouse in book_warehouse with id=" + str(book_author[0]) + " was not found. ", "Message")
-                continue
-        # 4.Check book_author duplicates
-        bs.notify("\n  Checking book_author duplicates...", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        sqlQuery = "SELECT id, book_num FROM 'bookstore.book_author' ORDER BY book_num"
-        cur.execute(sqlQuery)
-        books_authors = cur.fetchall()
-        last_book = None
-        for book_author in books_authors:
-            if last_book == None:
-                last_book = book_author[1]
-            else:
-                if book_author[1] == last_book:
-                    bs.notify_OK("\n  Book in book_author with id=" + str(book_author[0]) + " is duplicated.\n" + 
-                                   "  (Duplicated record will be deleted)", "Message")
-                    sqlQuery = "DELETE FROM 'bookstore.book_author' WHERE id=?"
-                    cur.execute(sqlQuery, (book_author[0], ) )
-                    conn.commit()
-                    continue
-                else:
-                    last_book = book_author[1]
-        # 5.Check book_warehouse duplicates
-        bs.notify("\n  Checking book_warehouse duplicates...", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        sqlQuery = "SELECT id, book_num, warehouse_num FROM 'bookstore.book_warehouse' ORDER BY book_num, warehouse_num"
-        cur.execute(sqlQuery)
-        books_warehouses = cur.fetchall()
-        last_book = None
-        last_warehouse = None
-        for book_warehouse in books_warehouses:
-            if last_book == None:
-                last_book = book_warehouse[1]
-                last_warehouse = book_warehouse[2]
-                continue
-            else:
-                if book_warehouse[1] == last_book:
-                    if book_warehouse[2] == last_warehouse:
-                        bs.notify_OK("\n  Book in book_warehouse with id=" + str(book_warehouse[0]) + " is duplicated.\n" + 
-                                       "  (Duplicated record will be deleted)", "Message")
-                        sqlQuery = "DELETE FROM 'bookstore.book_warehouse' WHERE id=?"
-                        cur.execute(sqlQuery, (book_warehouse[0],) )
-                        conn.commit()
-                        continue
-                else:
-                    last_book = book_warehouse[1]
-                    last_warehouse = book_warehouse[2]
-
-        bs.notify_OK("\n     Database integrity check finished.\n", "Message")
+        "Check database referential integrity: one query per relation, findings into a report file."
+        bs.notify("\n    Checking database integrity...\n", title="Message", form_color='STANDOUT', wrap=True, wide=False,)
+        filename = integrityCheck.report_filename("Text")
+        try:
+            summary = integrityCheck.check_database(config.conn, filename, newline=CR + LF)
+        except sqlite3.OperationalError as e:
+            bs.notify_OK("\n    sqlite3.OperationalError: \n"+str(e),"Message", form_color='STANDOUT', wrap=True, wide=False)
+            return
+        except FileNotFoundError:
+            self.error_message("The report directory does not exist.")
+            return
+
+        total = sum(count for count in summary.values() if count)
+        message = "\n  " + "\n  ".join(integrityCheck.summary_lines(summary)) + "\n\n  " + str(total) + " problems found."
+        if total == 0:
+            bs.notify_OK(message, "Database integrity check finished", wide=True)
+            os.remove(filename)
+        elif bs.notify_ok_cancel(message + "  View the report?", title="Database integrity check finished", wrap=True, editw = 1,):
+            subprocess.run([config.textViewer, filename])      # waits for completion (closing)
         self.exitDBintegrityCheck()
 
     def exitDBintegrityCheck(self):
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     dbLocking.py - Multiuser access to the shared SQLite database
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Two concurrency modes, chosen by config.WAL_MODE:
+#   - WAL (default): readers never wait for writers, nothing is locked while a
+#     record form is being edited, and every Save is one short write
+#     transaction. A busy writer makes the others wait up to BUSY_TIMEOUT
+#     seconds before the "Database is locked" message shows up.
+#   - Exclusive (the old way): opening a record form for C/U/D takes an
+#     EXCLUSIVE transaction that is released when the form is left.
+# Either way, Updates are optimistic: every row has a row_version that the
+# Save UPDATE compares and bumps, so a record saved by another terminal since
+# the form was opened is detected and shown field by field, not overwritten.
+##############################################################################
+
+import contextlib
+import sqlite3
+
+import bsWidgets as bs
+import config
+
+STATEMENT_CACHE = 256   # compiled statements kept per connection: the dataAccess tables' ones, and the rest
+
+
+def connect(filename):
+    "Opens a DB connection set up for the configured concurrency mode."
+    conn = sqlite3.connect(filename, timeout=config.BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE)
+    if config.WAL_MODE:
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")   # persistent: stored in the DB file
+        except sqlite3.OperationalError:    # another terminal is switching it right now
+            pass
+        conn.execute("PRAGMA synchronous = NORMAL") # safe with WAL, and much cheaper commits
+    return conn
+
+def lock_for_editing(conn, create=False):
+    "Called when a record form opens for Create/Update/Delete."
+    if config.WAL_MODE:
+        return  # nothing is held while the user types
+    while True:     # multiuser DB locking loop
+        try:
+            conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite only allows a single writer per database
+            if create:
+                conn.execute('PRAGMA locking_mode = EXCLUSIVE')
+            conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+            break
+        except sqlite3.OperationalError:
+            bs.notify_OK("\n    Database is locked, please wait.", "Message")
+
+def end_editing(parentApp):
+    "Called when a record form is left: releases whatever lock_for_editing() took."
+    if config.WAL_MODE:
+        if config.conn.in_transaction:
+            config.conn.rollback()  # nothing should be pending: every Save commits
+        return
+    # To unlock the database (for Create) we must disconnect and re-connect:
+    config.conn.close()
+    parentApp.connect_database()
+
+@contextlib.contextmanager
+def write_transaction(conn, interactive=True):
+    """ with write_transaction(conn): one short write transaction, committed at the end, rolled back on errors.
+    Without a screen (interactive=False), a database still locked after BUSY_TIMEOUT seconds raises OperationalError.
+    """
+    if not conn.in_transaction:     # in Exclusive mode, the form already holds the lock
+        while True:     # multiuser DB locking loop, after BUSY_TIMEOUT seconds of waiting
+            try:
+                conn.execute("BEGIN IMMEDIATE")     # take the write lock now, not halfway
+                break
+            except sqlite3.OperationalError:
+                if not interactive:
+                    raise
+                bs.notify_OK("\n    Database is locked, please wait.", "Message")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+VERSION_COLUMN = "row_version"  # added by dbInitialize migration 3
+
+
+class RowVersionConflict(Exception):
+    "The record was saved or deleted by another terminal since the form read it."
+
+
+def row_version(conn, tablename, id):
+    "Current version of a record, None if it doesn't exist anymore."
+    row = conn.execute("SELECT " + VERSION_COLUMN + " FROM " + tablename + " WHERE id = ?", (id,)).fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+def read_row(conn, tablename, id):
+    "Current record (SELECT * order, without its version) and its version; (None, None) if it was deleted."
+    cur = conn.execute("SELECT * FROM " + tablename + " WHERE id = ?", (id,))
+    row = cur.fetchone()
+    if row is None:
+        return None, None
+    columns = [d[0] for d in cur.description]
+    version = row[columns.index(VERSION_COLUMN)]
+    return [value for column, value in zip(columns, row) if column != VERSION_COLUMN], version
+
+def update_row(cur, tablename, columns, values, id, version):
+    "Compare-and-swap UPDATE: 'columns' like 'a=?, b=?' are only set if the row is still at 'version'."
+    sqlQuery = "UPDATE " + tablename + " SET " + columns + ", " + VERSION_COLUMN + " = " + VERSION_COLUMN + " + 1 " + \
+        "WHERE id = ? AND " + VERSION_COLUMN + " = ?"
+    cur.execute(sqlQuery, tuple(values) + (id, version))
+    if cur.rowcount == 0:   # someone else got there first
+        raise RowVersionConflict(tablename, id, version)
+    return version + 1
+
+def conflict_message(fields):
+    "Field-by-field report of a conflict. 'fields' is a list of (label, your value, saved value)."
+    lines = []
+    for label, mine, theirs in fields:
+        if make_differences_list(str(mine), str(theirs)):
+            lines.append("  " + label + "  yours: " + str(mine) + "  saved: " + str(theirs))
+    message = "\n  This record was saved by another terminal meanwhile.\n"
+    if lines:
+        message += "\n".join(lines) + "\n"
+    return message
+
+def make_differences_list(new_field, old_field):
+    "Accepts two comma-separated string-fields of values and returns a differences list like [new_value, -old_value]."
+    "For enumeration text fields."
+    diffList = []    # setting up a differences list
+    if new_field != old_field:  # there are changes 
+        oldList0 = list(old_field.split(","))
+        oldList = []
+        for c in oldList0:
+            if c != "": # extra commas do this
+              oldList.append(c.strip())
+        newList0 = list(new_field.split(","))
+        newList = []
+        for c in newList0:
+            if c != "": # extra commas do this
+                newList.append(c.strip())
+        for c in newList:
+            if c not in oldList:
+                try:
+                    diffList.append(int(c)) # is an int
+                except ValueError:
+                    try:
+                        diffList.append(float(c)) # is a float
+                    except ValueError:
+                        diffList.append(c) # is a string
+
+        for c in oldList:
+            if c not in newList:
+                try:
+                    diffList.append(0 - int(c)) # is an int
+                except ValueError:
+                    try:
+                        diffList.append(0 - float(c)) # is a float
+                    except ValueError:
+                        diffList.append("-" + c) # is a string: negative of a string!
+    return diffList
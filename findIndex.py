@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     findIndex.py - FTS5 full-text index behind the selectors' Find option
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Every indexed table gets an external-content FTS5 shadow table, named like
+# "optidrome.patient_fts", kept in sync by insert/update/delete triggers.
+# The trigram tokenizer matches any substring of 3+ characters, case
+# insensitive, so a MATCH finds the same rows as the old "LIKE '%x%'" scans
+# but through the index. Shorter literals, comparators and non-indexed
+# columns still go through LIKE in the selectors. A missing index is built
+# in one write transaction, checked again once the write lock is held, so
+# two terminals starting together don't both build it.
+##############################################################################
+
+import sqlite3
+
+import config
+import dbLocking
+
+# Indexed table -> its searchable text columns
+FTS_COLUMNS = {
+    "'optidrome.patient'": ["mrn", "name", "dob", "phone", "email", "address"],
+    "'optidrome.rxorder'": ["job", "patient_name", "notes"],
+}
+MIN_LITERAL = 3     # trigrams: shorter literals can't be matched
+
+indexed = set()     # tables with a working FTS index, set by set_up()
+
+
+def fts_tablename(tablename):
+    "'optidrome.patient' -> \"optidrome.patient_fts\" (double quoted: it goes into MATCH expressions)"
+    return '"' + tablename.strip("'") + '_fts"'
+
+def set_up(conn):
+    "Creates the missing FTS5 tables and their triggers. Returns False if this SQLite has no FTS5/trigram."
+    indexed.clear()
+    if not config.FTS_FIND:
+        return False
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.fts_probe")
+    except sqlite3.OperationalError:    # no fts5 module or no trigram tokenizer (SQLite < 3.34)
+        return False
+
+    for tablename, columns in FTS_COLUMNS.items():
+        if fts_exists(conn, tablename):
+            indexed.add(tablename)
+            continue
+        try:
+            with dbLocking.write_transaction(conn, interactive=False):  # the DDL and the first indexing, all or nothing
+                if not fts_exists(conn, tablename):     # another terminal may have built it meanwhile
+                    create(conn, tablename, columns)
+        except sqlite3.OperationalError:    # like a missing or locked table: Find will use LIKE, and it's built next time
+            continue
+        indexed.add(tablename)
+    return True
+
+def fts_exists(conn, tablename):
+    return conn.execute("SELECT EXISTS ( SELECT name FROM sqlite_schema WHERE type='table' AND name=? )", \
+        (fts_tablename(tablename).strip('"'),) ).fetchone()[0]
+
+def create(conn, tablename, columns):
+    "The FTS table of an indexed table, its triggers, and the index of the existing rows."
+    ftsname = fts_tablename(tablename)
+    colStr = ", ".join(columns)
+    newStr = ", ".join("new." + column for column in columns)
+    oldStr = ", ".join("old." + column for column in columns)
+    prefix = ftsname[:-1]   # for the trigger names
+    conn.execute("CREATE VIRTUAL TABLE " + ftsname + " USING fts5(" + colStr + ", content=" + tablename + \
+        ", content_rowid='id', tokenize='trigram')")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS " + prefix + '_ai"' + " AFTER INSERT ON " + tablename + " BEGIN " \
+        "INSERT INTO " + ftsname + " (rowid, " + colStr + ") VALUES (new.id, " + newStr + "); END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS " + prefix + '_ad"' + " AFTER DELETE ON " + tablename + " BEGIN " \
+        "INSERT INTO " + ftsname + " (" + ftsname + ", rowid, " + colStr + ") VALUES ('delete', old.id, " + oldStr + "); END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS " + prefix + '_au"' + " AFTER UPDATE ON " + tablename + " BEGIN " \
+        "INSERT INTO " + ftsname + " (" + ftsname + ", rowid, " + colStr + ") VALUES ('delete', old.id, " + oldStr + "); " \
+        "INSERT INTO " + ftsname + " (rowid, " + colStr + ") VALUES (new.id, " + newStr + "); END")
+    conn.execute("INSERT INTO " + ftsname + " (" + ftsname + ") VALUES ('rebuild')")   # index the existing rows
+
+def drop(conn, tablename):
+    "Drops the FTS table of an indexed table, and its triggers."
+    ftsname = fts_tablename(tablename)
+    prefix = ftsname[:-1]
+    try:
+        for suffix in ["_ai", "_ad", "_au"]:
+            conn.execute("DROP TRIGGER IF EXISTS " + prefix + suffix + '"')
+        conn.execute("DROP TABLE IF EXISTS " + ftsname)
+        conn.commit()
+    except sqlite3.OperationalError:
+        pass
+    indexed.discard(tablename)
+
+def can_match(tablename, literal, column=None):
+    "True if this Find can go through the FTS index."
+    if tablename not in indexed or len(literal) < MIN_LITERAL:
+        return False
+    return column is None or column in FTS_COLUMNS[tablename]
+
+def match_expression(literal, column=None):
+    "Find literal -> FTS5 MATCH string: a quoted phrase, optionally restricted to a column."
+    phrase = '"' + literal.replace('"', '""') + '"'     # no FTS operators from the user
+    if column is None:
+        return phrase
+    return column + " : " + phrase
+
+def where_clause(tablename, idfield="id"):
+    "The WHERE condition for a selector query; its parameter is a match_expression()."
+    ftsname = fts_tablename(tablename)
+    return idfield + " IN (SELECT rowid FROM " + ftsname + " WHERE " + ftsname + " MATCH ?)"
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     integrityCheck.py - Referential integrity of the optidrome database
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Every relation is checked with one set-based query: an anti-join of the
+# referencing rows against the unique key they point to (NOT EXISTS, served
+# by the key's unique index), so a check reads each table once whatever its
+# size. The findings are streamed into a report file (reportWriters formats)
+# and counted per check. Nothing is changed in the database.
+# Used by the "Check DB integrity" form, or headless:
+#     python integrityCheck.py [--format CSV] [--output file] [--db file]
+# The exit status is 1 when something was found, for scheduled runs.
+##############################################################################
+
+import argparse
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import config
+import reportWriters
+
+# Orphans: (check, referencing table, column, referenced table, key column). Empty references aren't orphans.
+ORPHAN_CHECKS = [
+    ("Order -> patient", "optidrome.rxorder", "patient_mrn", "optidrome.patient", "mrn"),
+    ("Order -> frame", "optidrome.rxorder", "frame_id", "optidrome.frame", "sku"),
+    ("Order -> lens", "optidrome.rxorder", "lens_id", "optidrome.lens", "sku"),
+    ("Prescription -> order", "optidrome.prescription", "rxorder_job", "optidrome.rxorder", "job"),
+    ("Prescription -> patient", "optidrome.prescription", "patient_mrn", "optidrome.patient", "mrn"),
+    ("Frame -> vendor", "optidrome.frame", "vendor_id", "optidrome.vendor", "vendor_num"),
+    ("Lens -> lab", "optidrome.lens", "origin_lab_num", "optidrome.vendor", "vendor_num"),
+]
+
+# Copied patient names that no longer match the patient's: (check, table). Joined by patient_mrn = mrn.
+NAME_CHECKS = [
+    ("Order patient name", "optidrome.rxorder"),
+    ("Prescription patient name", "optidrome.prescription"),
+]
+
+REPORT_COLUMNS = [("Check", 27), ("Table", 24), ("Id", 9), ("Value", 20)]
+
+
+def columns_of(conn, tablename):
+    return {row[0] for row in conn.execute("SELECT name FROM pragma_table_info(?)", (tablename,))}
+
+def check_queries(conn):
+    """ the queries of the checks that apply to this database
+    :return: [(check, table, sqlQuery)]; sqlQuery is None when a table or column doesn't exist
+    """
+    queries = []
+    for check, table, column, parent, key in ORPHAN_CHECKS:
+        sqlQuery = None
+        if column in columns_of(conn, table) and key in columns_of(conn, parent):
+            sqlQuery = 'SELECT c.id, c."' + column + '" FROM "' + table + '" AS c ' + \
+                'WHERE c."' + column + '" IS NOT NULL AND c."' + column + "\" != '' " + \
+                'AND NOT EXISTS (SELECT 1 FROM "' + parent + '" AS p WHERE p."' + key + '" = c."' + column + '")'
+        queries.append((check, table, sqlQuery))
+    for check, table in NAME_CHECKS:
+        sqlQuery = None
+        if {"patient_mrn", "patient_name"} <= columns_of(conn, table):
+            sqlQuery = 'SELECT c.id, c.patient_name FROM "' + table + '" AS c ' + \
+                'JOIN "optidrome.patient" AS p ON p.mrn = c.patient_mrn WHERE c.patient_name IS NOT p.name'
+        queries.append((check, table, sqlQuery))
+    return queries
+
+def findings(conn, summary):
+    """ the report rows of every check, as the cursors give them
+    :param summary: dict filled with {check: number of findings, None if skipped}, in check order
+    """
+    for check, table, sqlQuery in check_queries(conn):
+        summary[check] = None
+        if sqlQuery is None:
+            continue
+        count = 0
+        for id, value in conn.execute(sqlQuery):
+            count += 1
+            yield (check, table, id, value)
+        summary[check] = count
+
+def report_filename(format):
+    now = datetime.now().strftime('%Y%m%d%H%M%S.%f')[2:-7]
+    return config.dataPath + "Reports/integrity_check-" + now + reportWriters.WRITERS[format].extension
+
+def check_database(conn, filename, format="Text", newline="\n"):
+    """ runs all the checks, writing the findings into filename
+    :return: {check: number of findings, None if skipped}
+    """
+    summary = {}
+    reportWriters.write_report(filename, format, REPORT_COLUMNS, findings(conn, summary), newline)
+    return summary
+
+def summary_lines(summary):
+    lines = []
+    for check, count in summary.items():
+        lines.append(check.ljust(27) + ("skipped" if count is None else str(count)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the referential integrity of the " + config.pname + " database.")
+    parser.add_argument("--format", choices=list(reportWriters.WRITERS), default="Text", help="report format")
+    parser.add_argument("--output", help="report file (default: a new one in Data/Reports/)")
+    parser.add_argument("--db", default=config.dataPath + config.dbname, help="database file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(config.pname + ": " + args.db + " does not exist.")
+        sys.exit(2)
+    filename = args.output or report_filename(args.format)
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    conn = sqlite3.connect("file:" + args.db + "?mode=ro", uri=True)   # read only
+    summary = check_database(conn, filename, args.format)
+    conn.close()
+    print("\n".join(summary_lines(summary)))
+    total = sum(count for count in summary.values() if count)
+    print(str(total) + " problems found, report: " + filename)
+    sys.exit(1 if total else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     loadBenchmark.py - Timings of the program's DB work at growing sizes
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# For every size, a new database is filled by testData.py and the DB work
+# behind the forms is timed, without the screen:
+#   readDBTable     the selector grids' full set (count, first page, a jump
+#                   to the middle, End)
+#   read_record     a grid record by key: position_of_key() and its row
+# through the dataAccess tables and rowSource, as the selectors do:
+#   find_DB_rows    the selectors' Find, through the FTS index and by LIKE
+#   generateListing the orders listing by patient name, streamed into a
+#                   Text report through reportWriters
+#   integrityCheck  integrityCheck.check_database()
+# Every operation runs --repeat times; the median and the fastest run go
+# into a json report. With --baseline, the medians are compared with an
+# older report of the same sizes, and slower ones fail the run (exit 1):
+#   python loadBenchmark.py [--sizes 1000 100000 1000000] [--baseline old.json]
+##############################################################################
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import collation
+import config
+import dataAccess
+import dbInitialize
+import dbLocking
+import findIndex
+import integrityCheck
+import reportWriters
+import rowSource
+import testData
+
+SIZES = [1000, 100000, 1000000]
+REPEAT = 5
+KEYS_READ = 100         # read_record calls per run
+TOLERANCE = 1.25        # --baseline: a median this many times the old one is a regression
+
+PATIENT = "'optidrome.patient'"
+RXORDER = "'optidrome.rxorder'"
+PATIENT_GRID = dataAccess.PatientTable(["id", "mrn", "name", "dob", "phone", "email"])     # as in patientSelector
+PATIENTS = dataAccess.PatientTable()
+ORDERS = dataAccess.RxOrderTable()
+LISTING_COLUMNS = [("Patient", 34), ("Job", 9), ("Date", 11), ("Status", 10), ("Price", 10)]
+
+
+def read_db_table(table):
+    "A selector's readDBTable() and the grid moves that read pages: top, a jump to the middle, End."
+    rows = rowSource.PagedRowSource(table)
+    length = len(rows)
+    rows[0]
+    rows[length // 2]
+    rows[length - 1]
+
+def read_records(keys):
+    "patientSelector.read_record() for every key: its grid position and its row."
+    rows = rowSource.PagedRowSource(PATIENT_GRID)
+    for mrn in keys:
+        rows.position_of_key(mrn)
+        PATIENTS.by_key(str(mrn))
+
+def find_rows(sqlWhere, literal):
+    "patientSelector.find_DB_rows(): the query, and its rows into an IndexedRows subset."
+    filerows = PATIENT_GRID.find(sqlWhere, (literal,))
+    rows = rowSource.IndexedRows(filerows)
+    rows.position_of_key(filerows[0][1] if filerows else None)   # the subset's index gets built on first use
+    return len(rows)
+
+def order_listing(filename):
+    "The orders by patient name (sort keys), streamed from the cursor into a Text report."
+    cur = config.conn.execute("SELECT patient_name, job, creation_date, status, price FROM " + RXORDER + \
+        " ORDER BY patient_name_key, job")
+    return reportWriters.write_report(filename, "Text", LISTING_COLUMNS, cur)
+
+def operations(rows, workdir, seed):
+    """ the timed operations of a database of 'rows' patients
+    :return: [(name, function)]
+    """
+    rng = random.Random(seed)
+    keys = [rng.randint(1, rows) for i in range(KEYS_READ)]
+    name = config.conn.execute("SELECT name FROM " + PATIENT + " WHERE mrn = ?", (rng.randint(1, rows),)).fetchone()[0]
+    last_name = name.split(" ")[-1].split("-")[0]   # like "Núñez": some rows of every size
+    if PATIENT in findIndex.indexed:
+        fts = findIndex.where_clause(PATIENT) + " ORDER BY mrn"
+        ftsLiteral = findIndex.match_expression(last_name, "name")
+    else:   # no FTS5 in this SQLite: the selector's LIKE
+        fts, ftsLiteral = "name LIKE ? COLLATE NOCASE ORDER BY mrn", "%" + last_name + "%"
+    return [("readDBTable patient", lambda: read_db_table(PATIENT_GRID)),
+            ("readDBTable order", lambda: read_db_table(ORDERS)),
+            ("read_record patient x" + str(KEYS_READ), lambda: read_records(keys)),
+            ("find_DB_rows patient name", lambda: find_rows(fts, ftsLiteral)),
+            ("find_DB_rows patient dob>", lambda: find_rows("dob > ? COLLATE NOCASE ORDER BY mrn", "2015")),
+            ("find_DB_rows patient LIKE", lambda: find_rows("email LIKE ? COLLATE NOCASE ORDER BY mrn", \
+                "%" + testData.ascii_name(last_name) + "%")),
+            ("generateListing order", lambda: order_listing(os.path.join(workdir, "listing.txt"))),
+            ("integrityCheck", lambda: integrityCheck.check_database(config.conn, os.path.join(workdir, "integrity.txt")))
+            ]
+
+def timed(function, repeat):
+    "Runs function repeat times. Returns {median_ms, min_ms}."
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3)}
+
+def run_size(rows, workdir, seed, repeat):
+    "Builds a database of 'rows' patients in workdir and times the operations on it."
+    dbFilename = os.path.join(workdir, config.pname + "-" + str(rows) + ".db")
+    if os.path.exists(dbFilename):
+        os.remove(dbFilename)
+    conn = dbLocking.connect(dbFilename)
+    dbInitialize.migrate(conn)
+    start = time.perf_counter()
+    count = testData.generate(conn, rows, seed)
+    generate_s = time.perf_counter() - start
+    start = time.perf_counter()
+    findIndex.set_up(conn)
+    fts_s = time.perf_counter() - start
+    collation.register(conn)
+    config.conn = conn      # where rowSource and the selectors find it
+    result = {"rows": rows,
+              "tables": {tablename.strip("'"): n for tablename, n in count.items()},
+              "generate_s": round(generate_s, 3),
+              "fts_build_s": round(fts_s, 3),
+              "db_mb": round(os.path.getsize(dbFilename) / 1048576, 1),
+              "operations": {}
+              }
+    for name, function in operations(rows, workdir, seed):
+        result["operations"][name] = timed(function, repeat)
+    conn.close()
+    config.conn = None
+    return result
+
+def regressions(report, baseline, tolerance):
+    "Operations whose median is more than tolerance times the baseline's, at the same size: [line]."
+    old = {size["rows"]: size["operations"] for size in baseline["results"]}
+    lines = []
+    for size in report["results"]:
+        for name, timing in size["operations"].items():
+            before = old.get(size["rows"], {}).get(name)
+            if before and timing["median_ms"] > before["median_ms"] * tolerance:
+                lines.append(str(size["rows"]).rjust(8) + " rows  " + name.ljust(28) + str(before["median_ms"]) + \
+                    " -> " + str(timing["median_ms"]) + " ms")
+    return lines
+
+def report_filename():
+    now = datetime.now().strftime('%Y%m%d%H%M%S.%f')[2:-7]
+    return config.dataPath + "Reports/benchmark-" + now + ".json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the " + config.pname + " DB operations on fake databases of growing sizes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="patients (and orders) per database")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs of every operation")
+    parser.add_argument("--seed", type=int, default=testData.SEED, help="random seed of the fake data")
+    parser.add_argument("--output", help="json report (default: a new one in Data/Reports/)")
+    parser.add_argument("--workdir", help="where the databases are built and kept (default: a temporary directory)")
+    parser.add_argument("--baseline", help="older json report to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="slowdown factor that counts as a regression")
+    args = parser.parse_args()
+
+    report = {"program": config.pname,
+              "version": config.program_version,
+              "python": platform.python_version(),
+              "sqlite": sqlite3.sqlite_version,
+              "system": platform.system() + " " + platform.release(),
+              "machine": platform.machine(),
+              "date": datetime.now().isoformat(timespec="seconds"),
+              "seed": args.seed,
+              "repeat": args.repeat,
+              "results": []
+              }
+    with tempfile.TemporaryDirectory() as tempdir:
+        workdir = args.workdir or tempdir
+        os.makedirs(workdir, exist_ok=True)
+        for rows in args.sizes:
+            result = run_size(rows, workdir, args.seed, args.repeat)
+            report["results"].append(result)
+            print(str(rows).rjust(8) + " rows  generated in " + str(result["generate_s"]) + " s")
+            for name, timing in result["operations"].items():
+                print("          " + name.ljust(28) + str(timing["median_ms"]).rjust(12) + " ms")
+    filename = args.output or report_filename()
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, "w") as outfile:
+        json.dump(report, outfile, indent=1, ensure_ascii=False)
+    print("Report: " + filename)
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            lines = regressions(report, json.load(infile), args.tolerance)
+        if lines:
+            print("Slower than " + args.baseline + ":")
+            print("\n".join(lines))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
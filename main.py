@@ -10,7 +10,16 @@
 # (http://www.freebsd.org/copyright/freebsd-license.html)
 ##############################################################################
 
-import config
+import startupProfile     # first, to time everything else
+
+if startupProfile.requested():
+    startupProfile.enable()
+
+with startupProfile.phase("config import"):
+    import config
+
+if config.PROFILING:
+    startupProfile.enable()
 
 if config.TRACEMALLOC:
     import tracemalloc
@@ -25,10 +34,10 @@ else:
     print("\n>>> " + config.pname + ": I'm sorry, program only runs on Python 3.10 or later. <<<\n")
     sys.exit()
 
-import cProfile
 import os
-import pstats
-import mainMenu
+
+with startupProfile.phase("mainMenu import"):
+    import mainMenu
 
 import colored_traceback
 import npyscreen
@@ -36,20 +45,12 @@ import npyscreen
 colored_traceback.add_hook(always=True) # error Traceback in colors
 npyscreen.disableColor()                # application color
 
-PROFILING = config.PROFILING
-
-def set_profiling():
-    logfile = "cProfile.log"
-    cProfile.run('App.run()', logfile)
-    stats = pstats.Stats(logfile)
-    #s.strip_dirs().sort_stats(-1).print_stats()
-    stats.strip_dirs().print_stats()
-
 if __name__ == "__main__":
     if config.system == "Linux":
         os.environ.setdefault('ESCDELAY', '25')     # To shorten Esc key delay
     App = mainMenu.optidromeApp()
-    if PROFILING:
-        set_profiling()
-    else:
+    startupProfile.start_profiler()     # only in the instrumentation mode
+    try:
         App.run()
+    finally:    # the program usually leaves through sys.exit()
+        startupProfile.write_report(config.pname, config.program_version)
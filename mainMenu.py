@@ -21,14 +21,21 @@ import linecache
 import npyscreen
 from npyscreen import util_viewhelp
 
+import changeLog
+import collation
+import findIndex
+import startupProfile
 import patient
 import patientSelector
 import rxorder
 import rxorderSelector
+import schemaCheck
 #import bookSelector
 import bsWidgets as bs
 
 import config
+import dbInitialize
+import dbLocking
 import identification
 #import publisher
 #import publisherSelector
@@ -37,7 +44,7 @@ import userSelector
 import utilities
 #import warehouse
 #import warehouseSelector
-#import dbIntegrityCheck
+import dbIntegrityCheck
 #import deleteMultipleRecords
 from config import SCREENWIDTH as WIDTH
 
@@ -52,72 +59,119 @@ helpText =  "\nA simple menu form.\n\n\n" +\
     "* The main purpose of this program is to share my experience with the npyscreen terminal user interface and of course to learn some Python." 
 
 
+# Likely next forms, in order, to build while the main menu waits for a key (config.PREWARM_FORMS)
+PREWARM_LIST = ["RXORDERSELECTOR", "RXORDER", "PATIENTSELECTOR", "PATIENT", "UTILITIES", "USERSELECTOR", "USER"]
+
+
+class LazyForms(dict):
+    "NPSAppManaged._Forms replacement: a registered form factory is called the first time its form is looked up."
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.factories = {}     # form id -> function that builds the form
+
+    def __missing__(self, fmid):
+        factory = self.factories.pop(fmid)  # KeyError for unknown forms, as a plain dict
+        with startupProfile.phase("registerForm " + fmid):
+            self.app.registerForm(fmid, factory())
+        return self[fmid]
+
+
 class optidromeApp(npyscreen.NPSAppManaged):
     def onStart(self):
         "Override this method to perform any initialization."
         
-        self.connect_database()
-
-        # check tables' existence:
-        cur = config.conn.cursor()
-        DBprefix = "optidrome."
-        table_list = [  "patient",
-                        "rxorder",
-                        "frame",
-                        "lens",
-                        "user",
-                        "vendor"
-                        ]
-
-        while True: # locking the SQLite single user DB
-            for tname in table_list:
-                tname = DBprefix + tname
-                sqlQuery = "SELECT EXISTS ( SELECT name FROM sqlite_schema WHERE type='table' AND name=? )"
-                try:
-                    cur.execute(sqlQuery, (tname,) )
-                    if cur.fetchone()[0] != 1 : 
-                        bs.notify_OK("\n Database: Table does not exist: '" + tname + "'","Error")
-                        sys.exit()                
-                except sqlite3.OperationalError:    # default timeout is 5 sec
-                    bs.notify_OK("\n    Database is locked, please wait.", "Bookstore")
-                    continue    # to the loop
-            break   # go on
+        with startupProfile.phase("DB connect"):
+            self.connect_database()
+
+        with startupProfile.phase("DB migrations"):
+            self.migrate_database()
+
+        with startupProfile.phase("Schema validation"):
+            self.check_tables()
+
+        with startupProfile.phase("Find index set-up"):
+            findIndex.set_up(config.conn)   # Find's full-text index; the first time it indexes the existing rows
+
+        with startupProfile.phase("Sort keys"):
+            collation.fill_missing(config.conn)     # names written by other programs
 
         npyscreen.setTheme(npyscreen.Themes.DefaultTheme)
 
-        # Forms __inits__() are executed now:
-        self.registerForm("MAIN", MainMenuForm(name="MainMenu", parentApp=self, help=helpText, \
-            lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH, maximum_columns=WIDTH))
-        self.registerForm("IDENTIFICATION", identification.ID_Form(name="Identification", parentApp=self, \
-            help=identification.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-        self.registerForm("RXORDERSELECTOR", rxorderSelector.RxOrderSelectForm(name="RxOrderSelector", parentApp=self, \
-            help=rxorderSelector.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-        self.registerForm("RXORDER", rxorder.RxOrderForm(name="RxOrderForm", parentApp=self, \
-            help=rxorder.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-        self.registerForm("PATIENTSELECTOR", patientSelector.PatientSelectForm(name="PatientSelector", parentApp=self, \
-            help=patientSelector.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-        self.registerForm("PATIENT", patient.PatientForm(name="PatientForm", parentApp=self, \
-            help=patient.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-#        self.registerForm("PUBLISHERSELECTOR", publisherSelector.PublisherSelectForm(name="PublisherSelector", parentApp=self, \
-#            help=publisherSelector.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-#        self.registerForm("PUBLISHER", publisher.PublisherForm(name="PublisherForm", parentApp=self, \
-#            help=publisher.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-#        self.registerForm("WAREHOUSESELECTOR", warehouseSelector.WarehouseSelectForm(name="WarehouseSelector", parentApp=self, \
-#            help=warehouseSelector.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-#        self.registerForm("WAREHOUSE", warehouse.WarehouseForm(name="WarehouseForm", parentApp=self, \
-#            help=warehouse.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-#        self.registerForm("BOOKLISTING", bookListing.BookListingForm(name="BookListingForm", parentApp=self, \
-#            help=bookListing.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-        self.registerForm("UTILITIES", utilities.UtilitiesMenuForm(name="UtilitiesForm", parentApp=self, \
-            help=utilities.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-        self.registerForm("USERSELECTOR", userSelector.UserSelectForm(name="UserSelector", parentApp=self, \
-            help=userSelector.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-        self.registerForm("USER", user.UserForm(name="UserForm", parentApp=self, \
-            help=user.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-#        self.registerForm("DB_INTEGRITY_CHECK", dbIntegrityCheck.DBintegrityCheckForm(name="DBintegrityCheckForm", parentApp=self, \
-#            help=dbIntegrityCheck.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
-#        self.registerForm("DELETE_MULTIPLE_RECORDS", deleteMultipleRecords.DeleteMultipleRecordsForm(name="DeleteMultipleRecordsForm", parentApp=self, \
-#            help=deleteMultipleRecords.helpText, lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH))
+        # Forms are built on first use (see LazyForms); only the main menu is built now:
+        self._Forms = LazyForms(self)
+        with startupProfile.phase("registerForm MAIN"):
+            self.registerForm("MAIN", MainMenuForm(name="MainMenu", parentApp=self, help=helpText, \
+                lines=0, columns=0, minimum_lines=25, minimum_columns=WIDTH, maximum_columns=WIDTH))
+        self.register_lazy_forms()
+
+    def migrate_database(self):
+        "Schema migrations and the change log pruning, waiting for other terminals if needed."
+        while True:     # schema migrations: tables and indexes of this program version
+            try:
+                dbInitialize.migrate(config.conn)
+                if changeLog.prunable(config.conn):     # a plain start doesn't take the write lock
+                    with dbLocking.write_transaction(config.conn, interactive=False):
+                        changeLog.prune(config.conn)
+                break   # go on
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):     # like a read-only database
+                    bs.notify_OK("\n Database could not be updated to this program version:\n  " + str(e), "Error")
+                    sys.exit()
+                bs.notify_OK("\n    Database is locked, please wait.", "Message")
+
+    def check_tables(self):
+        "Schema validation against the program's model. Exits if a table is missing."
+        while True:     # multiuser DB locking loop
+            try:
+                missing, differences = schemaCheck.validate(config.conn, self.DBfilename)
+                break   # go on
+            except sqlite3.OperationalError:    # after BUSY_TIMEOUT seconds
+                bs.notify_OK("\n    Database is locked, please wait.", "Message")
+        if missing:
+            bs.notify_OK("\n Database: Table does not exist: '" + "', '".join(missing) + "'", "Error")
+            sys.exit()
+        if differences:
+            bs.notify_OK("\n Database differs from this program version:\n  " + "\n  ".join(differences[:10]) + \
+                ("\n  ..." if len(differences) > 10 else ""), "Warning")
+
+    def register_lazy_forms(self):
+        "Form factories: every form but the main menu is built the first time it's used."
+        self.addLazyForm("IDENTIFICATION", identification.ID_Form, name="Identification", help=identification.helpText)
+        self.addLazyForm("RXORDERSELECTOR", rxorderSelector.RxOrderSelectForm, name="RxOrderSelector", help=rxorderSelector.helpText)
+        self.addLazyForm("RXORDER", rxorder.RxOrderForm, name="RxOrderForm", help=rxorder.helpText)
+        self.addLazyForm("PATIENTSELECTOR", patientSelector.PatientSelectForm, name="PatientSelector", help=patientSelector.helpText)
+        self.addLazyForm("PATIENT", patient.PatientForm, name="PatientForm", help=patient.helpText)
+#        self.addLazyForm("PUBLISHERSELECTOR", publisherSelector.PublisherSelectForm, name="PublisherSelector", help=publisherSelector.helpText)
+#        self.addLazyForm("PUBLISHER", publisher.PublisherForm, name="PublisherForm", help=publisher.helpText)
+#        self.addLazyForm("WAREHOUSESELECTOR", warehouseSelector.WarehouseSelectForm, name="WarehouseSelector", help=warehouseSelector.helpText)
+#        self.addLazyForm("WAREHOUSE", warehouse.WarehouseForm, name="WarehouseForm", help=warehouse.helpText)
+#        self.addLazyForm("BOOKLISTING", bookListing.BookListingForm, name="BookListingForm", help=bookListing.helpText)
+        self.addLazyForm("UTILITIES", utilities.UtilitiesMenuForm, name="UtilitiesForm", help=utilities.helpText)
+        self.addLazyForm("USERSELECTOR", userSelector.UserSelectForm, name="UserSelector", help=userSelector.helpText)
+        self.addLazyForm("USER", user.UserForm, name="UserForm", help=user.helpText)
+        self.addLazyForm("DB_INTEGRITY_CHECK", dbIntegrityCheck.DBintegrityCheckForm, name="DBintegrityCheckForm", help=dbIntegrityCheck.helpText)
+#        self.addLazyForm("DELETE_MULTIPLE_RECORDS", deleteMultipleRecords.DeleteMultipleRecordsForm, name="DeleteMultipleRecordsForm", help=deleteMultipleRecords.helpText)
+
+    def addLazyForm(self, fmid, FormClass, **keywords):
+        "Registers a form to be built the first time it's used. Same geometry for all the program screens."
+        self._Forms.factories[fmid] = lambda: FormClass(parentApp=self, lines=0, columns=0, minimum_lines=25, \
+            minimum_columns=WIDTH, **keywords)
+
+    def setNextForm(self, fmid):
+        "The next form is built now, if needed: the record forms' set_...Mode() are called right after switching."
+        if fmid in self._Forms.factories:
+            self._Forms[fmid]
+        super().setNextForm(fmid)
+
+    def prewarm_form(self):
+        "Builds the next not yet built form of PREWARM_LIST. Returns False when there's nothing left to build."
+        for fmid in PREWARM_LIST:
+            if fmid in self._Forms.factories:
+                self._Forms[fmid]
+                return True
+        return False
 
     def onInMainLoop(self):
         """Called between each screen while the application is running. Not called before the first screen. Override at will"""
@@ -155,7 +209,7 @@ class optidromeApp(npyscreen.NPSAppManaged):
         # DB Connection creation
         conn = None
         try:
-            conn = sqlite3.connect(self.DBfilename)
+            conn = dbLocking.connect(self.DBfilename)  # WAL mode and busy timeout, see config
         except sqlite3.Error as e:
             print(e)
         config.conn = conn      # connection for this instance of bookstore
@@ -173,7 +227,10 @@ class MainMenuForm(npyscreen.FormBaseNew):
         super().__init__(name, parentApp, framed, help, color, widget_list, cycle_widgets, *args, **keywords)   # goes to _FormBase.__init__()
         
         self.password_entered = False
+        self.painted = False
         self.app = parentApp
+        if config.PREWARM_FORMS:
+            self.keypress_timeout = 5   # tenths of a second idle before while_waiting() builds a form
 
     def create(self):
         "The standard constructor will call the method .create(), which you should override to create the Form widgets."
@@ -207,13 +264,21 @@ class MainMenuForm(npyscreen.FormBaseNew):
     def pre_edit_loop(self):
         if AUTHENTICATE and not self.password_entered:
             self.password_entered = True
+            self.parentApp.getForm("IDENTIFICATION")    # built on first use
             identification.ID_Form.set_ID()
 
+    def while_waiting(self):
+        "Idle main menu: build the likely next forms one at a time, so they open at once."
+        if not self.app.prewarm_form():
+            self.keypress_timeout = None    # all built: back to plain blocking key reads
+
     def post_edit_loop(self):
         pass
     
     def _during_edit_loop(self):
-        pass
+        if not self.painted:    # the main menu is on screen
+            self.painted = True
+            startupProfile.mark("First paint")
 
     def mainSelector(self):
         value_list = [
@@ -280,28 +345,28 @@ class MainMenuForm(npyscreen.FormBaseNew):
     def menuRxOrderSelector(self):
         # Calls books selector
         selectorForm = self.parentApp._Forms['RXORDERSELECTOR']
-        selectorForm.update_grid()  # must be read here to get config.fileRows right
+        selectorForm.update_grid()  # must be read here to get its row set right
         selectorForm.ask_option()
         self.app.switchForm("RXORDERSELECTOR")
         
     def menuPatientSelector(self):
         # Calls authors selector
         selectorForm = self.parentApp._Forms['PATIENTSELECTOR']
-        selectorForm.update_grid()  # must be read here to get config.fileRows right
+        selectorForm.update_grid()  # must be read here to get its row set right
         selectorForm.ask_option()
         self.app.switchForm("PATIENTSELECTOR")
         
     def menuPublisherSelector(self):
         # Calls publishers selector
         selectorForm = self.parentApp._Forms['PUBLISHERSELECTOR']
-        selectorForm.update_grid()  # must be read here to get config.fileRows right
+        selectorForm.update_grid()  # must be read here to get its row set right
         selectorForm.ask_option()
         self.app.switchForm("PUBLISHERSELECTOR")
         
     def menuWarehouseSelector(self):
         # Calls warehouse selector
         selectorForm = self.parentApp._Forms['WAREHOUSESELECTOR']
-        selectorForm.update_grid()  # must be read here to get config.fileRows right
+        selectorForm.update_grid()  # must be read here to get its row set right
         selectorForm.ask_option()
         self.app.switchForm("WAREHOUSESELECTOR")
 
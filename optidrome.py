@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     optidrome.py - Batch mode: record maintenance from the command line
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# The record forms' rules and writes (records.py), without a terminal screen.
+# Run from the program directory:
+#   python -m optidrome create patient name="Jane Doe" dob=01/02/80 ...
+#   python -m optidrome update patient 12 phone=555-555-5555
+#   python -m optidrome delete order 1042
+#   python -m optidrome import order lab_feed.csv [--update]
+# Kinds of record: patient (key: mrn), user (numeral), order (job) and
+# prescription (rx_num).
+# An import reads a CSV file with a header line, or JSON Lines (.jsonl). New
+# records go through bulkImport.py, in batched transactions, and the refused
+# rows into a .rejected file. With --update, the rows are saved one by one
+# in one write transaction, and the refused ones reported by row number.
+# Exit status: 0 all done, 1 some rows refused, 2 error.
+##############################################################################
+
+import argparse
+import sqlite3
+import sys
+import time
+
+import bulkImport
+import config
+import dbInitialize
+import dbLocking
+import records
+
+
+def column_values(assignments):
+    "['name=Jane Doe', ...] -> {'name': 'Jane Doe', ...}"
+    values = {}
+    for assignment in assignments:
+        column, sep, value = assignment.partition("=")
+        if not sep:
+            raise ValueError("expected column=value, got '" + assignment + "'")
+        values[column.strip()] = value
+    return values
+
+def stored_passwords(entity, rows):
+    "Users' passwords are given in clear and stored encrypted, like the user form does."
+    for values in rows:
+        if entity == "user" and values.get("password"):
+            values = dict(values, password=records.encrypt_password(values["password"]))
+        yield values
+
+def connect(filename):
+    conn = dbLocking.connect(filename)
+    dbInitialize.migrate(conn)      # the same schema version the program would use
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m " + config.pname, \
+        description="Create, update, delete or import " + config.pname + " records without the screen forms.")
+    parser.add_argument("--db", default=config.dataPath + config.dbname, help="database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="create a record")
+    create.add_argument("entity", choices=list(records.ENTITIES))
+    create.add_argument("values", nargs="*", metavar="column=value", help="a missing key gets the next one")
+    update = commands.add_parser("update", help="change some values of a record")
+    update.add_argument("entity", choices=list(records.ENTITIES))
+    update.add_argument("key")
+    update.add_argument("values", nargs="+", metavar="column=value")
+    delete = commands.add_parser("delete", help="delete a record")
+    delete.add_argument("entity", choices=list(records.ENTITIES))
+    delete.add_argument("key")
+    load = commands.add_parser("import", help="create records from a CSV (with header) or JSON Lines file")
+    load.add_argument("entity", choices=list(records.ENTITIES))
+    load.add_argument("file")
+    load.add_argument("--update", action="store_true", help="update the records whose key exists (record by record)")
+    load.add_argument("--batch-size", type=int, default=bulkImport.BATCH_SIZE, help="rows per write transaction")
+    load.add_argument("--defer-indexes", action="store_true", \
+        help="first loads: drop the secondary indexes and build them once at the end")
+    args = parser.parse_args()
+
+    try:
+        conn = connect(args.db)
+        if args.command == "import":
+            rows = stored_passwords(args.entity, bulkImport.read_rows(args.file))
+            if args.update:     # record by record, like the forms
+                counts, errors = records.import_rows(conn, args.entity, rows, update=True)
+                for number, message in errors:
+                    print(args.file + ": row " + str(number) + ": " + message, file=sys.stderr)
+                print(args.entity + ": " + str(counts["created"]) + " created, " + str(counts["updated"]) + " updated, " + \
+                    str(len(errors)) + " refused")
+                sys.exit(1 if errors else 0)
+            start = time.perf_counter()
+            inserted, rejected, rejectsFilename = bulkImport.import_file(conn, args.entity, args.file, rows, args.batch_size, \
+                args.defer_indexes)
+            seconds = time.perf_counter() - start
+            print(args.entity + ": " + str(inserted) + " created, " + str(rejected) + " refused" + \
+                (" (see " + rejectsFilename + ")" if rejectsFilename else "") + \
+                ", " + str(round(seconds, 2)) + " s, " + str(int((inserted + rejected) / max(seconds, 1e-6))) + " rows/s")
+            sys.exit(1 if rejected else 0)
+
+        cur = conn.cursor()
+        with dbLocking.write_transaction(conn, interactive=False):
+            if args.command == "delete":
+                records.remove(cur, args.entity, args.key)
+                result = "deleted"
+            elif args.command == "update":
+                records.change(cur, args.entity, args.key, next(stored_passwords(args.entity, [column_values(args.values)])))
+                result = "updated"
+            else:
+                result = records.save(cur, args.entity, next(stored_passwords(args.entity, [column_values(args.values)])))
+        print(args.entity + " " + result)
+    except records.ValidationError as e:
+        print(config.pname + ": " + e.message, file=sys.stderr)
+        sys.exit(1)
+    except (sqlite3.Error, OSError, ValueError) as e:   # locked database, missing file, wrong arguments...
+        print(config.pname + ": " + str(e), file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,8 @@ import npyscreen
 
 import bsWidgets as bs
 import config
+import dbLocking
+import records
 
 DATEFORMAT = config.dateFormat
 DBTABLENAME = "'optidrome.patient'"
@@ -49,6 +51,11 @@ class PatientForm(npyscreen.FormBaseNew):
 
         self.selectorForm = self.parentApp._Forms['PATIENTSELECTOR']
 
+    @property
+    def rowSet(self):
+        "The row set of the selector this form is opened from: its rows and the record read (see rowSetCache.py)."
+        return self.selectorForm.rowSet
+
     def create(self):
         """The standard constructor will call the method .create(), which you should override to create the Form widgets."""
         self.framed = True   # framed form
@@ -86,21 +93,16 @@ class PatientForm(npyscreen.FormBaseNew):
         self.bu_notes = self.notesFld.value
 
     def update_fileRow(self):
-        "Updates config.fileRow."
+        "Updates self.rowSet.fileRow."
         if self.current_option != "Delete":
-            id = config.fileRow[0]
-            for row in config.fileRows:
-                if row[0] == id:
-                    config.fileRow = []
-                    config.fileRow.append(row[0])
-                    config.fileRow.append(int(self.mrnFld.value))
-                    config.fileRow.append(self.nameFld.value)
-                    config.fileRow.append(self.dobFld.value)
-                    config.fileRow.append(self.phoneFld.value)
-                    config.fileRow.append(self.emailFld.value)
-                    config.fileRow.append(self.addressFld.value)
-                    config.fileRow.append(self.notesFld.value)
-                    break
+            self.rowSet.fileRow = [self.rowSet.fileRow[0]]   # the same id: no need to look for the row in self.rowSet.rows
+            self.rowSet.fileRow.append(int(self.mrnFld.value))
+            self.rowSet.fileRow.append(self.nameFld.value)
+            self.rowSet.fileRow.append(self.dobFld.value)
+            self.rowSet.fileRow.append(self.phoneFld.value)
+            self.rowSet.fileRow.append(self.emailFld.value)
+            self.rowSet.fileRow.append(self.addressFld.value)
+            self.rowSet.fileRow.append(self.notesFld.value)
 
     def exit_patient(self):
         "Only for escape-exit, handler version."
@@ -113,9 +115,7 @@ class PatientForm(npyscreen.FormBaseNew):
             self.selectorForm.update_grid()
             self.backup_fields()
 
-        # To unlock the database (for Create) we must disconnect and re-connect:
-        config.conn.close()
-        self.parentApp.connect_database()
+        dbLocking.end_editing(self.parentApp)  # unlock the database, if it was locked
 
         self.selectorForm.grid.update()
         config.parentApp.setNextForm("PATIENTSELECTOR")
@@ -127,9 +127,7 @@ class PatientForm(npyscreen.FormBaseNew):
         self.selectorForm.update_grid()
         self.backup_fields()
 
-        # To unlock the database (for Create) we must disconnect and re-connect:
-        config.conn.close()
-        self.parentApp.connect_database()
+        dbLocking.end_editing(self.parentApp)  # unlock the database, if it was locked
 
         self.selectorForm.grid.update()
         config.parentApp.setNextForm("PRESCRIPTIONSELECTOR")
@@ -152,14 +150,7 @@ class PatientForm(npyscreen.FormBaseNew):
         "Setting the author form to create a new record."
         global form
         conn = config.conn
-        while True:     # for Creation, we must set the locking here
-            try:
-                conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite only allows a single writer per database
-                conn.execute('PRAGMA locking_mode = EXCLUSIVE')
-                conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
-                break
-            except sqlite3.OperationalError:
-                bs.notify_OK("\n    Database is locked, please wait.", "Message")
+        dbLocking.lock_for_editing(conn, create=True)  # for Creation, we must set the locking here (see WAL_MODE)
         form.current_option = "Create"
         form.mrnFld.editable = True
         form.mrnFld.maximum_string_length = 3
@@ -207,8 +198,8 @@ class PatientForm(npyscreen.FormBaseNew):
         "Setting the author form for update editing."
         global form
         conn = config.conn
-        conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite3 admits just one writing process
-        conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+        dbLocking.lock_for_editing(conn)   # exclusive access in the old mode, nothing in WAL_MODE
+        form.bu_version = dbLocking.row_version(conn, DBTABLENAME, form.rowSet.fileRow[0])    # checked at Save
         form.current_option = "Update"
         form.convertDBtoFields()
         form.mrnFld.editable = True
@@ -231,8 +222,7 @@ class PatientForm(npyscreen.FormBaseNew):
         "Setting the author form for deleting."
         global form
         conn = config.conn
-        conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite3 admits just one writing process
-        conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+        dbLocking.lock_for_editing(conn)   # exclusive access in the old mode, nothing in WAL_MODE
         form.current_option = "Delete"
         form.convertDBtoFields()
         form.mrnFld.editable = False
@@ -251,13 +241,13 @@ class PatientForm(npyscreen.FormBaseNew):
 
     def convertDBtoFields(self):
         "Convert DB fields into screen fields (strings)."
-        self.mrnFld.value = str(config.fileRow[1])
-        self.nameFld.value = config.fileRow[2]
-        self.dobFld.value = config.fileRow[3]
-        self.phoneFld.value = config.fileRow[4]
-        self.emailFld.value = config.fileRow[5]
-        self.addressFld.value = config.fileRow[6]
-        self.notesFld.value = config.fileRow[7]
+        self.mrnFld.value = str(self.rowSet.fileRow[1])
+        self.nameFld.value = self.rowSet.fileRow[2]
+        self.dobFld.value = self.rowSet.fileRow[3]
+        self.phoneFld.value = self.rowSet.fileRow[4]
+        self.emailFld.value = self.rowSet.fileRow[5]
+        self.addressFld.value = self.rowSet.fileRow[6]
+        self.notesFld.value = self.rowSet.fileRow[7]
 
     def strip_fields(self):
         "Required trimming of leading and trailing spaces."
@@ -271,15 +261,15 @@ class PatientForm(npyscreen.FormBaseNew):
     
     def save_mem_record(self):
         "Save new record (from Create) in global variable."
-        config.fileRow = []
-        config.fileRow.append(None)    # ID field is incremental, fulfilled later
-        config.fileRow.append(int(self.mrnFld.value))
-        config.fileRow.append(self.nameFld.value)
-        config.fileRow.append(self.dobFld.value)
-        config.fileRow.append(self.phoneFld.value)
-        config.fileRow.append(self.emailFld.value)
-        config.fileRow.append(self.addressFld.value)
-        config.fileRow.append(self.notesFld.value)
+        self.rowSet.fileRow = []
+        self.rowSet.fileRow.append(None)    # ID field is incremental, fulfilled later
+        self.rowSet.fileRow.append(int(self.mrnFld.value))
+        self.rowSet.fileRow.append(self.nameFld.value)
+        self.rowSet.fileRow.append(self.dobFld.value)
+        self.rowSet.fileRow.append(self.phoneFld.value)
+        self.rowSet.fileRow.append(self.emailFld.value)
+        self.rowSet.fileRow.append(self.addressFld.value)
+        self.rowSet.fileRow.append(self.notesFld.value)
 
     def createPrescriptionbtn_function(self):
         "Prescription button function under Create mode."
@@ -291,7 +281,8 @@ class PatientForm(npyscreen.FormBaseNew):
         else:
             if self.exist_changes():    # If there are changes, save them
                 self.save_mem_record()
-                self.save_created_patient()
+                if not self.save_created_patient():
+                    return  # back to the form
                 self.exitToPrescription()
                 self.selectorForm.grid.set_highlight_row(int(self.mrnFld.value))
             else:
@@ -309,7 +300,8 @@ class PatientForm(npyscreen.FormBaseNew):
         else:
             if self.exist_changes():
                 self.save_mem_record()  # backup record in config variable
-                self.save_created_patient()
+                if not self.save_created_patient():
+                    return  # back to the form
                 self.exitPatient(modified=True)
                 self.selectorForm.grid.set_highlight_row(int(self.mrnFld.value))
             else:
@@ -339,27 +331,25 @@ class PatientForm(npyscreen.FormBaseNew):
         "Button based Delete function for D=Delete."
         conn = config.conn
         cur = conn.cursor()
-        id = config.fileRow[0]
+        id = self.rowSet.fileRow[0]
 
         # Delete author record
-        sqlQuery = "DELETE FROM " + DBTABLENAME + " WHERE id = " + str(id)
-        cur.execute(sqlQuery)
-        conn.commit()
+        index = self.rowSet.rows.position_of_id(id)     # for positioning, while the row is still there
+        with dbLocking.write_transaction(conn):
+            records.delete_record(cur, DBTABLENAME, id)
         bs.notify("\n       Record deleted", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        # update config.fileRows:
-        index = 0           # for positioning
-        for row in config.fileRows:
-            if row[0] == id:
-                config.fileRows.remove(row)
-                break
-            index += 1
-        # update config.fileRow to the previous record in list:
+        # update self.rowSet.rows:
+        if index is None:
+            index = len(self.rowSet.rows)
+        else:
+            self.rowSet.rows.remove(self.rowSet.rows[index])
+        # update self.rowSet.fileRow to the previous record in list:
         if index > 0:
             index -= 1
         try:
-            config.fileRow = config.fileRows[index]
+            self.rowSet.fileRow = self.rowSet.rows[index]
         except IndexError:  # there are no rows in the table
-            config.fileRow = []
+            self.rowSet.fileRow = []
 
         self.exitPatient(modified=True)
 
@@ -372,18 +362,12 @@ class PatientForm(npyscreen.FormBaseNew):
     def deleteOKbtn_function(self):
         "OK button function under Delete mode."
 
-        # You cannot delete an author if it's in a book_author record
+        # You cannot delete a patient listed in an order
         conn = config.conn
-        cur = conn.cursor()
-        num = config.fileRow[1]
-        sqlQuery = "SELECT id FROM 'optidrome.rxorder' WHERE patient_mrn = ?"
-        cur.execute(sqlQuery, (str(num),) )
-        try:
-            id = cur.fetchone()[0]
-        except TypeError:   # there are no rows
-            id = None
+        num = self.rowSet.fileRow[1]
+        in_orders = records.patient_in_orders(conn, num)
         config.conn.commit()
-        if id :
+        if in_orders:
             pronoun = config.gender_neutral_pronoun.lower()
             bs.notify_OK("\n   You cannot delete this patient because \n"+ "    " +\
                 pronoun + " is listed in an order.\n", "Error")
@@ -394,7 +378,7 @@ class PatientForm(npyscreen.FormBaseNew):
             if bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
                 self.delete_patient()
                 try:
-                    numeral = config.fileRow[1]
+                    numeral = self.rowSet.fileRow[1]
                 except IndexError:  # there are no rows in the table
                     numeral = None
                 self.selectorForm.grid.set_highlight_row(numeral)
@@ -418,52 +402,28 @@ class PatientForm(npyscreen.FormBaseNew):
             if self._widgets_by_id[w].name == fieldName:
                 return w
 
+    def field_values(self):
+        "The fields as a dict of column values, for records.py."
+        return {"mrn": self.mrnFld.value, "name": self.nameFld.value, "dob": self.dobFld.value, "phone": self.phoneFld.value, \
+            "email": self.emailFld.value, "address": self.addressFld.value, "notes": self.notesFld.value}
+
     def check_fields_values(self):
-        "Checking for wrong values in the fields."
+        "Checking for wrong values in the fields: the record rules (records.py), then the screen's."
         errorMsg = None
-
-        # Mandatory values check:
-        emptyField = False
-        if self.mrnFld.value == "":
-            emptyField = True
-            self.editw = self.get_editw_number("MRN:") - 1
-        elif self.nameFld.value == "":  
-            emptyField = True
-            self.editw = self.get_editw_number("Name:") - 1
-        if emptyField:
-            self.ok_button.editing = False
-            errorMsg = "Error:  Mandatory field is empty"
-            return errorMsg
-        
-        # wrong value check: numeral field
+        id = None if self.current_option == "Create" else self.rowSet.fileRow[0]
         try:
-            a = int(self.mrnFld.value)
-        except ValueError:
-            self.editw = self.get_editw_number("MRN:") - 1
+            records.check_patient(config.conn, self.field_values(), id)
+        except records.ValidationError as e:
+            self.editw = self.get_editw_number(e.field) - 1
             self.ok_button.editing = False
-            errorMsg = "Error: MRN must be integer"
-            return errorMsg
+            return e.message
+
         if len(self.mrnFld.value) > self.mrnFld.maximum_string_length:
             self.editw = self.get_editw_number("MRN:") - 1
             self.ok_button.editing = False
             errorMsg = "Error: MRN maximum length exceeded"
             return errorMsg
 
-        # repeated value check: numeral and name fields
-        if self.mrnFld.value != self.bu_mrn or self.nameFld.value != self.bu_name:
-            for row in config.fileRows:
-                self.ok_button.editing = False
-                # Already exists and it's not itself
-                if row[1] == int(self.mrnFld.value) and self.mrnFld.value != self.bu_mrn:
-                    self.editw = self.get_editw_number("MRN:") - 1
-                    errorMsg = "Error:  MRN already exists"
-                    return errorMsg
-                # Already exists and it's not itself
-                if row[2] == self.nameFld.value and self.nameFld.value != self.bu_name:
-                    self.editw = self.get_editw_number("Name:") - 1
-                    errorMsg = "Error:  Name already exists"
-                    return errorMsg
-
     def exist_changes(self):
         "Checking for changes to the fields."
         exist_changes = False
@@ -484,17 +444,18 @@ class PatientForm(npyscreen.FormBaseNew):
 
         conn = config.conn
         cur = conn.cursor()
-        sqlQuery = "INSERT INTO " + DBTABLENAME + " (mrn,name,dob,phone,email,address,notes) VALUES (?,?,?,?,?,?,?)"
-        values = (self.mrnFld.value, self.nameFld.value, self.dobFld.value, self.phoneFld.value, self.emailFld.value, self.addressFld.value, self.notesFld.value)
-        cur.execute(sqlQuery, values)
-        conn.commit()
-        conn.isolation_level = None     # free the multiuser lock
-        config.fileRow[0] = cur.lastrowid
+        try:
+            with dbLocking.write_transaction(conn):     # the only write lock, and just for the INSERT
+                id = records.create_patient(cur, self.field_values())
+        except sqlite3.IntegrityError:  # another terminal may have just taken the same MRN
+            bs.notify_OK("\n     MRN or e-mail of patient already exists. ", "Message")
+            return False
+        self.rowSet.fileRow[0] = id
         bs.notify("\n       Record created", title="Message", form_color='STANDOUT', wrap=True, wide=False)
 
-        # update config.fileRows:
+        # update self.rowSet.rows:
         new_record = []
-        new_record.append(config.fileRow[0])    # id
+        new_record.append(self.rowSet.fileRow[0])    # id
         new_record.append(int(self.mrnFld.value))
         new_record.append(self.nameFld.value)
         new_record.append(self.dobFld.value)
@@ -502,7 +463,8 @@ class PatientForm(npyscreen.FormBaseNew):
         new_record.append(self.emailFld.value)
         new_record.append(self.addressFld.value)
         new_record.append(self.notesFld.value)
-        config.fileRows.append(new_record)
+        self.rowSet.rows.append(new_record)
+        return True
 
     def save_updated_patient(self):
         "Button based Save function for U=Update."
@@ -510,23 +472,34 @@ class PatientForm(npyscreen.FormBaseNew):
         conn = config.conn
         cur = config.conn.cursor()
 
-        # Change author_num in book_author records:
-        if self.mrnFld.value != self.bu_mrn:
-            sqlQuery = "UPDATE 'optidrome.rxorder' SET patient_mrn=? WHERE patient_mrn=?"
-            values = (self.mrnFld.value, self.bu_mrn)
-            cur.execute(sqlQuery, values)
-            conn.commit()
-
-        sqlQuery = "UPDATE " + DBTABLENAME + " SET mrn=?, name=?, dob=?, phone=?, email=?, address=?, notes=? WHERE id=?"
-        values = (self.mrnFld.value, self.nameFld.value, self.dobFld.value, self.phoneFld.value, self.emailFld.value, self.addressFld.value, self.notesFld.value, config.fileRow[0])
         try:
-            cur.execute(sqlQuery, values)
-            conn.commit()
+            with dbLocking.write_transaction(conn):     # the patient and their orders' MRN, or none
+                self.bu_version = records.update_patient(cur, self.rowSet.fileRow[0], self.field_values(), self.bu_version)
             bs.notify("\n       Record saved", title="Message", form_color='STANDOUT', wrap=True, wide=False)
         except sqlite3.IntegrityError:
             bs.notify_OK("\n     MRN or name of patient already exists. ", "Message")
-            return
-        
+            return False
+        except dbLocking.RowVersionConflict:
+            if self.resolve_conflict():
+                return self.save_updated_patient()
+            return False
+        return True
+
+    def resolve_conflict(self):
+        "Another terminal saved this patient meanwhile: show the differences and ask whether to save over them."
+        row, version = dbLocking.read_row(config.conn, DBTABLENAME, self.rowSet.fileRow[0])
+        if row is None:
+            bs.notify_OK("\n     This patient was deleted by another terminal. ", "Message")
+            return False
+        fields = [("MRN:", self.mrnFld.value, row[1]), ("Name:", self.nameFld.value, row[2]), ("DOB:", self.dobFld.value, row[3]), \
+            ("Phone:", self.phoneFld.value, row[4]), ("Email:", self.emailFld.value, row[5]), \
+            ("Address:", self.addressFld.value, row[6]), ("Notes:", self.notesFld.value, row[7])]
+        message = dbLocking.conflict_message(fields) + "\n  Save your values over them?"
+        if not bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
+            return False    # back to the form
+        self.bu_version = version
+        return True
+
     def updateOKbtn_function(self):
         "OK button function under Update mode."
         self.strip_fields()     # Get rid of spaces
@@ -536,7 +509,8 @@ class PatientForm(npyscreen.FormBaseNew):
             return
         else:
             if self.exist_changes():
-                self.save_updated_patient()
+                if not self.save_updated_patient():
+                    return  # back to the form
                 self.exitPatient(modified=True)
                 self.selectorForm.grid.set_highlight_row(int(self.mrnFld.value))
             else:
@@ -23,10 +23,13 @@ import sqlite3
 import time
 
 import npyscreen
-import numpy
 
 import bsWidgets as bs
 import config
+import dataAccess
+import findIndex
+import rowSetCache
+import rowSource
 from patient import PatientForm
 from config import SCREENWIDTH as WIDTH
 
@@ -35,6 +38,8 @@ REMEMBER_SUBSET = config.REMEMBER_SUBSET  # remember the last found subset
 DATEFORMAT = config.dateFormat  # program-wide
 FIELD_LIST = ["mrn", "name", "dob", "phone", "email"]     # only screen fields
 DBTABLENAME = "'optidrome.patient'"
+GRID_ROWS = dataAccess.PatientTable(["id"] + FIELD_LIST)   # the grid's columns, including Patient.id
+PATIENTS = dataAccess.PatientTable()     # whole records
 
 helpText =  "Another record selector screen for the authors.\n\n" \
     "* Although in the database exists an intermediate table 'book/author', I have not really implemented " \
@@ -55,6 +60,12 @@ class PatientSelectForm(npyscreen.FormBaseNew):
         
         # goes to _FormBase:
         super().__init__(name, parentApp, framed, help, color, widget_list, cycle_widgets=cycle_widgets, *args, **keywords)
+        self.keypress_timeout = config.GRID_POLL    # tenths of a second idle before while_waiting()
+
+    @property
+    def rowSet(self):
+        "The grid's row set, its full set or a Find subset, with the selected row (see rowSetCache.py)."
+        return rowSetCache.current(DBTABLENAME)
 
     def create(self):
         "The standard constructor will call the method .create(), which you should override to create the Form widgets."
@@ -119,63 +130,39 @@ class PatientSelectForm(npyscreen.FormBaseNew):
 
     def getRowListForScreen(self, filerows):
         "Memory row list to screen row list for grid."
+        if isinstance(filerows, rowSource.PagedRowSource) and len(filerows) > 0:
+            return filerows.screen_rows()   # full set: rows get read as the grid scrolls
         if len(filerows) > 0:
-            self.screenFileRows = numpy.array(filerows)  # I need numpy to...
-            self.screenFileRows = self.screenFileRows[:, 1:]  # ...cut the first field ("id")
-            return self.screenFileRows.tolist()          # and again to list
+            return rowSource.ScreenRows(filerows)   # the rows without their "id", as the grid shows them
         else:
             empty_list = [["","","","",""]]
             return empty_list
 
     def readDBTable(self):
-        "Reads the full table and returns a list of list-rows."
-        cur = config.conn.cursor()
-        while True:     # multiuser DB locking loop
-            try:
-                cur.execute("SELECT * FROM " + DBTABLENAME + " ORDER BY mrn")
-                break   # go on
-            except sqlite3.OperationalError:
-                bs.notify_OK("\n    Database is locked, please wait.", "Message")
-        filerows = cur.fetchall()
-        rows = []        
-        for row in filerows:
-            id = row[0]
-            mrn = row[1]
-            name = row[2]
-            dob = row[3]
-            phone = row[4]
-            email = row[5]
-            cRow = [id, mrn, name, dob, phone, email]
-            rows.append(cRow)    # including Author.id
-        self.set_up_title(filerows, full_set=True)
-        return rows # it's a list of lists
+        "Returns the full table as a paged row source: rows are read from the DB on demand."
+        rows = rowSource.PagedRowSource(GRID_ROWS)     # the grid columns' Rows, as they come
+        self.set_up_title(rows, full_set=True)     # it's a COUNT(*)
+        return rows # it reads like a list of lists
 
     def fill_grid(self):
-        "Read the DB table and put it into the grid."
-        config.fileRows = self.readDBTable()        # full row set: it's a list of lists
-        self.screenFileRows = self.getRowListForScreen(config.fileRows)     # it's a list of lists
+        "Put the full set into the grid: the one of the last visit, with the changes since (rowSetCache.py)."
+        rowSet = rowSetCache.activate(rowSetCache.row_set(DBTABLENAME))
+        if rowSetCache.bring_up_to_date(rowSet):
+            self.set_up_title(self.rowSet.rows, full_set=True)
+        else:
+            position = rowSetCache.position(DBTABLENAME)
+            self.rowSet.rows = self.readDBTable()        # full row set: it's a list of lists
+            rowSetCache.loaded(rowSet, position)
+        self.screenFileRows = self.getRowListForScreen(self.rowSet.rows)     # it's a list of lists
         self.grid.values = self.screenFileRows
 
     def update_grid(self):
-        "Updates the affected row in the author grid and RAM config table list."
-        # After a change or creation, grid displays full set :
-        if not REMEMBER_SUBSET or config.last_table != DBTABLENAME or \
-                (config.last_table == DBTABLENAME and config.last_operation == "Create") :
+        "Shows the row set of the last visit, the full set or a Find subset, up to date. Called from outside this module."
+        rowSet = rowSetCache.current(DBTABLENAME)
+        # After a creation, grid displays full set; a Find subset is kept, or found again after a write:
+        if not REMEMBER_SUBSET or rowSet.find is None or config.last_operation == "Create" or \
+                not self.find_DB_rows(rowSet.find):
             self.fill_grid()
-            config.last_table = DBTABLENAME
-        else:   # remember Find subset
-            if config.fileRow is not None:  # it's not initializing
-                for row in config.fileRows:
-                    if row[0] == config.fileRow[0]:     # ID field
-                        row[1] = config.fileRow[1]      # update grid row
-                        row[2] = config.fileRow[2]
-                        row[3] = config.fileRow[3]
-                        row[4] = config.fileRow[4]
-                        row[5] = config.fileRow[5]
-                        break
-                screenFileRows = self.getRowListForScreen(config.fileRows)
-                self.grid.values = screenFileRows
-                self.set_up_title(config.fileRows, full_set=False)
         if not REMEMBER_ROW:
             self.grid.set_highlight_row(None)    # select the first one
     
@@ -221,7 +208,7 @@ class PatientSelectForm(npyscreen.FormBaseNew):
 
         self.grid.editing = False
 
-        searchedMRN = config.currentRow
+        searchedMRN = self.rowSet.currentRow
         self.inputDetail.hidden = False
         self.inputDetail.editable = True
         self.inputDetail.relx = 26
@@ -259,7 +246,7 @@ class PatientSelectForm(npyscreen.FormBaseNew):
 
         self.grid.editing = False
 
-        searchedMRN = config.currentRow
+        searchedMRN = self.rowSet.currentRow
         self.inputDetail.hidden = False
         self.inputDetail.editable = True
         self.inputDetail.relx = 26
@@ -335,7 +322,7 @@ class PatientSelectForm(npyscreen.FormBaseNew):
 
         self.grid.editing = False
 
-        searchedMRN = config.currentRow
+        searchedMRN = self.rowSet.currentRow
         self.inputDetail.hidden = False
         self.inputDetail.editable = True
         self.inputDetail.relx = 26
@@ -352,37 +339,19 @@ class PatientSelectForm(npyscreen.FormBaseNew):
 
     def read_record(self, mrn):
         "Search for the required record and store it in a reachable variable. Called from the Detail-field widget."
-        config.screenRow = 0
-        config.fileRow = []
-        for row in config.fileRows:
-            if row[1] == mrn:
-                cur = config.conn.cursor()
-                while True:     # multiuser DB locking loop
-                    try:
-                        # I could just use .append(row[0]) below, but I read again to allow for record locking
-                        sqlQuery = "SELECT * FROM " + DBTABLENAME + " WHERE mrn=?"
-                        cur.execute(sqlQuery, (str(mrn),) )
-                        break   # go on
-                    except sqlite3.OperationalError:
-                        bs.notify_OK("\n    Database is locked, please wait.", "Message")
-                filerow = cur.fetchone()
-                config.fileRow.append(filerow[0])
-                config.fileRow.append(filerow[1])
-                config.fileRow.append(filerow[2])
-                config.fileRow.append(filerow[3])
-                config.fileRow.append(filerow[4])
-                config.fileRow.append(filerow[5])
-                config.fileRow.append(filerow[6])
-                config.fileRow.append(filerow[7])
-                self.grid.edit_cell = [config.screenRow, 0]  # highlight the selected row
-                # If the searched index is greater than the first index displayed on screen
-                if config.screenRow > self.grid.begin_row_display_at:
-                    self.grid.ensure_cursor_on_display_down_right(None)
-                else:   # If the searched index is smaller than the first index displayed on screen
-                    self.grid.ensure_cursor_on_display_up(None)
-                return True
-            config.screenRow += 1
-        return False    # not found
+        self.rowSet.fileRow = []
+        self.rowSet.screenRow = self.rowSet.rows.position_of_key(mrn)     # indexed, no row walking
+        if self.rowSet.screenRow is None:
+            self.rowSet.screenRow = 0
+            return False    # not found
+        self.rowSet.fileRow = PATIENTS.by_key(str(mrn))    # read again, not from the grid: the whole and current record
+        self.grid.edit_cell = [self.rowSet.screenRow, 0]  # highlight the selected row
+        # If the searched index is greater than the first index displayed on screen
+        if self.rowSet.screenRow > self.grid.begin_row_display_at:
+            self.grid.ensure_cursor_on_display_down_right(None)
+        else:   # If the searched index is smaller than the first index displayed on screen
+            self.grid.ensure_cursor_on_display_up(None)
+        return True
 
     def exitPatientSelector(self):
         "Escape key was pressed: isinstance(self, AuthorSelectForm) = True; we always come from the OptionField."
@@ -400,9 +369,14 @@ class PatientSelectForm(npyscreen.FormBaseNew):
             config.parentApp.setNextForm("MAIN")
             config.parentApp.switchFormNow()
 
-    def pre_edit_loop(self):
-        #print("pre_edit_loop()!!!")
-        pass
+    def while_waiting(self):
+        "Idle selector: shows the other terminals' changes to its row set."
+        rowSet = rowSetCache.current(DBTABLENAME)
+        if rowSet.rows is None or rowSetCache.is_fresh(rowSet):
+            return
+        if rowSet.find is None or not self.find_DB_rows(rowSet.find):
+            self.fill_grid()
+        self.display()
 
     def post_edit_loop(self):
         #print("post_edit_loop()!!!")
@@ -455,6 +429,11 @@ class PatientSelectForm(npyscreen.FormBaseNew):
         else:
             literal = find_literal
 
+        rowSet = rowSetCache.row_set(DBTABLENAME, find_literal)
+        if rowSetCache.bring_up_to_date(rowSet):    # the same Find: its rows, with the changes since
+            return self.show_subset(rowSet)
+        position = rowSetCache.position(DBTABLENAME)
+
         comparator = False
         if literal[0] in ["=","<",">"]:
             comparator = literal[0]
@@ -463,8 +442,11 @@ class PatientSelectForm(npyscreen.FormBaseNew):
             bs.notify_OK(" Find: Must specify 'field:' when using a comparator", "Message")
             return False
 
-        sqlQuery = "SELECT * FROM " + DBTABLENAME + " WHERE "
-        if not comparator:
+        fts = not comparator and findIndex.can_match(DBTABLENAME, literal, field.lower() if field else None)
+        if fts:     # through the full-text index
+            whereStr = findIndex.where_clause(DBTABLENAME) + " ORDER BY mrn"
+            literal = findIndex.match_expression(literal, field.lower() if field else None)
+        elif not comparator:
             if field == False:  # no field specified, so search all fields
                 whereStr = "mrn LIKE ? OR name LIKE ? OR dob LIKE ?" +\
                     " OR phone LIKE ? OR email LIKE ? OR address LIKE ? COLLATE NOCASE ORDER BY mrn"
@@ -473,35 +455,33 @@ class PatientSelectForm(npyscreen.FormBaseNew):
         elif comparator:
             whereStr = field + " " + comparator + " ? COLLATE NOCASE ORDER BY mrn"
 
-        sqlQuery += whereStr
-
-        cur = config.conn.cursor()
         try:
-            if comparator:
+            if comparator or fts:
                 pass    # leave literal without percents
             else:
                 literal = "%" + literal + "%"
             values = ()
-            for i in range(sqlQuery.count("?")):    # setting the parameters for SQL
+            for i in range(whereStr.count("?")):    # setting the parameters for SQL
                 values += (literal,)
-            cur.execute(sqlQuery, values)
+            filerows = GRID_ROWS.find(whereStr, values)     # the grid columns, including Patient.id
 
         except sqlite3.OperationalError as e:   # some inputs like '\' 
             bs.notify_OK("\n    sqlite3.OperationalError: \n"+str(e),"Message", form_color='STANDOUT', wrap=True, wide=False)
             return False
 
-        filerows = cur.fetchall()
         if len(filerows) == 0:
             bs.notify("\n    No matching records found","Message", form_color='STANDOUT', wrap=True, wide=False)
             return False
-        rows = []        
-        for row in filerows:
-            cRow = [row[0], row[1], row[2], row[3], row[4], row[5]]
-            rows.append(cRow)    # including Author.id
-        config.fileRows = rows
-        self.screenFileRows = self.getRowListForScreen(config.fileRows)     # it's a list of lists
+        rowSet.rows = rowSource.IndexedRows(filerows, read_row=GRID_ROWS.by_id)  # Find subset, indexed by key and id
+        rowSetCache.loaded(rowSet, position)
+        return self.show_subset(rowSet)
+
+    def show_subset(self, rowSet):
+        "Puts a Find subset into the grid."
+        rowSetCache.activate(rowSet)
+        self.screenFileRows = self.getRowListForScreen(self.rowSet.rows)     # it's a list of lists
         self.grid.values = self.screenFileRows
-        self.set_up_title(filerows, full_set=False)
+        self.set_up_title(self.rowSet.rows, full_set=False)
         return True
 
     def textfield_exit(self):
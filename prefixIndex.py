@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     prefixIndex.py - Prefix lookup in the chooser value lists
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# The choosers (bsWidgets.Chooser, MyAutocomplete) and their popups used to
+# scan their whole value list, and call values.index(), on every keystroke:
+# with every patient name in the list, that is noticeable. An index of a
+# list is built once, on first use, and kept while the list is the same
+# object (valueLists.py gives back the same list until its table changes):
+#   - the values in folded form (case and accents ignored: "Núñez" and
+#     "nunez" are the same), sorted, for bisect: the values starting with a
+#     prefix are a slice of them, found in logarithmic time;
+#   - the position of every value, and of every shortcut code ("2052" of
+#     "2052-Literal"), in a dict.
+# Prefix matches are ranked by their folded value, then by list position:
+# an exact match comes first, then the others in alphabetical order.
+#   index = prefixIndex.of(self.values)
+#   position = index.first("nun")
+##############################################################################
+
+import bisect
+import unicodedata
+from collections import OrderedDict
+
+import config
+
+MAX_INDEXES = config.PREFIX_INDEX_CACHE    # indexes kept, the most recently used ones
+
+_indexes = OrderedDict()    # id(values) -> PrefixIndex, in LRU order. The index holds its list, so the id stays its own
+
+
+def fold(text):
+    "The form compared by the prefix lookups: lowercase, without accents. 'Núñez' -> 'nunez'"
+    if text.isascii():
+        return text.lower()
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)).casefold()
+
+
+class PrefixIndex():
+    "The sorted folded values of a list, and the positions of its values and shortcut codes."
+    def __init__(self, values):
+        self.values = values
+        entries = sorted((fold(str(value)), position) for position, value in enumerate(values))
+        self.keys = [key for key, position in entries]
+        self.positions = [position for key, position in entries]
+        self.value_positions = {}   # value -> its first position
+        self.code_positions = {}    # shortcut code before "-" -> the first position of a value with it
+        for position, value in enumerate(values):
+            self.value_positions.setdefault(value, position)
+            code, hyphen, literal = str(value).partition("-")
+            if hyphen:
+                self.code_positions.setdefault(code, position)
+
+    def position(self, value):
+        "The position of the value in the list, None if it's not there."
+        return self.value_positions.get(value)
+
+    def code_position(self, code):
+        "The position of the first value with this shortcut code, None if there's none."
+        return self.code_positions.get(code)
+
+    def find(self, value):
+        "The position of a field value: of the value with its shortcut code, or of the value itself. None if not found."
+        code, hyphen, literal = value.partition("-")
+        position = self.code_positions.get(code)
+        if position is None:
+            position = self.value_positions.get(value)
+        return position
+
+    def span(self, prefix):
+        "The slice of self.keys that start with the folded prefix."
+        key = fold(prefix)
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_left(self.keys, key + "\U0010ffff", start)
+        return start, end
+
+    def first(self, prefix):
+        "The position of the best value starting with prefix (case and accents ignored), None if there's none."
+        start, end = self.span(prefix)
+        if start == end:
+            return None
+        return self.positions[start]
+
+    def matches(self, prefix, limit=None):
+        "The positions of the values starting with prefix, best first: limit of them at most."
+        start, end = self.span(prefix)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.positions[start:end]
+
+
+def of(values):
+    "The index of a value list: built the first time, then kept while the list is the same object."
+    key = id(values)
+    index = _indexes.get(key)
+    if index is not None and index.values is values:
+        _indexes.move_to_end(key)
+        return index
+    index = _indexes[key] = PrefixIndex(values)
+    _indexes.move_to_end(key)
+    while len(_indexes) > MAX_INDEXES:
+        _indexes.popitem(last=False)
+    return index
@@ -18,6 +18,8 @@ import npyscreen
 
 import bsWidgets as bs
 import config
+import dbLocking
+import rowSetCache
 
 DATEFORMAT = config.dateFormat
 DBTABLENAME = "'bookstore.Publisher'"
@@ -42,6 +44,11 @@ class PrescriptionForm(npyscreen.FormBaseNew):
 
         self.selectorForm = self.parentApp._Forms['PRESCRIPTIONSELECTOR']
 
+    @property
+    def rowSet(self):
+        "The row set of the selector this form is opened from: its rows and the record read (see rowSetCache.py)."
+        return self.selectorForm.rowSet
+
     def create(self):
         """The standard constructor will call the method .create(), which you should override to create the Form widgets."""
         self.framed = True   # framed form
@@ -77,19 +84,14 @@ class PrescriptionForm(npyscreen.FormBaseNew):
         self.bu_url = self.urlFld.value
 
     def update_fileRow(self):
-        "Updates config.fileRow."
+        "Updates self.rowSet.fileRow."
         if self.current_option != "Delete":
-            id = config.fileRow[0]
-            for row in config.fileRows:
-                if row[0] == id:
-                    config.fileRow = []
-                    config.fileRow.append(row[0])
-                    config.fileRow.append(int(self.numeralFld.value))
-                    config.fileRow.append(self.nameFld.value)
-                    config.fileRow.append(self.addressFld.value)
-                    config.fileRow.append(self.phoneFld.value)
-                    config.fileRow.append(self.urlFld.value)
-                    break
+            self.rowSet.fileRow = [self.rowSet.fileRow[0]]   # the same id: no need to look for the row in self.rowSet.rows
+            self.rowSet.fileRow.append(int(self.numeralFld.value))
+            self.rowSet.fileRow.append(self.nameFld.value)
+            self.rowSet.fileRow.append(self.addressFld.value)
+            self.rowSet.fileRow.append(self.phoneFld.value)
+            self.rowSet.fileRow.append(self.urlFld.value)
 
     def exit_publisher(self):
         "Only for escape-exit, handler version."
@@ -103,9 +105,7 @@ class PrescriptionForm(npyscreen.FormBaseNew):
             self.backup_fields()
         self.selectorForm.grid.update()
 
-        # To unlock the database (for Create) we must disconnect and re-connect:
-        config.conn.close()
-        self.parentApp.connect_database()
+        dbLocking.end_editing(self.parentApp)  # unlock the database, if it was locked
 
         config.parentApp.setNextForm("PUBLISHERSELECTOR")
         config.parentApp.switchFormNow()
@@ -126,14 +126,7 @@ class PrescriptionForm(npyscreen.FormBaseNew):
         "Setting the publisher form to create a new record."
         global form
         conn = config.conn
-        while True:     # for Creation, we must set the locking here
-            try:
-                conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite only allows a single writer per database
-                conn.execute('PRAGMA locking_mode = EXCLUSIVE')
-                conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
-                break
-            except sqlite3.OperationalError:
-                bs.notify_OK("\n    Database is locked, please wait.", "Message")
+        dbLocking.lock_for_editing(conn, create=True)  # for Creation, we must set the locking here (see WAL_MODE)
         form.current_option = "Create"
         form.numeralFld.editable = True
         form.numeralFld.maximum_string_length = 3
@@ -175,8 +168,7 @@ class PrescriptionForm(npyscreen.FormBaseNew):
         "Setting the publisher form for update editing."
         global form
         conn = config.conn
-        conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite3 admits just one writing process
-        conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+        dbLocking.lock_for_editing(conn)   # exclusive access in the old mode, nothing in WAL_MODE
         form.current_option = "Update"
         form.convertDBtoFields()
         form.numeralFld.editable = True
@@ -197,8 +189,7 @@ class PrescriptionForm(npyscreen.FormBaseNew):
         "Setting the publisher form for deleting."
         global form
         conn = config.conn
-        conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite3 admits just one writing process
-        conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+        dbLocking.lock_for_editing(conn)   # exclusive access in the old mode, nothing in WAL_MODE
         form.current_option = "Delete"
         form.convertDBtoFields()
         form.numeralFld.editable = False
@@ -215,11 +206,11 @@ class PrescriptionForm(npyscreen.FormBaseNew):
 
     def convertDBtoFields(self):
         "Convert DB fields into screen fields (strings)."
-        self.numeralFld.value = str(config.fileRow[1])
-        self.nameFld.value = config.fileRow[2]
-        self.addressFld.value = config.fileRow[3]
-        self.phoneFld.value = config.fileRow[4]
-        self.urlFld.value = config.fileRow[5]
+        self.numeralFld.value = str(self.rowSet.fileRow[1])
+        self.nameFld.value = self.rowSet.fileRow[2]
+        self.addressFld.value = self.rowSet.fileRow[3]
+        self.phoneFld.value = self.rowSet.fileRow[4]
+        self.urlFld.value = self.rowSet.fileRow[5]
 
     def strip_fields(self):
         "Required trimming of leading and trailing spaces."
@@ -231,13 +222,13 @@ class PrescriptionForm(npyscreen.FormBaseNew):
     
     def save_mem_record(self):
         "Save new record (from Create) in global variable."
-        config.fileRow = []
-        config.fileRow.append(None)    # ID field is incremental, fulfilled later
-        config.fileRow.append(int(self.numeralFld.value))
-        config.fileRow.append(self.nameFld.value)
-        config.fileRow.append(self.addressFld.value)
-        config.fileRow.append(self.phoneFld.value)
-        config.fileRow.append(self.urlFld.value)
+        self.rowSet.fileRow = []
+        self.rowSet.fileRow.append(None)    # ID field is incremental, fulfilled later
+        self.rowSet.fileRow.append(int(self.numeralFld.value))
+        self.rowSet.fileRow.append(self.nameFld.value)
+        self.rowSet.fileRow.append(self.addressFld.value)
+        self.rowSet.fileRow.append(self.phoneFld.value)
+        self.rowSet.fileRow.append(self.urlFld.value)
     
     def createOKbtn_function(self):
         "OK button function under Create mode."
@@ -249,7 +240,8 @@ class PrescriptionForm(npyscreen.FormBaseNew):
         else:
             if self.exist_changes():
                 self.save_mem_record()  # backup record in config variable
-                self.save_created_publisher()
+                if not self.save_created_publisher():
+                    return  # back to the form
                 self.selectorForm.grid.set_highlight_row(int(self.numeralFld.value))
             else:
                 self.exitPublisher(modified=False)
@@ -278,25 +270,25 @@ class PrescriptionForm(npyscreen.FormBaseNew):
         "Button based Delete function for D=Delete."
         conn = config.conn
         cur = conn.cursor()
-        id = config.fileRow[0]
+        id = self.rowSet.fileRow[0]
+        index = self.rowSet.rows.position_of_id(id)     # for positioning, while the row is still there
         sqlQuery = "DELETE FROM " + DBTABLENAME + " WHERE id = " + str(id)
-        cur.execute(sqlQuery)
-        conn.commit()
+        with dbLocking.write_transaction(conn):
+            cur.execute(sqlQuery)
+        rowSetCache.wrote(DBTABLENAME)
         bs.notify("\n       Record deleted", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        # update config.fileRows:
-        index = 0           # for positioning
-        for row in config.fileRows:
-            if row[0] == id:
-                config.fileRows.remove(row)
-                break
-            index += 1
-        # update config.fileRow to the previous record in list:
+        # update self.rowSet.rows:
+        if index is None:
+            index = len(self.rowSet.rows)
+        else:
+            self.rowSet.rows.remove(self.rowSet.rows[index])
+        # update self.rowSet.fileRow to the previous record in list:
         if index > 0:
             index -= 1
         try:
-            config.fileRow = config.fileRows[index]
+            self.rowSet.fileRow = self.rowSet.rows[index]
         except IndexError:  # there are no rows in the table
-            config.fileRow = []
+            self.rowSet.fileRow = []
         self.exitPublisher(modified=True)
 
     def deleteOKbtn_function(self):
@@ -304,7 +296,7 @@ class PrescriptionForm(npyscreen.FormBaseNew):
         # You cannot delete a publisher if it's in a book record
         conn = config.conn
         cur = conn.cursor()
-        num = config.fileRow[1]
+        num = self.rowSet.fileRow[1]
         sqlQuery = "SELECT id FROM 'bookstore.book' WHERE publisher_num = ?"
         cur.execute(sqlQuery, (str(num),) )
         try:
@@ -323,7 +315,7 @@ class PrescriptionForm(npyscreen.FormBaseNew):
             if bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
                 self.delete_publisher()
                 try:
-                    numeral = config.fileRow[1]
+                    numeral = self.rowSet.fileRow[1]
                 except IndexError:  # there are no rows in the table
                     numeral = None
                 self.selectorForm.grid.set_highlight_row(numeral)
@@ -379,7 +371,7 @@ class PrescriptionForm(npyscreen.FormBaseNew):
 
         # repeated value check: numeral and name fields
         if self.numeralFld.value != self.bu_numeral or self.nameFld.value != self.bu_name:
-            for row in config.fileRows:
+            for row in self.rowSet.rows:
                 self.ok_button.editing = False
                 # Already exists and it's not itself
                 if row[1] == int(self.numeralFld.value) and self.numeralFld.value != self.bu_numeral:
@@ -412,46 +404,54 @@ class PrescriptionForm(npyscreen.FormBaseNew):
         cur = conn.cursor()
         sqlQuery = "INSERT INTO " + DBTABLENAME + " (numeral,name,address,phone,url) VALUES (?,?,?,?,?)"
         values = (self.numeralFld.value, self.nameFld.value, self.addressFld.value, self.phoneFld.value, self.urlFld.value)
-        cur.execute(sqlQuery, values)
-        conn.commit()
-        conn.isolation_level = None     # free the multiuser lock
-        config.fileRow[0] = cur.lastrowid
+        try:
+            with dbLocking.write_transaction(conn):     # the only write lock, and just for the INSERT
+                cur.execute(sqlQuery, values)
+        except sqlite3.IntegrityError:  # another terminal may have just taken the same numeral
+            bs.notify_OK("\n     Numeral or name of publisher already exists. ", "Message")
+            return False
+        rowSetCache.wrote(DBTABLENAME)
+        self.rowSet.fileRow[0] = cur.lastrowid
         bs.notify("\n       Record created", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        # update config.fileRows:
+        # update self.rowSet.rows:
         new_record = []
-        new_record.append(config.fileRow[0])    # id
+        new_record.append(self.rowSet.fileRow[0])    # id
         new_record.append(int(self.numeralFld.value))
         new_record.append(self.nameFld.value)
         new_record.append(self.addressFld.value)
         new_record.append(self.phoneFld.value)
         new_record.append(self.urlFld.value)
-        config.fileRows.append(new_record)
+        self.rowSet.rows.append(new_record)
         self.exitPublisher(modified=True)
+        return True
 
     def save_updated_publisher(self):
         "Button based Save function for U=Update."
+        # Plain UPDATE, no row_version check: 'bookstore.Publisher' is not one of the
+        # optidrome tables dbInitialize migrates, so it has no version column (see dbLocking).
 
         cur = config.conn.cursor()
 
-        # Change all the book.publisher_num's
-        if self.numeralFld.value != self.bu_numeral:
-            sqlQuery = "UPDATE 'bookstore.book' SET publisher_num=? WHERE publisher_num=?"
-            values = (self.numeralFld.value, self.bu_numeral)
-            cur.execute(sqlQuery, values)
-            config.conn.commit()
-
-        # Update publisher record
-        sqlQuery = "UPDATE " + DBTABLENAME + " SET numeral=?, name=?, address=?, phone=?, url=? WHERE id=?"
-        values = (self.numeralFld.value, self.nameFld.value, self.addressFld.value, self.phoneFld.value, self.urlFld.value, config.fileRow[0])
         try:
-            cur.execute(sqlQuery, values)
-            config.conn.commit()
+            with dbLocking.write_transaction(config.conn):  # both updates or none
+                # Change all the book.publisher_num's
+                if self.numeralFld.value != self.bu_numeral:
+                    sqlQuery = "UPDATE 'bookstore.book' SET publisher_num=? WHERE publisher_num=?"
+                    values = (self.numeralFld.value, self.bu_numeral)
+                    cur.execute(sqlQuery, values)
+
+                # Update publisher record
+                sqlQuery = "UPDATE " + DBTABLENAME + " SET numeral=?, name=?, address=?, phone=?, url=? WHERE id=?"
+                values = (self.numeralFld.value, self.nameFld.value, self.addressFld.value, self.phoneFld.value, self.urlFld.value, self.rowSet.fileRow[0])
+                cur.execute(sqlQuery, values)
         except sqlite3.IntegrityError:
             bs.notify_OK("\n     Numeral or name of publisher already exists. ", "Message")
-            return
+            return False
+        rowSetCache.wrote(DBTABLENAME)
 
         bs.notify("\n       Record saved", title="Message", form_color='STANDOUT', wrap=True, wide=False)
         self.exitPublisher(modified=True)
+        return True
         
     def updateOKbtn_function(self):
         "OK button function under Update mode."
@@ -462,7 +462,8 @@ class PrescriptionForm(npyscreen.FormBaseNew):
             return
         else:
             if self.exist_changes():
-                self.save_updated_publisher()
+                if not self.save_updated_publisher():
+                    return  # back to the form
                 self.selectorForm.grid.set_highlight_row(int(self.numeralFld.value))
             else:
                 self.selectorForm.grid.set_highlight_row(int(self.numeralFld.value))
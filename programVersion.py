@@ -0,0 +1,50 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     programVersion.py - Build/install step: stores the program version
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Run it when building or installing a release, from the git working copy:
+#     python programVersion.py
+# It writes the last git tag into Data/program.json, which config reads the
+# first time config.program_version is used. The program itself never spawns
+# git nor writes that file, so it also runs from read-only data shares.
+##############################################################################
+
+import json
+import subprocess
+import sys
+
+import config
+
+
+def git_version():
+    "Last git tag, like 'v1.0'; '' outside a git repository."
+    try:
+        return subprocess.run(["git", "describe", "--tags", "--abbrev=0"], \
+            capture_output=True, text=True).stdout.strip('\n')[:4]
+    except FileNotFoundError:   # no git command
+        return ""
+
+def write_version_file(program_version):
+    data = {'program': [ {'version' : program_version} ] }
+    with open(config.versionFilename, 'w') as outfile:
+        outfile.write(json.dumps(data))
+
+
+def main():
+    program_version = git_version()
+    if program_version == "":
+        print("\n " + config.pname + ": no git tag found, " + config.versionFilename + " was not written.\n")
+        sys.exit(1)
+    write_version_file(program_version)
+    print(config.pname + " " + program_version + " -> " + config.versionFilename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     records.py - Record rules and writes, without a screen
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# The business logic of the record forms: value checks, and the INSERT,
+# UPDATE and DELETE of every kind of record, taking a dict of column values.
+# The forms call it with their fields' values; optidrome.py calls it for the
+# command line batch mode. Nothing here touches a widget or a selector's row set
+# (a write just marks the table's row sets stale, see rowSetCache.py):
+# a check raises ValidationError with the label of the wrong field, and the
+# writes run inside the caller's dbLocking.write_transaction().
+##############################################################################
+
+import base64
+import sqlite3
+
+import collation
+import dbLocking
+import rowSetCache
+
+PATIENT = "'optidrome.patient'"
+USER = "'optidrome.user'"
+RXORDER = "'optidrome.rxorder'"
+PRESCRIPTION = "'optidrome.prescription'"
+
+PATIENT_COLUMNS = ["mrn", "name", "dob", "phone", "email", "address", "notes"]
+USER_COLUMNS = ["numeral", "user", "user_name", "user_level", "creation_date", "password"]
+
+
+class ValidationError(Exception):
+    "A value the record rules refuse. 'field' is the label of the wrong field in its form."
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+        self.message = message
+
+
+def table_columns(conn, tablename):
+    return [row[1] for row in conn.execute("PRAGMA table_info(" + tablename + ")")]
+
+def taken(conn, tablename, column, value, id=None):
+    "Another record than 'id' already has this value."
+    sqlQuery = "SELECT 1 FROM " + tablename + " WHERE " + column + " = ? AND id IS NOT ?"
+    return conn.execute(sqlQuery, (value, id)).fetchone() is not None
+
+def find(conn, entity, key):
+    "Current record of a kind by its key, as a dict with its id and row_version; None if it doesn't exist."
+    tablename, keyColumn = ENTITIES[entity][:2]
+    cur = conn.execute("SELECT * FROM " + tablename + " WHERE " + keyColumn + " = ?", (key,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip([d[0] for d in cur.description], row))
+
+def next_key(conn, entity):
+    "Last key + 1, the default key of a new record."
+    tablename, keyColumn = ENTITIES[entity][:2]
+    row = conn.execute("SELECT MAX(" + keyColumn + ") FROM " + tablename).fetchone()
+    return (row[0] or 0) + 1
+
+def insert(cur, tablename, values):
+    "INSERT of a dict of column values. Returns the new id."
+    columns = list(values)
+    sqlQuery = "INSERT INTO " + tablename + " (" + ",".join(columns) + ") VALUES (" + ",".join("?" * len(columns)) + ")"
+    cur.execute(sqlQuery, [values[column] for column in columns])
+    rowSetCache.wrote(tablename)
+    return cur.lastrowid
+
+def update(cur, tablename, id, values, version):
+    "Compare-and-swap UPDATE of a dict of column values (see dbLocking.update_row). Returns the new version."
+    columns = ", ".join(column + "=?" for column in values)
+    version = dbLocking.update_row(cur, tablename, columns, list(values.values()), id, version)
+    rowSetCache.wrote(tablename)
+    return version
+
+def delete_record(cur, tablename, id):
+    cur.execute("DELETE FROM " + tablename + " WHERE id = ?", (id,))
+    rowSetCache.wrote(tablename)
+
+
+def mandatory(values, fields):
+    "fields: [(column, label)]. The first empty one raises."
+    for column, label in fields:
+        if values.get(column) is None or str(values[column]).strip() == "":
+            raise ValidationError(label, "Error:  Mandatory field is empty")
+
+def integer(values, column, label, message):
+    try:
+        int(values[column])
+    except (ValueError, TypeError):
+        raise ValidationError(label, message)
+
+def unique(conn, entity, values, id=None):
+    "The UNIQUE values of a kind of record: (column, type, label, message)."
+    for column, type, label, message in UNIQUE[entity]:
+        if taken(conn, ENTITIES[entity][0], column, type(values[column]), id):
+            raise ValidationError(label, message)
+
+def referenced(conn, entity, values):
+    "The records a kind of record points to: (column, table, key column, label, message)."
+    for column, tablename, keyColumn, label, message in REFERENCES.get(entity, []):
+        if conn.execute("SELECT 1 FROM " + tablename + " WHERE " + keyColumn + " = ?", (values[column],)).fetchone() is None:
+            raise ValidationError(label, message)
+
+def known_columns(conn, entity, values):
+    unknown = set(values) - set(table_columns(conn, ENTITIES[entity][0]))
+    if unknown:
+        raise ValidationError("", "Error: Unknown " + entity + " columns: " + ", ".join(sorted(unknown)))
+
+def with_patient_name(tablename, values, name, name_key=None):
+    "A record's columns, but its id and version, with the patient's name (and its sort key, if the table has one) copied."
+    row = dict(values)
+    row.pop("id", None)
+    row.pop(dbLocking.VERSION_COLUMN, None)
+    row["patient_name"] = name
+    if ("patient_name", "patient_name_key") in collation.SORT_KEYS.get(tablename, []):
+        row["patient_name_key"] = collation.sort_key(name) if name_key is None else name_key
+    return row
+
+def patient_name(cur, mrn):
+    return cur.execute("SELECT name FROM " + PATIENT + " WHERE mrn = ?", (mrn,)).fetchone()[0]
+
+#------------------------------------------------------------------------------
+# Patients
+
+def patient_rules(values):
+    "The checks of a patient's own values, before comparing with the other records."
+    mandatory(values, [("mrn", "MRN:"), ("name", "Name:")])
+    integer(values, "mrn", "MRN:", "Error: MRN must be integer")
+
+def check_patient(conn, values, id=None):
+    "Raises ValidationError on the first wrong value. 'id' is the record being updated, None on creation."
+    patient_rules(values)
+    unique(conn, "patient", values, id)
+
+def patient_values(values):
+    "All the patient columns, and the name's sort key and folded form."
+    row = {column: values.get(column, "") for column in PATIENT_COLUMNS}
+    row["name_key"] = collation.sort_key(row["name"])
+    row["name_fold"] = collation.fold_key(row["name"])
+    return row
+
+def create_patient(cur, values):
+    return insert(cur, PATIENT, patient_values(values))
+
+def update_patient(cur, id, values, version):
+    "Saves the patient and moves their orders to a new MRN. Returns the new version."
+    old_mrn = cur.execute("SELECT mrn FROM " + PATIENT + " WHERE id = ?", (id,)).fetchone()
+    if old_mrn is not None and str(old_mrn[0]) != str(values["mrn"]):
+        cur.execute("UPDATE " + RXORDER + " SET patient_mrn=? WHERE patient_mrn=?", (values["mrn"], old_mrn[0]))
+        rowSetCache.wrote(RXORDER)
+    return update(cur, PATIENT, id, patient_values(values), version)
+
+def patient_in_orders(conn, mrn):
+    "A patient listed in an order can't be deleted."
+    return conn.execute("SELECT 1 FROM " + RXORDER + " WHERE patient_mrn = ? LIMIT 1", (mrn,)).fetchone() is not None
+
+def delete_patient(cur, id, mrn):
+    if patient_in_orders(cur.connection, mrn):
+        raise ValidationError("MRN:", "Error: Patient is listed in an order")
+    delete_record(cur, PATIENT, id)
+
+#------------------------------------------------------------------------------
+# Users
+
+def user_rules(values):
+    "The checks of a user's own values, before comparing with the other records."
+    mandatory(values, [("numeral", "Numeral:"), ("user", "User:"), ("creation_date", "Creation date:"), \
+        ("password", "Encrypted password:")])
+    integer(values, "numeral", "Numeral:", "Error: Numeral must be an integer")
+    if " " in values["user"]:
+        raise ValidationError("User:", "Error: User must be a single word")
+    integer(values, "user_level", "User level:", "Error: User level must be integer")
+    if " " in values["password"]:
+        raise ValidationError("Encrypted password:", "Error: Password must be a single word")
+    if not values["user"][0].isalpha():
+        raise ValidationError("User:", "Error: User field must start with a letter")
+    if not values["user"].isalnum():
+        raise ValidationError("User:", "Error: User field must be alphanumeric")
+
+def check_user(conn, values, id=None):
+    "Raises ValidationError on the first wrong value. 'id' is the record being updated, None on creation."
+    user_rules(values)
+    unique(conn, "user", values, id)
+
+def encrypt_password(password):
+    "Quick'n'dirty encryption of a password, as stored."
+    return repr(base64.b64encode(password.encode('utf-8')))[2:-1]
+
+def user_values(values):
+    return {column: values.get(column, "") for column in USER_COLUMNS}
+
+def create_user(cur, values):
+    return insert(cur, USER, user_values(values))
+
+def update_user(cur, id, values, version):
+    return update(cur, USER, id, user_values(values), version)
+
+def delete_user(cur, id, numeral):
+    delete_record(cur, USER, id)
+
+#------------------------------------------------------------------------------
+# Orders: any rxorder columns, like the ones of a lab feed
+
+def order_rules(values):
+    "The checks of an order's own values, before comparing with the other records."
+    mandatory(values, [("job", "Job:"), ("patient_mrn", "Patient:")])
+    integer(values, "job", "Job:", "Error: Job must be integer")
+    integer(values, "patient_mrn", "Patient:", "Error: Patient MRN must be integer")
+
+def check_order(conn, values, id=None):
+    "Raises ValidationError on the first wrong value. 'id' is the record being updated, None on creation."
+    order_rules(values)
+    known_columns(conn, "order", values)
+    unique(conn, "order", values, id)
+    referenced(conn, "order", values)
+
+def create_order(cur, values):
+    return insert(cur, RXORDER, with_patient_name(RXORDER, values, patient_name(cur, values["patient_mrn"])))
+
+def update_order(cur, id, values, version):
+    return update(cur, RXORDER, id, with_patient_name(RXORDER, values, patient_name(cur, values["patient_mrn"])), version)
+
+def delete_order(cur, id, job):
+    if cur.execute("SELECT 1 FROM " + PRESCRIPTION + " WHERE rxorder_job = ? LIMIT 1", (job,)).fetchone():
+        raise ValidationError("Job:", "Error: Order has a prescription")
+    delete_record(cur, RXORDER, id)
+
+#------------------------------------------------------------------------------
+# Prescriptions: one per order
+
+def prescription_rules(values):
+    "The checks of a prescription's own values, before comparing with the other records."
+    mandatory(values, [("rx_num", "Rx number:"), ("rxorder_job", "Job:"), ("patient_mrn", "Patient:"), ("date", "Date:"), \
+        ("expiration", "Expiration:"), ("rx_type", "Rx type:"), ("doctor", "Doctor:"), ("doctor_phone", "Doctor phone:")])
+    integer(values, "rx_num", "Rx number:", "Error: Rx number must be integer")
+    integer(values, "rxorder_job", "Job:", "Error: Job must be integer")
+    integer(values, "patient_mrn", "Patient:", "Error: Patient MRN must be integer")
+
+def check_prescription(conn, values, id=None):
+    "Raises ValidationError on the first wrong value. 'id' is the record being updated, None on creation."
+    prescription_rules(values)
+    known_columns(conn, "prescription", values)
+    unique(conn, "prescription", values, id)
+    referenced(conn, "prescription", values)
+
+def create_prescription(cur, values):
+    return insert(cur, PRESCRIPTION, with_patient_name(PRESCRIPTION, values, patient_name(cur, values["patient_mrn"])))
+
+def update_prescription(cur, id, values, version):
+    return update(cur, PRESCRIPTION, id, with_patient_name(PRESCRIPTION, values, patient_name(cur, values["patient_mrn"])), version)
+
+def delete_prescription(cur, id, rx_num):
+    delete_record(cur, PRESCRIPTION, id)
+
+
+# Record kinds: name -> (table, key column, check, create, update, delete)
+ENTITIES = {"patient": (PATIENT, "mrn", check_patient, create_patient, update_patient, delete_patient),
+            "user": (USER, "numeral", check_user, create_user, update_user, delete_user),
+            "order": (RXORDER, "job", check_order, create_order, update_order, delete_order),
+            "prescription": (PRESCRIPTION, "rx_num", check_prescription, create_prescription, update_prescription, \
+                delete_prescription)
+            }
+
+# Checks of the record's own values, the same for a form, a batch or a bulk import
+RULES = {"patient": patient_rules, "user": user_rules, "order": order_rules, "prescription": prescription_rules}
+
+# Values no other record of the kind may have: (column, type, label, message)
+UNIQUE = {  "patient": [("mrn", int, "MRN:", "Error:  MRN already exists"), ("name", str, "Name:", "Error:  Name already exists")],
+            "user": [("numeral", int, "Numeral:", "Error:  Numeral already exists"), ("user", str, "User:", "Error:  User already exists")],
+            "order": [("job", int, "Job:", "Error:  Job number of order already exists")],
+            "prescription": [("rx_num", int, "Rx number:", "Error:  Rx number already exists"), \
+                ("rxorder_job", int, "Job:", "Error:  Order already has a prescription")]
+            }
+
+# Records that must exist: (column, table, key column, label, message)
+REFERENCES = {  "order": [("patient_mrn", PATIENT, "mrn", "Patient:", "Error: Patient was not found")],
+                "prescription": [("rxorder_job", RXORDER, "job", "Job:", "Error: Order was not found"), \
+                    ("patient_mrn", PATIENT, "mrn", "Patient:", "Error: Patient was not found")]
+                }
+
+
+def save(cur, entity, values, update=False):
+    """ creates a record from its column values, or updates the one with the same key
+    :param update: the key may exist: its record gets the given values, the others are kept
+    :return: "created" or "updated"
+    """
+    keyColumn, check, create_function = ENTITIES[entity][1], ENTITIES[entity][2], ENTITIES[entity][3]
+    conn = cur.connection
+    if values.get(keyColumn, "") == "":
+        values = dict(values, **{keyColumn: next_key(conn, entity)})
+    if update and find(conn, entity, values[keyColumn]) is not None:
+        change(cur, entity, values[keyColumn], values)
+        return "updated"
+    check(conn, values)     # an existing key is refused here
+    create_function(cur, values)
+    return "created"
+
+def change(cur, entity, key, values):
+    "Updates the record with this key: it gets the given values (a new key too), the others are kept."
+    check, update_function = ENTITIES[entity][2], ENTITIES[entity][4]
+    current = find(cur.connection, entity, key)
+    if current is None:
+        raise ValidationError("", "Error: " + entity.capitalize() + " " + str(key) + " was not found")
+    merged = dict(current, **values)
+    check(cur.connection, merged, current["id"])
+    update_function(cur, current["id"], merged, current[dbLocking.VERSION_COLUMN])
+
+def remove(cur, entity, key):
+    "Deletes the record with this key, if its rules allow it."
+    current = find(cur.connection, entity, key)
+    if current is None:
+        raise ValidationError("", "Error: " + entity.capitalize() + " " + str(key) + " was not found")
+    ENTITIES[entity][5](cur, current["id"], current[ENTITIES[entity][1]])
+
+def import_rows(conn, entity, rows, update=False):
+    """ saves many records in one write transaction; a wrong row is skipped, not the others
+    :param rows: iterable of dicts of column values, like a csv.DictReader
+    :return: ({"created": n, "updated": n}, [(row number, error message)])
+    """
+    counts = {"created": 0, "updated": 0}
+    errors = []
+    cur = conn.cursor()
+    with dbLocking.write_transaction(conn, interactive=False):
+        for number, values in enumerate(rows, 1):
+            try:
+                counts[save(cur, entity, values, update)] += 1
+            except ValidationError as e:
+                errors.append((number, e.message))
+            except sqlite3.IntegrityError as e:     # the schema's constraints: only this statement is undone
+                errors.append((number, "Error: " + str(e)))
+    return counts, errors
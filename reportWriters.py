@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     reportWriters.py - Streamed output formats for the listings
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# A listing is a list of columns, (name, text width), and an iterable of
+# rows. write_report() streams the rows into the file through the writer of
+# the chosen format, one row at a time:
+#   - "Text":       the fixed-width report, for people and the text viewer
+#   - "CSV":        header line + one line per row
+#   - "JSON Lines": one json object per row
+#   - "Columnar":   compact binary, columns stored together in row groups of
+#                   ROW_GROUP_SIZE rows; read it back with read_columnar()
+##############################################################################
+
+import csv
+import json
+import struct
+
+ROW_GROUP_SIZE = 4096   # rows kept in memory by the columnar writer
+
+COLUMNAR_MAGIC = b"OCOL1\n"     # Columnar file layout, little endian:
+                                #   magic, uint32 header length, json header {"columns": [names]}
+                                #   row groups: uint32 row count (0 ends the file), then for each column:
+                                #       null bitmap (1 bit per row), type code byte, values of the non-null rows:
+                                #       b"q" int64s, b"d" float64s, b"s" uint32 lengths + utf-8 bytes,
+                                #       b"k" repetitive strings: uint32 count + b"s" of the distinct ones + uint16 indexes
+
+
+class TextReportWriter:
+    """ Fixed-width columns, header and dashed lines. The writers of the other formats override its
+    begin(), write_row() and end(); the file is opened and closed by write_report().
+    """
+    extension = ".txt"
+    binary = False      # open mode of the file
+
+    def __init__(self, f, columns, newline="\n"):
+        self.f = f
+        self.columns = columns      # [(name, width), ...]
+        self.newline = newline
+
+    def line(self):
+        return "-" * sum(width for name, width in self.columns) + self.newline
+
+    def begin(self):
+        self.f.write("".join(name.ljust(width) for name, width in self.columns) + self.newline + self.line())
+
+    def write_row(self, row):
+        fields = []
+        for (name, width), value in zip(self.columns, row):
+            if value is None:
+                value = ""
+            fields.append(str(value)[:width - 1].ljust(width))   # a space between columns
+        fields[-1] = str(row[-1] or "").ljust(self.columns[-1][1])  # the last one isn't truncated
+        self.f.write("".join(fields) + self.newline)
+
+    def end(self):
+        self.f.write(self.line())   # final line
+
+
+class CsvReportWriter(TextReportWriter):
+    extension = ".csv"
+
+    def begin(self):
+        self.writer = csv.writer(self.f)
+        self.writer.writerow([name for name, width in self.columns])
+
+    def write_row(self, row):
+        self.writer.writerow(["" if value is None else value for value in row])
+
+    def end(self):
+        pass
+
+
+class JsonLinesReportWriter(TextReportWriter):
+    extension = ".jsonl"
+
+    def begin(self):
+        self.names = [name for name, width in self.columns]
+
+    def write_row(self, row):
+        self.f.write(json.dumps(dict(zip(self.names, row)), ensure_ascii=False) + "\n")
+
+    def end(self):
+        pass
+
+
+class ColumnarReportWriter(TextReportWriter):
+    "Compact binary columns, see COLUMNAR_MAGIC. Memory is bounded by ROW_GROUP_SIZE."
+    extension = ".ocol"
+    binary = True
+
+    def begin(self):
+        header = json.dumps({"columns": [name for name, width in self.columns]}).encode("utf-8")
+        self.f.write(COLUMNAR_MAGIC + struct.pack("<I", len(header)) + header)
+        self.rows = []
+
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) == ROW_GROUP_SIZE:
+            self.write_row_group()
+
+    def end(self):
+        if self.rows:
+            self.write_row_group()
+        self.f.write(struct.pack("<I", 0))
+
+    def write_row_group(self):
+        nrows = len(self.rows)
+        self.f.write(struct.pack("<I", nrows))
+        for column in zip(*self.rows):
+            bitmap = bytearray((nrows + 7) // 8)
+            values = []
+            for i, value in enumerate(column):
+                if value is None:
+                    bitmap[i // 8] |= 1 << (i % 8)
+                else:
+                    values.append(value)
+            self.f.write(bytes(bitmap))
+            if all(type(value) is int for value in values):
+                self.f.write(b"q" + struct.pack("<%dq" % len(values), *values))
+            elif all(type(value) in (int, float) for value in values):
+                self.f.write(b"d" + struct.pack("<%dd" % len(values), *values))
+            else:
+                values = [str(value) for value in values]
+                distinct = list(dict.fromkeys(values))
+                if len(distinct) <= len(values) // 2 and len(distinct) < 65536:   # dictionary-encoded
+                    positions = {value: i for i, value in enumerate(distinct)}
+                    self.f.write(b"k" + struct.pack("<I", len(distinct)) + self.packed_strings(distinct) + \
+                        struct.pack("<%dH" % len(values), *[positions[value] for value in values]))
+                else:
+                    self.f.write(b"s" + self.packed_strings(values))
+        self.rows = []
+
+    def packed_strings(self, values):
+        encoded = [value.encode("utf-8") for value in values]
+        return struct.pack("<%dI" % len(encoded), *[len(e) for e in encoded]) + b"".join(encoded)
+
+
+WRITERS = { "Text": TextReportWriter,
+            "CSV": CsvReportWriter,
+            "JSON Lines": JsonLinesReportWriter,
+            "Columnar": ColumnarReportWriter
+            }
+
+
+def write_report(filename, format, columns, rows, newline="\n"):
+    """ streams rows into filename, in one of the WRITERS formats
+    :param columns: [(name, text width), ...]
+    :param rows: any iterable, like a cursor or a generator
+    :return: number of rows written
+    """
+    writerClass = WRITERS[format]
+    if writerClass.binary:
+        f = open(filename, "wb")
+    else:
+        f = open(filename, "w", encoding="utf-8", newline="")     # writers choose their own line ends
+    count = 0
+    with f:
+        writer = writerClass(f, columns, newline)
+        writer.begin()
+        for row in rows:
+            writer.write_row(row)
+            count += 1
+        writer.end()
+    return count
+
+
+def unpack_strings(f, count):
+    lengths = struct.unpack("<%dI" % count, f.read(4 * count))
+    return [f.read(n).decode("utf-8") for n in lengths]
+
+def read_columnar(filename):
+    "Rows of a Columnar file, row group by row group."
+    with open(filename, "rb") as f:
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(filename + ": not a columnar report")
+        length, = struct.unpack("<I", f.read(4))
+        ncolumns = len(json.loads(f.read(length))["columns"])
+        while True:
+            nrows, = struct.unpack("<I", f.read(4))
+            if nrows == 0:
+                return
+            columns = []
+            for c in range(ncolumns):
+                bitmap = f.read((nrows + 7) // 8)
+                nulls = [bool(bitmap[i // 8] & (1 << (i % 8))) for i in range(nrows)]
+                nvalues = nulls.count(False)
+                code = f.read(1)
+                if code == b"s":
+                    values = unpack_strings(f, nvalues)
+                elif code == b"k":
+                    ndistinct, = struct.unpack("<I", f.read(4))
+                    distinct = unpack_strings(f, ndistinct)
+                    values = [distinct[i] for i in struct.unpack("<%dH" % nvalues, f.read(2 * nvalues))]
+                else:
+                    values = list(struct.unpack("<%d%s" % (nvalues, code.decode()), f.read(8 * nvalues)))
+                values.reverse()
+                columns.append([None if null else values.pop() for null in nulls])
+            yield from zip(*columns)
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     rowSetCache.py - The selectors' row sets, kept between visits
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Every selector has its own row sets: the full set and its recent Find
+# subsets, keyed by table and Find literal. A row set keeps its rows and the
+# selected row (what used to be the shared config.fileRows, fileRow,
+# currentRow and screenRow). A selector's rowSet is its table's current()
+# one, and its record forms use the selector's. Coming back to a selector shows its last row set as it was,
+# without reading the table again, unless something was written to it:
+#   - this terminal's writes bump the table's write generation (wrote(),
+#     called by records.py and the forms that write with their own SQL);
+#   - another terminal's commits change SQLite's PRAGMA data_version.
+# A stale row set is brought up to date with the change log lines of its
+# table after its position (changeLog.py): only the inserted, updated or
+# deleted rows are read. It is read again if the log doesn't go back that
+# far, or if a Find subset may have gained rows.
+##############################################################################
+
+from collections import OrderedDict
+
+import changeLog
+import config
+
+MAX_SUBSETS = config.ROW_SET_CACHE     # Find subsets kept, all the selectors together
+# Grids that show another table's columns: a change of those records makes their rows stale too
+SHOWS = {"'optidrome.rxorder'": ["'optidrome.patient'"], "'optidrome.prescription'": ["'optidrome.patient'"]}  # the patient's name
+
+_row_sets = OrderedDict()   # (table, Find literal or None) -> RowSet, in LRU order
+_current = {}               # table -> the RowSet its selector showed last
+_generations = {}           # table -> number of writes by this terminal
+
+
+class RowSet():
+    "A selector's full set or Find subset, and its selected row."
+    def __init__(self, tablename, find=None):
+        self.tablename = tablename
+        self.find = find            # the Find literal, None for the full set
+        self.rows = None            # a rowSource.PagedRowSource or IndexedRows
+        self.fileRow = None         # the record read by the selector
+        self.currentRow = 0         # the key of the grid's selected row
+        self.screenRow = None       # the grid position of the record
+        self.stamp = None           # (write generation, data_version) when the rows were read or brought up to date
+        self.seq = 0                # the change log position they are up to date with
+
+
+def data_version():
+    "SQLite's counter of the commits of other connections."
+    return config.conn.execute("PRAGMA data_version").fetchone()[0]
+
+def stamp(tablename):
+    "(write generation, data_version): it changes with every write to the table, and with other terminals' commits."
+    return (_generations.get(tablename, 0), data_version())
+
+def wrote(*tablenames):
+    "This terminal has written to these tables: their row sets are stale."
+    for tablename in tablenames:
+        for stale in [tablename] + [shown for shown, sources in SHOWS.items() if tablename in sources]:
+            _generations[stale] = _generations.get(stale, 0) + 1
+
+def row_set(tablename, find=None):
+    "The row set of a table and Find literal, a new empty one the first time."
+    key = (tablename, find)
+    if key in _row_sets:
+        _row_sets.move_to_end(key)
+        return _row_sets[key]
+    rowSet = _row_sets[key] = RowSet(tablename, find)
+    subsets = [key for key in _row_sets if key[1] is not None and _row_sets[key] not in _current.values()]
+    for key in subsets[:len(subsets) - MAX_SUBSETS]:    # the least recently used ones, but the ones on screen
+        del _row_sets[key]
+    return rowSet
+
+def current(tablename):
+    "The row set a selector showed last: its full set the first time."
+    return _current.get(tablename) or row_set(tablename)
+
+def activate(rowSet):
+    "Makes it the selector's current row set: the one behind its rowSet."
+    previous = _current.get(rowSet.tablename)
+    if previous is not None and previous is not rowSet:     # the selector changes sets: the record it read stays
+        rowSet.fileRow, rowSet.currentRow = previous.fileRow, previous.currentRow
+    _current[rowSet.tablename] = rowSet
+    return rowSet
+
+def position(tablename):
+    "Where the table's changes stand now: taken before reading a row set's rows, for loaded()."
+    return stamp(tablename), changeLog.last_seq(config.conn)
+
+def loaded(rowSet, position):
+    "Its rows have been read from the DB, after position() was taken."
+    rowSet.stamp, rowSet.seq = position
+
+def is_fresh(rowSet):
+    "It has rows, and nothing has been written to its table since they were read."
+    return rowSet.rows is not None and rowSet.stamp == stamp(rowSet.tablename)
+
+def bring_up_to_date(rowSet):
+    """ applies the change log lines of its table since its rows were read
+    :return: True if its rows are up to date, False if they must be read (again)
+    """
+    if rowSet.rows is None:
+        return False
+    if is_fresh(rowSet):
+        return True
+    now = stamp(rowSet.tablename)
+    tablenames = [rowSet.tablename] + SHOWS.get(rowSet.tablename, [])
+    changes = changeLog.changes(config.conn, tablenames, rowSet.seq)
+    if changes is None:     # the log has been pruned since
+        return False
+    if any(tablename != rowSet.tablename and op != "I" for seq, tablename, op, id, key in changes):
+        return False        # a shown record has changed or gone: its rows aren't known
+    if not rowSet.rows.apply_changes([change for change in changes if change[1] == rowSet.tablename]):
+        return False
+    rowSet.stamp = now
+    if changes:
+        rowSet.seq = changes[-1][0]
+    return True
+
+def unchanged(cached):
+    """ something read from a table, with its .tablename, and .stamp and .seq from position():
+    True if none of the table's records has changed since. The change log is only read after a write somewhere.
+    """
+    now = stamp(cached.tablename)
+    if cached.stamp == now:
+        return True
+    if changeLog.changes(config.conn, [cached.tablename], cached.seq) != []:
+        return False
+    cached.stamp = now      # the writes were to other tables
+    return True
@@ -0,0 +1,316 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     rowSource.py - Paged row sources for the selector grids
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# A PagedRowSource behaves like the list of lists that readDBTable() used to
+# return (len(), [index], iteration), but it only keeps a bounded window of
+# pages in memory. Pages are read with keyset pagination on the selector's
+# unique key column (mrn, job, numeral), so scrolling never uses OFFSET over
+# the table rows, and the row count comes from a single COUNT(*) query.
+# Find subsets are IndexedRows lists. Both kinds of row set answer
+# position_of_key() and position_of_id() without walking the rows: an
+# IndexedRows from its dicts; a PagedRowSource from its pages in memory, or
+# else from its fences, the keys at every page_size-th position, read in one
+# pass of the key index the first time: a key's position is its fence's plus
+# a COUNT(*) of the index entries between them, about a page of them.
+# The queries are the table's prepared ones (dataAccess.py) and the rows
+# are its Row namedtuples, unless the selector converts them.
+# apply_changes() brings a row set up to date with the change log lines of
+# its table (changeLog.py): updated rows are read again by id, and an insert
+# or deletion only drops the pages from its key on.
+##############################################################################
+
+import bisect
+from collections import OrderedDict
+
+import config
+
+PAGE_SIZE = config.GRID_PAGE_SIZE       # rows per page
+MAX_PAGES = config.GRID_MAX_PAGES       # pages kept in memory
+
+
+class PagedRowSource():
+    "Sequence-like, keyset-paginated view of a full DB table for the selector grids."
+    def __init__(self, table, convert_row=None, key_index=1, page_size=PAGE_SIZE, max_pages=MAX_PAGES):
+        self.table = table              # a dataAccess.Table, ordered by its unique key column (mrn, job, numeral)
+        self.key_index = key_index      # position of the key in a converted row
+        self.convert_row = convert_row  # DB row -> cRow ("converted row"), selector-supplied; None = the Rows as they come
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.refresh(recount=True)
+
+    def refresh(self, recount=False):
+        "Drops the cached pages, so the rows get read again from the DB on demand."
+        self._pages = OrderedDict()     # page number -> list of cRows, in LRU order
+        self._first_keys = {}           # page number -> key of its first row
+        self._key_positions = {}        # key -> row position, for the pages in memory
+        self._id_positions = {}         # id -> row position, for the pages in memory
+        if recount:
+            self._count = None
+            self._fences = None         # keys at positions 0, page_size, 2*page_size... (see read_fences())
+            self._fences_complete = False   # they go to the end of the table
+
+    def convert(self, filerows):
+        "DB rows to grid rows."
+        if self.convert_row is None:
+            return filerows
+        return [self.convert_row(row) for row in filerows]
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self.table.count()
+        return self._count
+
+    def __getitem__(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError("row index out of range")
+        page = self.get_page(index // self.page_size)
+        try:
+            return page[index % self.page_size]
+        except IndexError:      # the table shrank under us: recount next time
+            self.refresh(recount=True)
+            raise
+
+    def __iter__(self):
+        "Walks the whole table one page at a time, without filling the page cache."
+        table = self.table
+        filerows = table.fetch(table.sqlFirstPage, (self.page_size,))
+        while filerows:
+            rows = self.convert(filerows)
+            for row in rows:
+                yield row
+            if len(filerows) < self.page_size:
+                break
+            last_key = rows[-1][self.key_index]
+            filerows = table.fetch(table.sqlPageAfter, (last_key, self.page_size))
+
+    def get_page(self, number):
+        "Returns a page of rows, reading it from the DB if it is not in the window."
+        if number in self._pages:
+            self._pages.move_to_end(number)
+            return self._pages[number]
+
+        table = self.table
+        size = self.page_size
+        if number == 0:
+            filerows = table.fetch(table.sqlFirstPage, (size,))
+        elif number in self._first_keys:    # seen before
+            filerows = table.fetch(table.sqlPageFrom, (self._first_keys[number], size))
+        elif number - 1 in self._pages:     # scrolling down
+            last_key = self._pages[number - 1][-1][self.key_index]
+            filerows = table.fetch(table.sqlPageAfter, (last_key, size))
+        elif number + 1 in self._first_keys:    # scrolling up: the previous page is always full
+            filerows = table.fetch(table.sqlPageBefore, (self._first_keys[number + 1], size))
+            filerows.reverse()
+        elif number == (len(self) - 1) // size:     # End key: read the last page backwards
+            filerows = table.fetch(table.sqlLastPage, (len(self) - number * size,))
+            filerows.reverse()
+        else:   # random jump: find the page boundary on the key index only, then go on by key
+            boundary = table.scalar(table.sqlKeyAt, (number * size,))
+            if boundary is None:
+                return []
+            filerows = table.fetch(table.sqlPageFrom, (boundary, size))
+
+        page = self.convert(filerows)
+        if len(page) > 0:
+            self._first_keys[number] = page[0][self.key_index]
+        self._pages[number] = page
+        position = number * size
+        for row in page:
+            self._key_positions[row[self.key_index]] = position
+            self._id_positions[row[0]] = position
+            position += 1
+        if len(self._pages) > self.max_pages:
+            number, page = self._pages.popitem(last=False)     # forget the least recently used page
+            for row in page:
+                self._key_positions.pop(row[self.key_index], None)
+                self._id_positions.pop(row[0], None)
+        return page
+
+    def reindex(self):
+        "Builds both position indexes from the pages in memory."
+        self._key_positions = {}
+        self._id_positions = {}
+        for number, page in self._pages.items():
+            position = number * self.page_size
+            for row in page:
+                self._key_positions[row[self.key_index]] = position
+                self._id_positions[row[0]] = position
+                position += 1
+
+    def forget_from(self, key):
+        "A row was inserted or deleted at key: the pages from there on have moved."
+        self._count = None
+        for number, page in list(self._pages.items()):
+            if not page or page[-1][self.key_index] >= key:
+                del self._pages[number]
+        for number, first_key in list(self._first_keys.items()):
+            if first_key >= key:
+                del self._first_keys[number]
+        if self._fences is not None:    # the fences before the key keep their positions
+            self._fences = self._fences[:bisect.bisect_left(self._fences, key)]
+            self._fences_complete = False
+        self.reindex()
+
+    def apply_changes(self, changes):
+        """ brings the rows up to date with change log lines
+        :param changes: [(seq, tablename, op, id, key)] of this table, from changeLog.changes()
+        :return: True (a full set can always follow them)
+        """
+        for seq, tablename, op, id, key in changes:
+            if op == "U":
+                position = self._id_positions.get(id)
+                if position is None:
+                    continue    # not in memory: it will be read as it is now
+                filerow = self.table.by_id(id)
+                page = self._pages.get(position // self.page_size)
+                if filerow is not None and page is not None:
+                    page[position % self.page_size] = self.convert([filerow])[0]
+            else:   # "I" or "D": the rows after it move
+                self.forget_from(key)
+        return True
+
+    def read_fences(self):
+        "Reads the keys at every page_size-th position: one pass of the key index, no rows."
+        self._fences = [row[0] for row in self.table.execute(self.table.sqlFences, (self.page_size,), rows=False)]
+        self._fences_complete = True
+
+    def position_of_key(self, key):
+        """ Row position of a key (mrn, job, numeral), or None if it is not in the table.
+        Out of the pages in memory, it costs a search in the fences and a count of up to a page of index entries
+        (more after many inserts, until the fences are read again).
+        """
+        if key in self._key_positions:
+            return self._key_positions[key]
+        if key is None:
+            return None
+        if self._fences is None:
+            self.read_fences()
+        try:
+            number = bisect.bisect_right(self._fences, key) - 1
+        except TypeError:   # a key typed in, like "1042" for an integer column: the DB's own one
+            key = self.table.scalar(self.table.sqlKeyOfKey, (key,))
+            return None if key is None else self.position_of_key(key)
+        if number == len(self._fences) - 1 and not self._fences_complete:
+            self.read_fences()      # past the fences kept after an insert or deletion
+            number = bisect.bisect_right(self._fences, key) - 1
+        if number < 0:      # before the first row
+            return None
+        offset = self.table.scalar(self.table.sqlPositionFrom, (self._fences[number], key, key))
+        if offset is None:
+            return None
+        return number * self.page_size + offset
+
+    def position_of_id(self, id):
+        "Row position of a record id, or None if it is not in the table."
+        if id in self._id_positions:
+            return self._id_positions[id]
+        key = self.table.scalar(self.table.sqlKeyOfId, (id,))
+        if key is None:
+            return None
+        return self.position_of_key(key)
+
+    def append(self, row):
+        "The record has already been inserted into the DB: its change log line will place it (apply_changes)."
+        self._count = None
+
+    def remove(self, row):
+        "The record has already been deleted from the DB: its change log line will move the rows (apply_changes)."
+        self._count = None
+
+    def screen_rows(self):
+        "The same rows, without the 'id' field, for the grid values."
+        return ScreenRows(self)
+
+
+class ScreenRows():
+    "Grid values view of a PagedRowSource: every row without its first field ('id')."
+    def __init__(self, source):
+        self.source = source
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, index):
+        return self.source[index][1:]
+
+    def __iter__(self):
+        for row in self.source:
+            yield row[1:]
+
+
+class IndexedRows(list):
+    "A list of rows (a Find subset) with key->position and id->position indexes."
+    def __init__(self, rows=(), key_index=1, read_row=None):
+        super().__init__(rows)
+        self.key_index = key_index      # position of the key in a row
+        self.read_row = read_row        # id -> the row as in the list, or None: selector-supplied, for apply_changes()
+        self._key_positions = None      # built on first use
+        self._id_positions = None
+
+    def reindex(self):
+        "Builds both indexes from scratch."
+        self._key_positions = {}
+        self._id_positions = {}
+        for position, row in enumerate(self):
+            self._key_positions[row[self.key_index]] = position
+            self._id_positions[row[0]] = position
+
+    def position_of_key(self, key):
+        "Row position of a key (mrn, job, numeral), or None if it is not in the list."
+        if self._key_positions is None:
+            self.reindex()
+        return self._key_positions.get(key)
+
+    def position_of_id(self, id):
+        "Row position of a record id, or None if it is not in the list."
+        if self._id_positions is None:
+            self.reindex()
+        return self._id_positions.get(id)
+
+    def update_row(self, position, row):
+        "Replaces a row, keeping the indexes right if its key has changed."
+        old_row = self[position]
+        self[position] = row
+        if self._key_positions is not None:
+            del self._key_positions[old_row[self.key_index]]
+            self._key_positions[row[self.key_index]] = position
+
+    def append(self, row):
+        super().append(row)
+        if self._key_positions is not None:
+            self._key_positions[row[self.key_index]] = len(self) - 1
+            self._id_positions[row[0]] = len(self) - 1
+
+    def remove(self, row):
+        super().remove(row)
+        self._key_positions = None      # the following rows have moved: rebuild on next use
+        self._id_positions = None
+
+    def apply_changes(self, changes):
+        """ brings the subset up to date with change log lines: its updated and deleted rows
+        :param changes: [(seq, tablename, op, id, key)] of this table, from changeLog.changes()
+        :return: False if the Find must run again: an inserted row may match it
+        """
+        for seq, tablename, op, id, key in changes:
+            if op == "I" or self.read_row is None:
+                return False
+            position = self.position_of_id(id)
+            if position is None:
+                continue    # not in the subset
+            row = self.read_row(id) if op == "U" else None
+            if row is None:     # deleted
+                self.remove(self[position])
+            else:
+                self.update_row(position, row)
+        return True
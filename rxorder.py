@@ -12,19 +12,25 @@
 
 import curses
 import decimal
-import locale
 import sqlite3
 import time
 from decimal import Decimal
 
-import icu
 import npyscreen
 
 import bsWidgets as bs
+import collation
 import config
+import dbLocking
+import records
+import rowSetCache
+import typeAhead
+import valueLists
 
 DATEFORMAT = config.dateFormat
 DBTABLENAME = "'optidrome.rxorder'"
+PATIENT = "'optidrome.patient'"
+PRESCRIPTION = "'optidrome.prescription'"
 
 global form
 
@@ -72,6 +78,11 @@ class RxOrderForm(npyscreen.FormBaseNew):
 
         self.selectorForm = self.parentApp._Forms['RXORDERSELECTOR']
 
+    @property
+    def rowSet(self):
+        "The row set of the selector this form is opened from: its rows and the record read (see rowSetCache.py)."
+        return self.selectorForm.rowSet
+
     def create(self):
         "The standard constructor will call the method .create(), which you should override to create the Form widgets."
         self.framed = True   # framed form
@@ -88,8 +99,8 @@ class RxOrderForm(npyscreen.FormBaseNew):
         self.jobFld=self.add(bs.MyTitleText, name="Job №.", value="", relx=3, rely=2, begin_entry_at=9, editable=False)
         self.creationDateFld=self.add(bs.TitleDateField, name="Created:", value="", format=DATEFORMAT, relx=3, rely=4, begin_entry_at=9, editable=False)
 
-        self.patientValues = self.get_all_patients()
-        self.patientFld=self.add(bs.TitleChooser, name="Patient:", value="", values=self.patientValues, popupType="narrow", \
+        self.patientValues = typeAhead.QueryValues(PATIENT, "name", "name_fold", "name_key")   # read as you type
+        self.patientFld=self.add(bs.TitleChooser, name="Patient:", value="", valueSource=self.patientValues, popupType="narrow", \
             relx=29, rely=3, width=6, min_width=8, max_width=49, begin_entry_at=15, use_max_space=False, use_two_lines=False,\
             height=0, max_height=0, check_value_change=True, editable=False)
         self.patientLabel=self.add(bs.MyFixedText, name="PatientLabel", value="[+]", relx=68, rely=3, min_width=4, max_width=4, \
@@ -129,41 +140,25 @@ class RxOrderForm(npyscreen.FormBaseNew):
 
     def reload(self):
         ".init and .create functions are only executed once. We need a function to execute every time we come from main_menu->selector."
-        # Reload patients into the chooser field
-        self.patientValues = self.get_all_patients()
+        # Reload the first patients into the chooser field: the same list while no patient has changed
         chooser = self.patientFld.entry_widget
-        chooser.load_values(self.patientValues)
+        chooser.load_values(self.patientValues.from_value(""))
         self.patientFld.update(clear=True)
 
-    def get_all_patients(self):
-        "Returns a list of patients from DB"
-        conn = config.conn
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM 'optidrome.patient' ORDER BY name")
-        filerows = cur.fetchall()
-        patient_list = []
-        for row in filerows:
-            patient_list.append((row[0],))    # patients = [('literal',)]
-        # We need PyICU (=icu) to order unicode strings in Spanish, Catalan, French...
-        collator = icu.Collator.createInstance(icu.Locale(locale.getlocale()[0]))
-        aux_list = [i[0] for i in patient_list]
-        aux_list.sort(key=collator.getSortKey)
-        patient_list = [(i,) for i in aux_list]
-        return patient_list
-    
     def get_all_prescriptions(self):
         "Returns a list of prescriptions from DB that match chosen patient"
+        return valueLists.get("prescription names", PRESCRIPTION, self.read_prescriptions, self.patientFld.value)
+
+    def read_prescriptions(self, patient):
         conn = config.conn
         cur = conn.cursor()
-        cur.execute("SELECT name FROM 'optidrome.prescription' WHERE patient = ? ORDER BY name", (self.patientFld.value,))
+        cur.execute("SELECT name FROM 'optidrome.prescription' WHERE patient = ? ORDER BY name", (patient,))
         filerows = cur.fetchall()
         prescription_list = []
         for row in filerows:
             prescription_list.append((row[0],))
-        # We need PyICU (=icu) to order unicode strings in Spanish, Catalan, French...
-        collator = icu.Collator.createInstance(icu.Locale(locale.getlocale()[0]))
         aux_list = [i[0] for i in prescription_list]
-        aux_list.sort(key=collator.getSortKey)
+        aux_list.sort(key=collation.sort_key)   # ICU order
         prescription_list = [(i,) for i in aux_list]
         return prescription_list
     
@@ -221,17 +216,12 @@ class RxOrderForm(npyscreen.FormBaseNew):
     def update_fileRow(self):
         "Updates accessible record variable."
         if self.current_option != "Delete":
-            id = config.fileRow[0]
-            for row in config.fileRows:
-                if row[0] == id:
-                    config.fileRow = []
-                    config.fileRow.append(row[0])
-                    config.fileRow.append(int(self.jobFld.value))
-                    config.fileRow.append(self.patientFld.value)
-                    config.fileRow.append(self.creationDateFld.value)
-                    price = self.priceFld.value.replace(",", ".")   # here, no matter config.decimal_symbol
-                    config.fileRow.append(Decimal(price))
-                    break
+            self.rowSet.fileRow = [self.rowSet.fileRow[0]]   # the same id: no need to look for the row in self.rowSet.rows
+            self.rowSet.fileRow.append(int(self.jobFld.value))
+            self.rowSet.fileRow.append(self.patientFld.value)
+            self.rowSet.fileRow.append(self.creationDateFld.value)
+            price = self.priceFld.value.replace(",", ".")   # here, no matter config.decimal_symbol
+            self.rowSet.fileRow.append(Decimal(price))
         elif self.current_option == "Delete":
             pass
 
@@ -247,9 +237,7 @@ class RxOrderForm(npyscreen.FormBaseNew):
             self.backup_fields()
         self.selectorForm.grid.update()
 
-        # To unlock the database (for Create) we must disconnect and re-connect:
-        config.conn.close()
-        self.parentApp.connect_database()
+        dbLocking.end_editing(self.parentApp)  # unlock the database, if it was locked
 
         config.parentApp.setNextForm("RXORDERSELECTOR")
         config.parentApp.switchFormNow()
@@ -269,14 +257,7 @@ class RxOrderForm(npyscreen.FormBaseNew):
         "Setting the book form to create a new record."
         global form
         conn = config.conn
-        while True:     # for Creation, we must set the locking here
-            try:
-                conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite only allows a single writer per database
-                conn.execute('PRAGMA locking_mode = EXCLUSIVE')
-                conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
-                break
-            except sqlite3.OperationalError:
-                bs.notify_OK("\n    Database is locked, please wait.", "Message")
+        dbLocking.lock_for_editing(conn, create=True)  # for Creation, we must set the locking here (see WAL_MODE)
         form.reload()   # reloading chooser fields, etc in case we've changed the other tables
         form.current_option = "Create"
         form.jobFld.editable = True
@@ -330,8 +311,7 @@ class RxOrderForm(npyscreen.FormBaseNew):
         "Setting the book form for update editing."
         global form
         conn = config.conn
-        conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite3 admits just one writing process
-        conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+        dbLocking.lock_for_editing(conn)   # exclusive access in the old mode, nothing in WAL_MODE
         form.reload()   # reloading chooser fields, etc in case we've changed other tables
         form.current_option = "Update"
         form.convertDBtoFields()
@@ -353,8 +333,7 @@ class RxOrderForm(npyscreen.FormBaseNew):
         "Setting the book form for deleting."
         global form
         conn = config.conn
-        conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite3 admits just one writing process
-        conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+        dbLocking.lock_for_editing(conn)   # exclusive access in the old mode, nothing in WAL_MODE
         form.current_option = "Delete"
         form.convertDBtoFields()
         form.jobFld.editable = False
@@ -372,18 +351,18 @@ class RxOrderForm(npyscreen.FormBaseNew):
 
     def convertDBtoFields(self):
         "Convert DB fields into screen fields (strings)."
-        self.jobFld.value = str(config.fileRow[1])
-#        self.bookTitleFld.value = config.fileRow[2]
-#        self.originalTitleFld.value = config.fileRow[3]
-        self.patientFld.value = self.selectorForm.get_patient_name(config.fileRow[1])
-#        self.descriptionFld.value = config.fileRow[5]
-#        self.isbnFld.value = config.fileRow[6]
-#        self.yearFld.value = str(config.fileRow[7])
-#        self.publisherFld.value = config.fileRow[8]
-#        self.creationDateFld.value = self.DBtoScreenDate(config.fileRow[9], DATEFORMAT)
-#        self.genreFld.value = str(config.fileRow[10])+"-"+self.genreValues[config.fileRow[10] - 1]
-#        self.coverTypeFld.value = str(config.fileRow[11])+"-"+self.coverTypeValues[config.fileRow[11] - 1]
-        price = str(config.fileRow[3])
+        self.jobFld.value = str(self.rowSet.fileRow[1])
+#        self.bookTitleFld.value = self.rowSet.fileRow[2]
+#        self.originalTitleFld.value = self.rowSet.fileRow[3]
+        self.patientFld.value = self.selectorForm.get_patient_name(self.rowSet.fileRow[1])
+#        self.descriptionFld.value = self.rowSet.fileRow[5]
+#        self.isbnFld.value = self.rowSet.fileRow[6]
+#        self.yearFld.value = str(self.rowSet.fileRow[7])
+#        self.publisherFld.value = self.rowSet.fileRow[8]
+#        self.creationDateFld.value = self.DBtoScreenDate(self.rowSet.fileRow[9], DATEFORMAT)
+#        self.genreFld.value = str(self.rowSet.fileRow[10])+"-"+self.genreValues[self.rowSet.fileRow[10] - 1]
+#        self.coverTypeFld.value = str(self.rowSet.fileRow[11])+"-"+self.coverTypeValues[self.rowSet.fileRow[11] - 1]
+        price = str(self.rowSet.fileRow[3])
         if config.decimal_symbol == ",":
             price = price.replace(".", ",")     # screen value only
         self.priceFld.value = price
@@ -397,17 +376,17 @@ class RxOrderForm(npyscreen.FormBaseNew):
     
     def save_mem_record(self):
         "Save new record (from Create) to global variable."
-        config.fileRow = []
-        config.fileRow.append(None)    # ID field is incremental, fulfilled later
-        config.fileRow.append(int(self.jobFld.value))
-        config.fileRow.append(self.patientFld.value)
-        config.fileRow.append(self.creationDateFld.value)
+        self.rowSet.fileRow = []
+        self.rowSet.fileRow.append(None)    # ID field is incremental, fulfilled later
+        self.rowSet.fileRow.append(int(self.jobFld.value))
+        self.rowSet.fileRow.append(self.patientFld.value)
+        self.rowSet.fileRow.append(self.creationDateFld.value)
         ctx = decimal.getcontext()
         ctx.prec = 6
         ctx.rounding = decimal.ROUND_HALF_DOWN  # rounds if enters more than self.ndecimals decimals
         price = self.priceFld.value.replace(",", ".")   # here, no matter config.decimal_symbol
         price = str(round(Decimal(price), self.ndecimals))
-        config.fileRow.append(Decimal(price))
+        self.rowSet.fileRow.append(Decimal(price))
     
     def createOKbtn_function(self):
         "OK button function under Create mode."
@@ -419,7 +398,8 @@ class RxOrderForm(npyscreen.FormBaseNew):
         else:
             if self.exist_changes():
                 self.save_mem_record()  # backup record in config variable
-                self.save_created_book()
+                if not self.save_created_book():
+                    return  # back to the form
                 self.selectorForm.grid.set_highlight_row(int(self.jobFld.value))
             else:
                 self.exitRxOrder(modified=False)
@@ -449,29 +429,29 @@ class RxOrderForm(npyscreen.FormBaseNew):
 
         conn = config.conn
         cur = conn.cursor()
-        id = config.fileRow[0]
-        numeral = config.fileRow[1]
+        id = self.rowSet.fileRow[0]
+        numeral = self.rowSet.fileRow[1]
 
         # Delete book record
+        index = self.rowSet.rows.position_of_id(id)     # for positioning, while the row is still there
         sqlQuery = "DELETE FROM " + DBTABLENAME + " WHERE id = " + str(id)
-        cur.execute(sqlQuery)
-        conn.commit()
+        with dbLocking.write_transaction(conn):
+            cur.execute(sqlQuery)
+        rowSetCache.wrote(DBTABLENAME)
         bs.notify("\n       Record deleted", title="Message", form_color='STANDOUT', wrap=True, wide=False)
         
-        # update config.fileRows:
-        index = 0           # for positioning
-        for row in config.fileRows:
-            if row[0] == id:
-                config.fileRows.remove(row)
-                break
-            index += 1
-        # update config.fileRow to the previous record in list:
+        # update self.rowSet.rows:
+        if index is None:
+            index = len(self.rowSet.rows)
+        else:
+            self.rowSet.rows.remove(self.rowSet.rows[index])
+        # update self.rowSet.fileRow to the previous record in list:
         if index > 0:
             index -= 1
         try:
-            config.fileRow = config.fileRows[index]
+            self.rowSet.fileRow = self.rowSet.rows[index]
         except IndexError:  # there are no rows in the table
-            config.fileRow = []
+            self.rowSet.fileRow = []
         
         # Delete book_author relationship table row(s)
 #        sqlQuery = "DELETE FROM 'optidrome.book_author' WHERE book_num = " + str(numeral)
@@ -492,7 +472,7 @@ class RxOrderForm(npyscreen.FormBaseNew):
         if bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
             self.delete_book()
             try:
-                numeral = config.fileRow[1]
+                numeral = self.rowSet.fileRow[1]
             except IndexError:  # there are no rows in the table
                 numeral = None
             self.selectorForm.grid.set_highlight_row(numeral)
@@ -583,7 +563,7 @@ class RxOrderForm(npyscreen.FormBaseNew):
 
         # repeated value check: numeral and isbn fields
         if self.jobFld.value != self.bu_job:
-            for row in config.fileRows:
+            for row in self.rowSet.rows:
                 self.ok_button.editing = False
                 # Already exists and it's not itself
                 if row[1] == int(self.jobFld.value) and self.jobFld.value != self.bu_job:
@@ -642,21 +622,22 @@ class RxOrderForm(npyscreen.FormBaseNew):
             message = "\n   Patient was not found. Create it as a new one?"
             if bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
                 self.patient_mrn = self.get_last_mrn("'optidrome.patient'") + 1
-                sqlQuery = "INSERT INTO 'optidrome.patient' (mrn, name, dob, phone, email) VALUES (?,?,?,?,?)"
-                values = (int(self.patient_mrn), self.patientFld.value, "", "", "")  # some fields are filled empty
-                cur.execute(sqlQuery, values)
-                conn.commit()
+                try:
+                    with dbLocking.write_transaction(conn):
+                        records.create_patient(cur, {"mrn": int(self.patient_mrn), "name": self.patientFld.value})   # the other fields empty
+                except sqlite3.IntegrityError as e:     # like the patient table's own checks on the empty fields
+                    bs.notify_OK("\n     Patient could not be created:\n     " + str(e), "Message")
+                    return False
                 bs.notify_OK("\n      A new patient was created.\n      Remember to fulfill all the data in their file.", "Message")
             else:
                 bs.notify_OK("\n      Getting back to order form.\n      Choose or enter a valid patient.", "Message")
-                return
+                return False
 
         # creation of book_author intermediate table
 #        sqlQuery = "INSERT INTO 'bookstore.book_author' (book_num, author_num, is_main_author) VALUES (?,?,?)"
 #        values = (int(self.jobFld.value), int(self.patient_mrn), 1)
 #        cur.execute(sqlQuery, values)
 #        conn.commit()
-        conn.isolation_level = None     # free the multiuser lock
 
         # Create the book record
         
@@ -671,9 +652,14 @@ class RxOrderForm(npyscreen.FormBaseNew):
         columns = " (job,creation_date,price) "
         sqlQuery = "INSERT INTO " + DBTABLENAME + columns + " VALUES (?,?,?)"
         values = (int(self.jobFld.value), DBcreationDate, price)
-        cur.execute(sqlQuery, values)
-        conn.commit()
-        config.fileRow[0] = cur.lastrowid
+        try:
+            with dbLocking.write_transaction(conn):     # the only write lock, and just for the INSERT
+                cur.execute(sqlQuery, values)
+        except sqlite3.IntegrityError:  # another terminal may have just taken the same job number
+            bs.notify_OK("\n     Job number of order already exists. ", "Message")
+            return False
+        rowSetCache.wrote(DBTABLENAME)
+        self.rowSet.fileRow[0] = cur.lastrowid
         bs.notify("\n       Record created", title="Message", form_color='STANDOUT', wrap=True, wide=False)
 
         # Manage book warehouses:
@@ -702,14 +688,15 @@ class RxOrderForm(npyscreen.FormBaseNew):
 #                    bs.notify_OK(message, title="", wrap=True, editw = 1,)
 #                    continue
 
-        # update config.fileRows:
+        # update self.rowSet.rows:
         new_record = []
-        new_record.append(config.fileRow[0])
+        new_record.append(self.rowSet.fileRow[0])
         new_record.append(self.patientFld.value)
         new_record.append(self.creationDateFld.value)
         new_record.append(Decimal(price))
-        config.fileRows.append(new_record)
+        self.rowSet.rows.append(new_record)
         self.exitRxOrder(modified=True)
+        return True
 
 #    def save_updated_book(self):
 #        "Button based Save function for U=Update."
@@ -839,7 +826,7 @@ class RxOrderForm(npyscreen.FormBaseNew):
  #       columns = "numeral=?, book_title=?, original_title=?, description=?, isbn=?, year=?, publisher_num=?, creation_date=?, genre_id=?, cover_type=?, price=?"
  #       sqlQuery = "UPDATE " + DBTABLENAME + " SET " + columns + " WHERE id=?"
  #       values = (int(self.jobFld.value), self.bookTitleFld.value, self.originalTitleFld.value, self.descriptionFld.value, self.isbnFld.value, \
- #           int(self.yearFld.value), publisher_num, DBcreationDate, genre, cover_type, price, config.fileRow[0])
+ #           int(self.yearFld.value), publisher_num, DBcreationDate, genre, cover_type, price, self.rowSet.fileRow[0])
  #       cur.execute(sqlQuery, values)
  #       conn.commit()
  #       bs.notify("\n       Record saved", title="Message", form_color='STANDOUT', wrap=True, wide=False)
@@ -913,39 +900,7 @@ class RxOrderForm(npyscreen.FormBaseNew):
 
     def make_differences_list(self, new_field, old_field):
         "Accepts two comma-separated string-fields of values and returns a differences list like [new_value, -old_value]."
-        "For enumeration text fields."
-        diffList = []    # setting up a differences list
-        if new_field != old_field:  # there are changes 
-            oldList0 = list(old_field.split(","))
-            oldList = []
-            for c in oldList0:
-                if c != "": # extra commas do this
-                  oldList.append(c.strip())
-            newList0 = list(new_field.split(","))
-            newList = []
-            for c in newList0:
-                if c != "": # extra commas do this
-                    newList.append(c.strip())
-            for c in newList:
-                if c not in oldList:
-                    try:
-                        diffList.append(int(c)) # is an int
-                    except ValueError:
-                        try:
-                            diffList.append(float(c)) # is a float
-                        except ValueError:
-                            diffList.append(c) # is a string
-
-            for c in oldList:
-                if c not in newList:
-                    try:
-                        diffList.append(0 - int(c)) # is an int
-                    except ValueError:
-                        try:
-                            diffList.append(0 - float(c)) # is a float
-                        except ValueError:
-                            diffList.append("-" + c) # is a string: negative of a string!
-        return diffList
+        return dbLocking.make_differences_list(new_field, old_field)
         
     def textfield_exit(self):
         "Exit from a text field with Escape"
@@ -11,19 +11,20 @@
 ##############################################################################
 
 import curses
-import locale
+import itertools
 import os
 import sqlite3
 import subprocess
 import textwrap
 from datetime import datetime
 
-import icu
 import npyscreen
 from npyscreen import fmForm, wgmultiline
 
 import bsWidgets as bs
+import collation
 import config
+import reportWriters
 
 REMEMBER_FILTERS = config.REMEMBER_FILTERS  # remember the last listing filter subset
 
@@ -34,6 +35,27 @@ LF  = chr(curses.ascii.LF)
 
 if config.system_release == "10":   LF = ''     # Windows 8.1 notepad program needs LF
 
+LISTING_COLUMNS = [("Book title", 34), ("Author", 26), ("Year", 6), ("Publisher", 24), ("Warehouse", 24), ("Genre", 11)]
+
+# The listing's ordering (and compression) key of each order option, as in SQL.
+# Every part is COALESCEd: one NULL would make the whole key NULL, and the
+# adjacent NULL keys of unrelated books would be compressed into one line.
+def listing_key(*parts):
+    return " || '_' || ".join("COALESCE(" + part + ", " + default + ")" for part, default in parts)
+
+TITLE = ("'bookstore.Book'.book_title", "''")
+AUTHOR = ("'optidrome.Patient'.name", "''")
+PUBLISHER = ("'bookstore.Publisher'.name", "''")
+GENRE = ("CAST('bookstore.Book'.genre_id AS TEXT)", "''")
+WAREHOUSE = ("'bookstore.Warehouse'.code", "'None'")
+
+LISTING_KEYS = {"book title":   listing_key(TITLE, PUBLISHER),
+                "author":       listing_key(AUTHOR, TITLE, PUBLISHER),
+                "publisher":    listing_key(PUBLISHER, TITLE),
+                "genre":        listing_key(GENRE, TITLE, PUBLISHER),
+                "warehouse":    listing_key(WAREHOUSE, TITLE, PUBLISHER)
+                }
+
 helpText = "A listing utility for the book database.\n\n\
 * Searching is SQL LIKE-based. Filter fields must not be empty. First items in the filters must be ORs (|), then the NOTs (!=).\n\n\
 * A text program will open the report and wait for you to close it to return to the program. \
@@ -96,6 +118,9 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
             relx=21, rely=19, begin_entry_at=12, use_max_space=False, max_width=34, editable=True)
         self.orderLabel=self.add(bs.MyFixedText, name="OrderLabel", value="[+]", relx=56, rely=19, min_width=4, max_width=4, \
             min_height=0, max_height=0, use_max_space=False, editable=False)
+        self.formatValues = [(format,) for format in reportWriters.WRITERS]
+        self.formatFld = self.add(bs.TitleChooser, name="Format:", value="", values=self.formatValues, popupType="narrow",\
+            relx=23, rely=20, begin_entry_at=10, use_max_space=False, max_width=22, editable=True)
         #-------------------------------------------------------------------------------------------------------------------------
         self.ok_button=self.add(bs.MyMiniButtonPress, name="Generate listing", relx=18, rely=21, editable=True)
         self.ok_button.when_pressed_function = self.Generatebtn_function
@@ -114,6 +139,7 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
             self.genreFilterFld.value = "%"
             self.warehouseFilterFld.value = "%"
             self.orderFld.value = self.orderValues[0][0]   # "Book title" by default
+            self.formatFld.value = self.formatValues[0][0]   # "Text" by default
 
     def Generatebtn_function(self):
         "Generate button function."
@@ -159,6 +185,9 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
         elif self.orderFld.value == "":
             emptyField = True
             self.editw = self.get_editw_number("Order by:") - 1
+        elif self.formatFld.value == "":
+            emptyField = True
+            self.editw = self.get_editw_number("Format:") - 1
         if emptyField:
             self.ok_button.editing = False
             errorMsg = "Error:  Mandatory field is empty"
@@ -170,6 +199,12 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
             self.editw = self.get_editw_number("Order by:") - 1
             return errorMsg
 
+        if (self.formatFld.value.strip(),) not in self.formatValues:
+            self.ok_button.editing = False
+            errorMsg = "Error:  Wrong format"
+            self.editw = self.get_editw_number("Format:") - 1
+            return errorMsg
+
     def error_message(self, errorMsg):
         self.statusLine.value = errorMsg
         self.statusLine.display()
@@ -311,27 +346,25 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
         # To distinguish between lines with same title, different publisher:
         groupSentence = " GROUP BY 'bookstore.Book'.book_title, 'bookstore.Book'.publisher_num, 'bookstore.Book_warehouse'.warehouse_num"
 
-        orderSentence = " ORDER BY "
-        
         if self.orderFld.value == "Book title":
             orderBy = "book title"
-            orderSentence += "'bookstore.Book'.book_title"
         elif self.orderFld.value == "Author and title":
             orderBy = "author"
-            orderSentence += "'optidrome.Patient'.name, 'bookstore.Book'.book_title"
         elif self.orderFld.value == "Publisher and title":
             orderBy = "publisher"
-            orderSentence += "'bookstore.Publisher'.name, 'bookstore.Book'.book_title"
         elif self.orderFld.value == "Genre and title":
             orderBy = "genre"
-            orderSentence += "'bookstore.Book'.genre_id, 'bookstore.Book'.book_title"
         elif self.orderFld.value == "Warehouse and title":
             orderBy = "warehouse"
-            orderSentence += "'bookstore.Warehouse'.code, 'bookstore.Book'.book_title"
         else:
             orderBy = "book title"
 
-        sqlQuery = "SELECT "+flist+" FROM 'bookstore.Book_author' \
+        # ICU ordering of the ordering field, done by SQLite: it sorts on disk if needed, so memory stays bounded.
+        # One sort key per row, compared as plain bytes, instead of a collator call per comparison.
+        collation.register(conn)
+        orderSentence = " ORDER BY icu_sort_key(listing_key), listing_key"
+
+        sqlQuery = "SELECT "+flist+", "+LISTING_KEYS[orderBy]+" AS listing_key FROM 'bookstore.Book_author' \
             INNER JOIN 'bookstore.Book' ON 'bookstore.Book'.numeral = 'bookstore.Book_author'.book_num \
             INNER JOIN 'optidrome.Patient' ON 'optidrome.Patient'.numeral = 'bookstore.Book_author'.author_num \
             INNER JOIN 'bookstore.Publisher' ON 'bookstore.Publisher'.numeral = 'bookstore.Book'.publisher_num \
@@ -340,123 +373,28 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
             WHERE " + bookLikeSentence + " AND " + authorLikeSentence + " AND " + publisherLikeSentence + \
             " AND " +  genreLikeSentence + " AND " + warehouseLikeSentence + groupSentence + orderSentence
 
+        # Report file creation, written as the rows come from the cursor:
+        # cursor -> compress_rows() -> listing_rows() -> report writer of the chosen format -> file
+        format = self.formatFld.value
+        DataPath = config.dataPath + "Reports/"
+        now = datetime.now().strftime('%Y%m%d%H%M%S.%f')[2:-7]
+        filename = DataPath + "book_listing-" + now + reportWriters.WRITERS[format].extension
         try:
             cur.execute(sqlQuery)
-            conn.commit()
-            rows = cur.fetchall()
+            count = reportWriters.write_report(filename, format, LISTING_COLUMNS, \
+                self.listing_rows(self.compress_rows(cur, orderBy)), newline=CR + LF)
         except sqlite3.OperationalError as e:
             bs.notify_OK("\n    sqlite3.OperationalError: \n"+str(e),"Message", form_color='STANDOUT', wrap=True, wide=False)
             return
-
-        report = ""
-
-        # Listing header
-        book_title = "Book title".ljust(34)
-        author = "Author".ljust(26)
-        year = "Year".ljust(6)
-        publisher = "Publisher".ljust(24)
-        warehouse = "Warehouse".ljust(24)
-        genre = "Genre".ljust(11)
-        header = book_title + author + year + publisher + warehouse + genre + CR + LF + "-" * 125 + CR + LF
-        
-        report += header
-
-        # Compress and combine same book with different warehouses
-        compress_dict = {}
-
-        for row in rows:
-
-            title = row[0]
-            author = row[1]
-            year = row[2]
-            publisher = row[3]
-            warehouse = row[4]
-            genre = row[5]
-
-            if orderBy == "book title":
-                index = title + "_" + publisher
-            elif orderBy == "author":
-                index = author + "_" + title + "_" + publisher
-            elif orderBy == "publisher":
-                index = publisher + "_" + title
-            elif orderBy == "genre":
-                index = str(genre) + "_" + title + "_" + publisher
-            elif orderBy == "warehouse":
-                index = warehouse
-                if index == None:
-                    index = "None_" + title + "_" + publisher
-                else:
-                    index = warehouse + "_" + title + "_" + publisher
-
-            if orderBy != "warehouse":  # can compress books by warehouse
-                try:
-                    if compress_dict[index]:
-                        try:
-                            wrhouse = compress_dict[index][4] + ", " + warehouse
-                        except TypeError:   # it's None
-                            wrhouse = ""
-                    new_row = (title, author, year, publisher, wrhouse, genre)
-                    compress_dict[index] = new_row
-                except KeyError:
-                    compress_dict[index] = row
-            else:
-                compress_dict[index] = row
-
-        rows = list(compress_dict.values())
-        
-        # ICU ordering of the ordering field
-        # We need PyICU (=icu) to order unicode strings in Spanish, Catalan, French...
-        collator = icu.Collator.createInstance(icu.Locale(locale.getlocale()[0]))
-
-        if orderBy == "book title":
-            index_list = [i[0] + "_" + i[3] for i in rows]
-        elif orderBy == "author":
-            index_list = [i[1] + "_" + i[0] + "_" + i[3] for i in rows]
-        elif orderBy == "publisher":
-            index_list = [i[3] + "_" + i[0] for i in rows]
-        elif orderBy == "genre":
-            index_list = [str(i[5]) + "_" + i[0] + "_" + i[3] for i in rows]
-        elif orderBy == "warehouse":
-            index_list = []
-            for i in rows:
-                if i[4] == None:
-                    index_list.append("None_" + i[0] + "_" + i[3])
-                else:
-                    index_list.append(i[4]+"_" + i[0] + "_" + i[3])
-
-        index_list.sort(key=collator.getSortKey)
-
-        new_rows = []
-        for item in index_list:
-            new_rows.append(compress_dict[item])
-
-        for row in new_rows:
-            book_title = row[0][:33].ljust(34)
-            author = row[1][:25].ljust(26)
-            year = str(row[2])[:6].ljust(6)
-            publisher = row[3][:23].ljust(24)
-            if row[4] != None:
-                warehouse = row[4][:23].ljust(24)
-            else:
-                warehouse = "".ljust(24)
-
-            genre = config.genreList[row[5] - 1].ljust(11)
-            
-            report += book_title + author + year + publisher + warehouse + genre + CR + LF
-        
-        report += "-" * 125 + CR + LF   # final line
-
-        # Text file creation
-        DataPath = config.dataPath + "Reports/"
-        now = datetime.now().strftime('%Y%m%d%H%M%S.%f')[2:-7]
-        filename = DataPath + "book_listing-" + now + ".txt"
-        try:
-            with open(filename, 'w') as f:
-                f.write(report)
         except FileNotFoundError:
             message = "The report directory does not exist."
             if bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
                 self.exitBookListing()
+            return
+
+        if format != "Text":    # an export for other programs: kept, not viewed
+            bs.notify_OK("\n  " + str(count) + " rows exported to\n  " + filename, "Message", wrap=True)
+            return
 
         # Text file display through an external app
         viewer = config.textViewer
@@ -469,6 +407,27 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
             except FileNotFoundError:   # whatever
                 pass
 
+    def compress_rows(self, rows, orderBy):
+        "Compress and combine same book with different warehouses. Rows come sorted by listing_key, so they're adjacent."
+        for index, group in itertools.groupby(rows, key=lambda row: row[6]):
+            compressed = None
+            for row in group:
+                title, author, year, publisher, warehouse, genre = row[:6]
+                if compressed is None or orderBy == "warehouse":    # can't compress books by warehouse
+                    compressed = row[:6]
+                else:
+                    try:
+                        wrhouse = compressed[4] + ", " + warehouse
+                    except TypeError:   # it's None
+                        wrhouse = ""
+                    compressed = (title, author, year, publisher, wrhouse, genre)
+            yield compressed
+
+    def listing_rows(self, rows):
+        "Listing values: the genre by name."
+        for row in rows:
+            yield row[:5] + (config.genreList[row[5] - 1],)
+
     def exitBookListing(self):
         config.parentApp.setNextForm("MAIN")
         config.parentApp.switchFormNow()
@@ -510,7 +469,7 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
 
     def is_editable_field(self, widget=None):
         "Hooked from bs.MyAutocomplete.filter_char()"
-        if widget.name == "Order by:" :
+        if widget.name in ("Order by:", "Format:"):
             return True
         else:
             return False
@@ -519,12 +478,14 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
         "Hooked from bs.MyAutocomplete.get_choice()"
         if widget.name == "Order by:":
             tmp_window = bs.MyPopup(self, name=widget.name, framed=True, show_atx=42, show_aty=13, columns=32, lines=10, shortcut_len=None)
+        elif widget.name == "Format:":
+            tmp_window = bs.MyPopup(self, name=widget.name, framed=True, show_atx=42, show_aty=14, columns=20, lines=8, shortcut_len=None)
         return tmp_window
 
     def scan_value_in_list(self, widget=None):
         "Hook from bs.MyAutocomplete.when_check_value_changed()"
         widget_value = widget.value
-        if widget.name == "Order by:" :
+        if widget.name in ("Order by:", "Format:"):
             if widget.cursor_position != 0:
                 widget_value = widget.value[:widget.cursor_position]
                 found_value = widget.find_value_literal(widget_value)
@@ -537,5 +498,7 @@ class RxOrderListingForm(npyscreen.FormBaseNew):
         parentField = None
         if widget.name == "Order by:" :
             parentField = self.orderFld
+        elif widget.name == "Format:":
+            parentField = self.formatFld
         return parentField 
 
@@ -25,10 +25,13 @@ from decimal import Decimal
 import sys
 
 import npyscreen
-import numpy
 
 import bsWidgets as bs
 import config
+import dataAccess
+import findIndex
+import rowSetCache
+import rowSource
 from rxorder import RxOrderForm
 from config import SCREENWIDTH as WIDTH
 
@@ -37,6 +40,7 @@ REMEMBER_SUBSET = config.REMEMBER_SUBSET  # remember the last 'Find' result subs
 DATEFORMAT = config.dateFormat  # program-wide
 FIELD_LIST = ["job", "patient", "creation_date", "status", "balance"] # only screen fields, not DB
 DBTABLENAME = "'optidrome.rxorder'"
+ORDERS = dataAccess.RxOrderTable()
 
 helpText =  "The book selector is a grid of database table rows (records).\n\n" +\
     "* Use the arrow keys, Page Up/Down and Home/End to navigate the grid.\n\n" +\
@@ -64,9 +68,15 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
         
         # goes to _FormBase:
         super().__init__(name, parentApp, framed, help, color, widget_list, cycle_widgets=cycle_widgets, *args, **keywords)
+        self.keypress_timeout = config.GRID_POLL    # tenths of a second idle before while_waiting()
 
         self.ndecimals = config.ndecimals   # to round the DB price
 
+    @property
+    def rowSet(self):
+        "The grid's row set, its full set or a Find subset, with the selected row (see rowSetCache.py)."
+        return rowSetCache.current(DBTABLENAME)
+
     def create(self):
         "The standard constructor will call the method .create(), which you should override to create the Form widgets."
         self.framed = False   # frameless form
@@ -129,77 +139,62 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
 
     def getRowListForScreen(self, filerows):
         "Memory row list to screen row list for grid."
+        if isinstance(filerows, rowSource.PagedRowSource) and len(filerows) > 0:
+            return filerows.screen_rows()   # full set: rows get read as the grid scrolls
         if len(filerows) > 0:
-            self.screenFileRows = numpy.array(filerows)  # I need numpy to...
-            self.screenFileRows = self.screenFileRows[:, 1:]  # ...cut the first field ("id")
-            return self.screenFileRows.tolist()          # and again to list
+            return rowSource.ScreenRows(filerows)   # the rows without their "id", as the grid shows them
         else:
             empty_list = [["","","","","",""]]
             return empty_list
 
     def readDBTable(self):
-        "Reads the full table and returns a list of list-rows."
-        cur = config.conn.cursor()
-        while True:     # multiuser DB locking loop
-            try:
-                cur.execute("SELECT * FROM " + DBTABLENAME + " ORDER BY job")
-                break   # go on
-            except sqlite3.OperationalError:
-                bs.notify_OK("\n    Database is locked, please wait.", "Message")
-        filerows = cur.fetchall()
-        rows = []        
-        for row in filerows:
-            id = row[0]
-            numeral = row[1]
-            bookTitle = row[2]
-            patient = self.get_patient_name(numeral)
-            year = row[6]
-            publisher = self.get_publisher_name(row[7])
-            date = self.DBtoScreenDate(row[8], DATEFORMAT)   # = creation date
-            isbn = row[5]
-            cRow = [id, numeral, bookTitle, patient, year, publisher, date, isbn]
-            rows.append(cRow)    # included book.id
-        self.set_up_title(filerows, full_set=True)
-        return rows # it's a list of lists
+        "Returns the full table as a paged row source: rows are read from the DB on demand."
+        rows = rowSource.PagedRowSource(ORDERS, self.convert_row)
+        self.set_up_title(rows, full_set=True)     # it's a COUNT(*)
+        return rows # it reads like a list of lists
+
+    def convert_row(self, row):
+        "DB row to grid row."
+        id = row[0]
+        numeral = row[1]
+        bookTitle = row[2]
+        patient = self.get_patient_name(numeral)
+        year = row[6]
+        publisher = self.get_publisher_name(row[7])
+        date = self.DBtoScreenDate(row[8], DATEFORMAT)   # = creation date
+        isbn = row[5]
+        cRow = [id, numeral, bookTitle, patient, year, publisher, date, isbn]
+        return cRow    # included book.id
+
+    def grid_row(self, id):
+        "The grid row of a record id, None if it doesn't exist: for the Find subsets' apply_changes()."
+        row = ORDERS.by_id(id)
+        return None if row is None else self.convert_row(row)
     
     def fill_grid(self):
-        "Read the DB table and put it into the grid."
-        config.fileRows = self.readDBTable()        # full row set: it's a list of lists
-        self.screenFileRows = self.getRowListForScreen(config.fileRows)     # it's a list of lists
+        "Put the full set into the grid: the one of the last visit, with the changes since (rowSetCache.py)."
+        rowSet = rowSetCache.activate(rowSetCache.row_set(DBTABLENAME))
+        if rowSetCache.bring_up_to_date(rowSet):
+            self.set_up_title(self.rowSet.rows, full_set=True)
+        else:
+            position = rowSetCache.position(DBTABLENAME)
+            self.rowSet.rows = self.readDBTable()        # full row set: it's a list of lists
+            rowSetCache.loaded(rowSet, position)
+        self.screenFileRows = self.getRowListForScreen(self.rowSet.rows)     # it's a list of lists
         self.grid.values = self.screenFileRows
 
     def update_grid(self):
-        "Updates the affected row in the book grid and RAM config table list. Called from outside this module."
-        # After a change, creation or multiple deletion, the grid displays the full set :
-        if not REMEMBER_SUBSET or \
-            config.last_table != DBTABLENAME or \
-                (config.last_table == DBTABLENAME and config.last_operation == "Create") or \
-                    (config.last_table == DBTABLENAME and config.last_operation == "Delete" or \
-                        config.last_operation == "DeleteMultipleRecords"):
+        "Shows the row set of the last visit, the full set or a Find subset, up to date. Called from outside this module."
+        rowSet = rowSetCache.current(DBTABLENAME)
+        first_visit = rowSet.rows is None
+        # After a creation or deletion, the grid displays the full set; a Find subset is kept, or found again after a write:
+        if not REMEMBER_SUBSET or rowSet.find is None or \
+                config.last_operation in ["Create", "Delete", "DeleteMultipleRecords"] or \
+                    not self.find_DB_rows(rowSet.find):
             self.fill_grid()
-            if config.last_table != DBTABLENAME:
-                config.last_table = DBTABLENAME
-                self.grid.set_highlight_row(None)    # simply selects the first one
-        else:   # remember Find subset, etc...
-            if config.last_operation != "Delete":
-                if config.fileRow is not None:  # it's not initializing
-                    for row in config.fileRows:
-                        if row[0] == config.fileRow[0]:     # ID field
-                            row[1] = config.fileRow[1]      # Numeral
-                            row[2] = config.fileRow[2]      # RxOrderTitle
-                            row[3] = config.fileRow[4]      # Author
-                            row[4] = config.fileRow[7]      # Year
-                            row[5] = config.fileRow[8]      # Publisher
-                            if len(config.fileRow[9]) == 23:    # we come from the main menu
-                                row[6] = self.DBtoScreenDate(config.fileRow[9], DATEFORMAT)
-                            else:   # we come from the book form
-                                row[6] = config.fileRow[9]  # Date = creation date
-                            row[7] = config.fileRow[6]      # ISBN/SKU
-                            break
-                    screenFileRows = self.getRowListForScreen(config.fileRows)
-                    self.grid.values = screenFileRows
-                    self.set_up_title(config.fileRows, full_set=False)
-                
+        if first_visit:
+            self.grid.set_highlight_row(None)    # simply selects the first one
+
         if not REMEMBER_ROW:
             self.grid.set_highlight_row(None)    # simply selects the first one
 
@@ -244,7 +239,7 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
 
         self.grid.editing = False
 
-        searchedNumeral = config.currentRow
+        searchedNumeral = self.rowSet.currentRow
         self.inputDetail.hidden = False
         self.inputDetail.editable = True
         self.inputDetail.relx = 26
@@ -282,7 +277,7 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
 
         self.grid.editing = False
 
-        searchedNumeral = config.currentRow
+        searchedNumeral = self.rowSet.currentRow
         self.inputDetail.hidden = False
         self.inputDetail.editable = True
         self.inputDetail.relx = 26
@@ -358,7 +353,7 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
 
         self.grid.editing = False
 
-        searchedNumeral = config.currentRow
+        searchedNumeral = self.rowSet.currentRow
         self.inputDetail.hidden = False
         self.inputDetail.editable = True
         self.inputDetail.relx = 26
@@ -375,51 +370,42 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
 
     def read_record(self, numeral):
         "Search for the required record and store it in a reachable variable. Called from the Detail-field widget."
-        config.screenRow = 0
-        config.fileRow = []
-        for row in config.fileRows:
-            if row[1] == numeral:
-                cur = config.conn.cursor()
-                # ...and I read again 'cause there can be more fields in the form than in the grid list
-                sqlQuery = "SELECT * FROM " + DBTABLENAME + " WHERE numeral=?"
-                while True:     # multiuser DB locking loop...
-                    try:
-                        cur.execute(sqlQuery, (str(numeral),) )
-                        break   # go on
-                    except sqlite3.OperationalError:
-                        bs.notify_OK("\n    Database is locked, please wait.", "Message")
-                filerow = cur.fetchone()
-                config.fileRow.append(filerow[0])   # id
-                config.fileRow.append(filerow[1])   # numeral
-                config.fileRow.append(filerow[2])   # book title
-                config.fileRow.append(filerow[3])   # original title
-                # filerow has no author value, it is found through intermediate table:
-                config.fileRow.append(self.get_patient_name(filerow[1]))   # author
-                config.fileRow.append(filerow[4])   # description
-                config.fileRow.append(filerow[5])   # isbn/sku
-                config.fileRow.append(filerow[6])   # year
-                config.fileRow.append(self.get_publisher_name(filerow[7]))   # publisher
-                config.fileRow.append(filerow[8])   # creation_date
-                config.fileRow.append(filerow[9])   # genre
-                config.fileRow.append(filerow[10])  # cover_type
-                # rounding of price decimals
-                price = filerow[11]
-                ctx = decimal.getcontext()
-                ctx.prec = 6
-                ctx.rounding = decimal.ROUND_HALF_DOWN  # rounds if entered more than self.ndecimals decimals
-                price = str(round(Decimal(price), self.ndecimals))
-                config.fileRow.append(price)
-                self.grid.edit_cell = [config.screenRow, 0]  # highlight the selected row
-                # If the searched index is greater than the first displayed index
-                if config.screenRow > self.grid.begin_row_display_at:
-                    self.grid.ensure_cursor_on_display_down_right(None)
-                else:   # If the searched index is smaller than the first displayed index
-                    self.grid.ensure_cursor_on_display_up(None)
-                return True
-            config.screenRow += 1
-        bs.notify("\n        Record not found", form_color='STANDOUT', wrap=True, wide=False)
-        time.sleep(0.6)     # let it be seen
-        return False    # not found
+        self.rowSet.fileRow = []
+        self.rowSet.screenRow = self.rowSet.rows.position_of_key(numeral)     # indexed, no row walking
+        if self.rowSet.screenRow is None:
+            self.rowSet.screenRow = 0
+            bs.notify("\n        Record not found", form_color='STANDOUT', wrap=True, wide=False)
+            time.sleep(0.6)     # let it be seen
+            return False    # not found
+        # ...and I read again 'cause there can be more fields in the form than in the grid list
+        filerow = ORDERS.by_key(str(numeral))
+        self.rowSet.fileRow.append(filerow[0])   # id
+        self.rowSet.fileRow.append(filerow[1])   # numeral
+        self.rowSet.fileRow.append(filerow[2])   # book title
+        self.rowSet.fileRow.append(filerow[3])   # original title
+        # filerow has no author value, it is found through intermediate table:
+        self.rowSet.fileRow.append(self.get_patient_name(filerow[1]))   # author
+        self.rowSet.fileRow.append(filerow[4])   # description
+        self.rowSet.fileRow.append(filerow[5])   # isbn/sku
+        self.rowSet.fileRow.append(filerow[6])   # year
+        self.rowSet.fileRow.append(self.get_publisher_name(filerow[7]))   # publisher
+        self.rowSet.fileRow.append(filerow[8])   # creation_date
+        self.rowSet.fileRow.append(filerow[9])   # genre
+        self.rowSet.fileRow.append(filerow[10])  # cover_type
+        # rounding of price decimals
+        price = filerow[11]
+        ctx = decimal.getcontext()
+        ctx.prec = 6
+        ctx.rounding = decimal.ROUND_HALF_DOWN  # rounds if entered more than self.ndecimals decimals
+        price = str(round(Decimal(price), self.ndecimals))
+        self.rowSet.fileRow.append(price)
+        self.grid.edit_cell = [self.rowSet.screenRow, 0]  # highlight the selected row
+        # If the searched index is greater than the first displayed index
+        if self.rowSet.screenRow > self.grid.begin_row_display_at:
+            self.grid.ensure_cursor_on_display_down_right(None)
+        else:   # If the searched index is smaller than the first displayed index
+            self.grid.ensure_cursor_on_display_up(None)
+        return True
 
     def exitRxOrderSelector(self):
         "Escape key was pressed: isinstance(self, BookSelectForm) = True; we always come from the OptionField."
@@ -436,9 +422,14 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
             config.parentApp.setNextForm("MAIN")
             config.parentApp.switchFormNow()
 
-    def pre_edit_loop(self):
-        #print("pre_edit_loop()!!!")
-        pass
+    def while_waiting(self):
+        "Idle selector: shows the other terminals' changes to its row set."
+        rowSet = rowSetCache.current(DBTABLENAME)
+        if rowSet.rows is None or rowSetCache.is_fresh(rowSet):
+            return
+        if rowSet.find is None or not self.find_DB_rows(rowSet.find):
+            self.fill_grid()
+        self.display()
 
     def post_edit_loop(self):
         #print("post_edit_loop()!!!")
@@ -542,6 +533,11 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
         else:
             literal = find_literal
 
+        rowSet = rowSetCache.row_set(DBTABLENAME, find_literal)
+        if rowSetCache.bring_up_to_date(rowSet):    # the same Find: its rows, with the changes since
+            return self.show_subset(rowSet)
+        position = rowSetCache.position(DBTABLENAME)
+
         comparator = False
         if literal[0] in ["=","<",">"]:
             comparator = literal[0]
@@ -563,6 +559,11 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
         sqlQuery = "SELECT " + fieldStr + " FROM " + DBTABLENAME + \
             " INNER JOIN 'optidrome.patient' ON 'optidrome.patient'.id = 'optidrome.prescription'.patient_mrn "
             
+        # Full-text index columns for the screen fields
+        fts_column = {"job": "job", "patient": "patient_name"}.get(field.strip().lower()) if field else None
+        fts = not comparator and not date_literal and (field == False or fts_column is not None) and \
+            findIndex.can_match(DBTABLENAME, literal, fts_column)
+
         if field == "numeral":
             field = "'optidrome.rxorder'.job"
         elif field == "patient":
@@ -570,7 +571,11 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
         elif field == "date":
             field = "'optidrome.rxorder'.creation_date"
 
-        if not comparator:
+        if fts:     # through the full-text index
+            whereStr = "WHERE " + findIndex.where_clause(DBTABLENAME, "'optidrome.rxorder'.id") + \
+                " ORDER BY 'optidrome.rxorder'.job"
+            literal = findIndex.match_expression(literal, fts_column)
+        elif not comparator:
             if field == False:  # no field specified, so search all fields
                 # Small trick for dates:
                 if date_literal:
@@ -599,7 +604,7 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
         
         cur = config.conn.cursor()
         try:
-            if comparator:
+            if comparator or fts:
                 pass    # leave literal without percents
             else:
                 literal = "%" + literal + "%"
@@ -616,7 +621,7 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
         if len(filerows) == 0:
             bs.notify("\n    No matching records found","Message", form_color='STANDOUT', wrap=True, wide=False)
             return False
-        rows = []        
+        rows = rowSource.IndexedRows(read_row=self.grid_row)     # Find subset, indexed by key and id
         for row in filerows:
             id = row[0]
             numeral = row[1]
@@ -628,11 +633,16 @@ class RxOrderSelectForm(npyscreen.FormBaseNew):
             isbn = row[7]
             cRow = [id, numeral, title, patient, year, publisher, date, isbn]
             rows.append(cRow)
-        config.fileRows = rows
-        self.screenFileRows = self.getRowListForScreen(config.fileRows)     # it's a list of lists
+        rowSet.rows = rows
+        rowSetCache.loaded(rowSet, position)
+        return self.show_subset(rowSet)
+
+    def show_subset(self, rowSet):
+        "Puts a Find subset into the grid."
+        rowSetCache.activate(rowSet)
+        self.screenFileRows = self.getRowListForScreen(self.rowSet.rows)     # it's a list of lists
         self.grid.values = self.screenFileRows
-        self.set_up_title(filerows, full_set=False)
-
+        self.set_up_title(self.rowSet.rows, full_set=False)
         return True
 
     def DBtoScreenDate(self, DBdate, format):
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     schemaCheck.py - Startup validation of the database schema
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# The expected model is what dbInitialize builds (tables + migrations), made
+# in memory. The database schema is read in one query, every table with its
+# columns. A missing REQUIRED_TABLES table stops the program; the other
+# differences (older databases name some columns differently) are reported.
+# A passed check is cached in CACHE_FILE, keyed by DB file and its PRAGMA
+# schema_version, which only changes with the schema (not the file's mtime,
+# which every write and WAL checkpoint bumps): a warm start doesn't validate
+# anything.
+##############################################################################
+
+import json
+import os
+import sqlite3
+
+import config
+import dbInitialize
+
+REQUIRED_TABLES = ["optidrome.patient", "optidrome.rxorder", "optidrome.frame", "optidrome.lens", "optidrome.user", \
+    "optidrome.vendor"]
+CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", config.pname, "schema_check.json")  # per terminal
+
+SCHEMA_QUERY = "SELECT m.name, p.name, p.type, p.\"notnull\" FROM sqlite_schema AS m " + \
+    "JOIN pragma_table_info(m.name) AS p WHERE m.type = 'table' ORDER BY m.name, p.cid"
+
+
+def read_schema(conn):
+    "{table: {column: (type, notnull)}} of a database, in one query."
+    schema = {}
+    for table, column, type, notnull in conn.execute(SCHEMA_QUERY):
+        schema.setdefault(table, {})[column] = (type.upper(), notnull)
+    return schema
+
+def expected_schema():
+    "The model: a new database of this program version, built in memory."
+    conn = sqlite3.connect(":memory:")
+    dbInitialize.migrate(conn)
+    schema = read_schema(conn)
+    conn.close()
+    return schema
+
+def compare(schema, model):
+    "Returns (missing required tables, list of other differences as text lines)."
+    missing = [table for table in REQUIRED_TABLES if table not in schema]
+    differences = []
+    for table, columns in model.items():
+        if table not in schema:
+            if table not in missing:
+                differences.append("Table '" + table + "' does not exist")
+            continue
+        for column, (type, notnull) in columns.items():
+            if column not in schema[table]:
+                differences.append(table + "." + column + ": does not exist")
+            elif schema[table][column][0] != type:
+                differences.append(table + "." + column + ": " + schema[table][column][0] + ", expected " + type)
+    return missing, differences
+
+def cache_key(conn, filename):
+    return [os.path.abspath(filename), conn.execute("PRAGMA schema_version").fetchone()[0]]
+
+def is_cached(key):
+    try:
+        with open(CACHE_FILE) as json_file:
+            return json.load(json_file) == key
+    except (OSError, ValueError):   # no cache yet, or unreadable
+        return False
+
+def store_cache(key):
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(CACHE_FILE, "w") as outfile:
+            outfile.write(json.dumps(key))
+    except OSError:     # no writable home: we'll just validate every time
+        pass
+
+def validate(conn, filename):
+    """ validates the schema of the database file, unless this very schema was validated before
+    :return: (missing required tables, other differences); ([], []) on a warm start
+    """
+    key = cache_key(conn, filename)
+    if is_cached(key):
+        return [], []
+    missing, differences = compare(read_schema(conn), expected_schema())
+    if not missing:
+        store_cache(key)    # the differences are shown once, not on every start
+    return missing, differences
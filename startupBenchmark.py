@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     startupBenchmark.py - Timings of the program's startup imports
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Every run is a new Python interpreter, started in the program directory,
+# that does what main.py does before the main menu shows up and times:
+#   config import       'import config'
+#   program_version     the first read of config.program_version
+#   mainMenu import     'import mainMenu', with npyscreen and every form
+# plus the whole interpreter, from its start to its exit. The interpreter
+# alone ('python -c pass') is timed too, as the floor of every run.
+# Every one runs --repeat times; the median and the fastest run are printed,
+# and go into a json report with --output. With --source, another working
+# copy of the program is timed, like a checkout of an older version:
+#   python startupBenchmark.py [--repeat 20] [--source ../old] [--output x.json]
+# Without npyscreen installed, the mainMenu import is reported as failed and
+# the rest is still timed.
+##############################################################################
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+REPEAT = 20
+
+# What every timed interpreter runs. It prints a json dict of ms per step.
+STARTUP_SCRIPT = """
+import json, time
+timings = {}
+start = time.perf_counter()
+import config
+timings["config import"] = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+config.program_version
+timings["program_version"] = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+try:
+    import mainMenu
+    timings["mainMenu import"] = (time.perf_counter() - start) * 1000
+except ImportError as error:
+    timings["mainMenu import"] = repr(error)
+print(json.dumps(timings))
+"""
+
+
+def run_interpreter(source, code):
+    "A new interpreter in the 'source' directory running 'code': its output and its wall time in ms."
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=source, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return result.stdout, elapsed
+
+def timing(values):
+    return {"median_ms": round(statistics.median(values), 3), "min_ms": round(min(values), 3)}
+
+def run_benchmark(source, repeat):
+    "The startup steps of 'source', 'repeat' times each. Failed steps come back as their error."
+    steps = {}
+    errors = {}
+    floor = []
+    total = []
+    for n in range(repeat):
+        floor.append(run_interpreter(source, "pass")[1])
+        output, elapsed = run_interpreter(source, STARTUP_SCRIPT)
+        total.append(elapsed)
+        for name, value in json.loads(output).items():
+            if isinstance(value, str):
+                errors[name] = value
+            else:
+                steps.setdefault(name, []).append(value)
+    results = {name: timing(values) for name, values in steps.items()}
+    results["interpreter only"] = timing(floor)
+    results["whole run"] = timing(total)
+    return results, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the program's startup imports in new interpreters.")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="interpreters started")
+    parser.add_argument("--source", default=os.path.dirname(os.path.abspath(__file__)), \
+        help="program directory to time (default: this one)")
+    parser.add_argument("--output", help="json report")
+    args = parser.parse_args()
+
+    results, errors = run_benchmark(os.path.abspath(args.source), args.repeat)
+    print("Startup of " + args.source + ", " + str(args.repeat) + " runs:")
+    for name, result in results.items():
+        print("    " + name.ljust(20) + str(result["median_ms"]).rjust(10) + " ms median" + \
+            str(result["min_ms"]).rjust(10) + " ms fastest")
+    for name, error in errors.items():
+        print("    " + name.ljust(20) + "failed: " + error)
+
+    if args.output:
+        report = {"source": os.path.abspath(args.source),
+                  "python": platform.python_version(),
+                  "system": platform.system() + " " + platform.release(),
+                  "date": datetime.now().isoformat(timespec="seconds"),
+                  "repeat": args.repeat,
+                  "results": results,
+                  "errors": errors
+                  }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=1)
+        print("Report: " + args.output)
+
+
+if __name__ == "__main__":
+    main()
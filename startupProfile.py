@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     startupProfile.py - Startup instrumentation mode
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Turned on by 'python main.py --profile', by the OPTIDROME_PROFILE
+# environment variable (1, or the report file name) or by config.PROFILING.
+# It records:
+#   - startup phases (config import, DB connect, table checks, every form
+#     build, first paint of the main menu), in ms since the program started;
+#   - import times of every module imported the first time, nested included;
+#   - a cProfile of the whole run, sorted by cumulative time;
+# and writes them as json into REPORT_FILE when the program exits.
+# Nothing here imports config, so main.py can time the config import itself.
+##############################################################################
+
+import builtins
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+
+ENV_VARIABLE = "OPTIDROME_PROFILE"
+CLI_FLAG = "--profile"
+REPORT_FILE = "startup_profile.json"    # in the working directory
+TOP_FUNCTIONS = 40      # cProfile rows in the report
+
+enabled = False
+t0 = time.perf_counter()    # the program's time zero
+phases = []             # [name, start ms, duration ms]
+imports = []            # [module, ms], nested imports included
+profiler = None
+_original_import = builtins.__import__
+
+
+def ms_since_start():
+    return round((time.perf_counter() - t0) * 1000, 3)
+
+def requested():
+    "The instrumentation mode was asked for in the command line or the environment."
+    return CLI_FLAG in sys.argv or os.environ.get(ENV_VARIABLE, "") not in ("", "0")
+
+def enable():
+    "Starts the instrumentation: import timing now, cProfile from start_profiler()."
+    global enabled, REPORT_FILE
+    if enabled:
+        return
+    enabled = True
+    if CLI_FLAG in sys.argv:
+        sys.argv.remove(CLI_FLAG)
+    value = os.environ.get(ENV_VARIABLE, "")
+    if value not in ("", "0", "1"):     # a report file name
+        REPORT_FILE = value
+    builtins.__import__ = _timed_import
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    "builtins.__import__ replacement: times the modules imported for the first time."
+    if level != 0 or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    start = time.perf_counter()
+    module = _original_import(name, globals, locals, fromlist, level)
+    imports.append([name, round((time.perf_counter() - start) * 1000, 3)])
+    return module
+
+@contextlib.contextmanager
+def phase(name):
+    "with phase('DB connect'): ... records the block's duration, if the mode is on."
+    if not enabled:
+        yield
+        return
+    start = ms_since_start()
+    try:
+        yield
+    finally:
+        phases.append([name, start, round(ms_since_start() - start, 3)])
+
+def mark(name):
+    "A zero-length phase, like the first paint."
+    if enabled:
+        phases.append([name, ms_since_start(), 0])
+
+def start_profiler():
+    global profiler
+    if enabled:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+def write_report(pname="", version=""):
+    "Writes the json report. Called on program exit, however it exits."
+    if not enabled:
+        return
+    builtins.__import__ = _original_import
+    functions = []
+    if profiler is not None:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)  # by cumulative time
+        for (filename, line, function), (cc, ncalls, tottime, cumtime, callers) in rows[:TOP_FUNCTIONS]:
+            functions.append({"function": os.path.basename(filename) + ":" + str(line) + "(" + function + ")", \
+                "calls": ncalls, "tottime_ms": round(tottime * 1000, 3), "cumtime_ms": round(cumtime * 1000, 3)})
+    report = {  "program": pname,
+                "version": version,
+                "python": platform.python_version(),
+                "system": platform.system(),
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "total_ms": ms_since_start(),
+                "phases": [{"phase": name, "start_ms": start, "ms": duration} for name, start, duration in phases],
+                "imports": [{"module": name, "ms": duration} for name, duration in imports],
+                "functions": functions
+                }
+    with open(REPORT_FILE, "w") as outfile:
+        json.dump(report, outfile, indent=1)
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     testData.py - Deterministic fake data for the optidrome tables
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# Fills a database with made-up vendors, frames, lenses, patients, orders
+# and their prescriptions, sized by the number of patients. The same size
+# and seed always give the same rows, so timings of different program
+# versions compare. Names are unique and use accented letters, for the ICU
+# sort keys; prescriptions have plausible sph/cyl/axis/add values.
+#   python testData.py --rows 100000 [--seed 1] [--db file]
+# The database is created (or migrated) first. Rows are added after the
+# existing ones, so the keys must not be taken: use a new database.
+##############################################################################
+
+import argparse
+import datetime
+import random
+import sqlite3
+import sys
+import time
+import unicodedata
+
+import collation
+import config
+import dbInitialize
+import findIndex
+
+SEED = 1
+BATCH_SIZE = 20000      # rows per executemany()
+
+FIRST_NAMES = ["Aitana", "Álvaro", "Amélie", "Ana", "Andrés", "Ángela", "Antoine", "Beatriz", "Bruno", "Camille",
+    "Carlos", "Carmen", "Chloé", "Clara", "Daniel", "David", "Élodie", "Emma", "Enzo", "Ernesto", "Fátima", "Felipe",
+    "François", "Gabriel", "Hélène", "Hugo", "Inés", "Iván", "Jacques", "Javier", "Jérôme", "Joan", "Jordi", "José",
+    "Julia", "Léa", "Lucía", "Luis", "Manon", "Marc", "María", "Marta", "Mateo", "Mireia", "Montserrat", "Nicolás",
+    "Noémie", "Núria", "Óscar", "Pablo", "Paula", "Pierre", "Raúl", "René", "Rocío", "Sofía", "Sören", "Teresa",
+    "Zoë", "Zuriñe"]
+LAST_NAMES = ["Abad", "Álvarez", "Benítez", "Blanco", "Bonnet", "Castaño", "Castro", "Cortés", "Díaz", "Domínguez",
+    "Dubois", "Durand", "Escrivà", "Fernández", "Ferrer", "Font", "Fontaine", "García", "Garnier", "Gil", "Giménez",
+    "Gómez", "González", "Gutiérrez", "Hernández", "Ibáñez", "Iglesias", "Jiménez", "Lambert", "Lefèvre", "López",
+    "Márquez", "Martín", "Martínez", "Mercier", "Molina", "Moreno", "Muñoz", "Navarro", "Núñez", "Ortega", "Ortiz",
+    "Pérez", "Prieto", "Puig", "Ramírez", "Ramos", "Roig", "Rousseau", "Rubio", "Ruiz", "Sánchez", "Santos", "Sanz",
+    "Serrano", "Suárez", "Torres", "Vázquez", "Vidal", "Zúñiga"]
+INITIALS = "ABCDEFGHIJKLMNOPRSTUVZ"
+STREETS = ["Main St", "Oak Ave", "Maple Rd", "Elm St", "Park Blvd", "Cedar Ln", "Pine St", "Lake Dr", "Hill Rd", "River Rd"]
+CITIES = ["Springfield", "Riverside", "Fairview", "Georgetown", "Salem", "Madison", "Franklin", "Clinton"]
+DOCTORS = ["Dr. " + name for name in LAST_NAMES[:24]]
+COLORS = ["Black", "Tortoise", "Gold", "Silver", "Crystal", "Navy", "Burgundy", "Gunmetal"]
+EDGES = ["Polish", "Satin", "Safety bevel", "Drill mount", "Groove"]
+TODAY = datetime.date(2024, 1, 1)   # a fixed "today", for repeatable dates
+
+
+def ascii_name(text):
+    "María Núñez -> maria.nunez, for the emails."
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return text.lower().replace(" ", ".")
+
+def phone(rng):
+    return "555-" + str(rng.randint(100, 999)) + "-" + str(rng.randint(1000, 9999))
+
+def day(rng, first, last):
+    "A random date between two dates, as stored (ISO)."
+    return (first + datetime.timedelta(days=rng.randint(0, (last - first).days))).isoformat()
+
+def quarter_steps(value, low, high):
+    "Rounded to the 0.25 D steps of a refraction, within limits."
+    return min(max(round(value * 4) / 4, low), high) + 0.0     # no -0.0
+
+
+def patient_names(count):
+    """ count unique names, "First I. Last-Last", spread over the alphabet
+    :return: generator of names
+    """
+    combinations = len(FIRST_NAMES) * len(INITIALS) * len(LAST_NAMES) ** 2
+    if count > combinations:
+        raise ValueError("at most " + str(combinations) + " patients")
+    step = 1000003      # a prime: i * step mod combinations visits every combination once
+    for i in range(count):
+        n = i * step % combinations
+        n, first = divmod(n, len(FIRST_NAMES))
+        n, initial = divmod(n, len(INITIALS))
+        last2, last1 = divmod(n, len(LAST_NAMES))
+        yield FIRST_NAMES[first] + " " + INITIALS[initial] + ". " + LAST_NAMES[last1] + "-" + LAST_NAMES[last2]
+
+def vendor_rows(rng, count):
+    for n in range(1, count + 1):
+        name = rng.choice(LAST_NAMES) + (" Optical Lab" if n % 3 == 0 else " Eyewear")
+        yield (n, name, str(rng.randint(1, 999)) + " " + rng.choice(STREETS) + ", " + rng.choice(CITIES), phone(rng),
+            phone(rng), "orders" + str(n) + "@" + ascii_name(name).replace(".", "") + ".example", "www." + \
+            ascii_name(name).replace(".", "") + ".example", None, "PO Box " + str(rng.randint(100, 9999)),
+            round(rng.uniform(500, 20000), 2), day(rng, TODAY - datetime.timedelta(days=30), TODAY),
+            rng.choice(["Net 30", "Net 60", "Prepaid"]), n % 3 == 0)
+
+def frame_rows(rng, count, vendors):
+    for sku in range(1, count + 1):
+        a = rng.randint(44, 58)
+        cost = round(rng.uniform(15, 120), 2)
+        yield (sku, rng.randint(1, vendors), rng.choice(config.frameMakeList), rng.choice("ABCDEFGHJK") + \
+            str(rng.randint(100, 999)), rng.choice(COLORS), rng.choice(config.frameMaterialList), \
+            rng.choice(config.frameStyleList), a, a - rng.randint(10, 18), a + rng.randint(2, 6), rng.randint(14, 22), \
+            rng.choice([135, 140, 145, 150]), cost, round(cost * rng.uniform(2, 3.5), 2))
+
+def lens_rows(rng, count, labs):
+    for sku in range(1, count + 1):
+        cost = round(rng.uniform(8, 90), 2)
+        yield (sku, rng.choice(config.lensStyleList), rng.choice(config.lensAugmentList), \
+            rng.choice(config.lensMaterialList), rng.choice(labs), cost, round(cost * rng.uniform(2, 4), 2))
+
+def patient_rows(rng, count):
+    for mrn, name in enumerate(patient_names(count), 1):
+        yield (mrn, name, collation.sort_key(name), collation.fold_key(name), day(rng, datetime.date(1935, 1, 1), datetime.date(2020, 12, 31)), \
+            phone(rng), ascii_name(name).replace("-", ".") + str(mrn) + "@mail.example", \
+            str(rng.randint(1, 9999)) + " " + rng.choice(STREETS) + ", " + rng.choice(CITIES), None)
+
+def refraction(rng, rx_type):
+    "(sph, cyl, axis, add) of one eye. Mostly mild myopia, minus cylinder, adds for multifocals."
+    sph = quarter_steps(rng.gauss(-1.0, 2.25), -12, 8)
+    cyl = quarter_steps(-abs(rng.gauss(0, 0.75)), -4, 0)
+    axis = rng.randint(1, 180) if cyl else 180
+    add = quarter_steps(rng.uniform(0.75, 3.0), 0.75, 3.0) if rx_type != "SV" else None
+    return sph, cyl, axis, add
+
+def order_and_prescription_rows(rng, count, patients, frames, lenses, names, name_keys):
+    """ one order and its prescription per job
+    :return: generator of (order row, prescription row)
+    """
+    start = TODAY - datetime.timedelta(days=3650)
+    for job in range(1, count + 1):
+        mrn = rng.randint(1, patients)
+        created = start + datetime.timedelta(days=rng.randint(0, 3650))
+        due = created + datetime.timedelta(days=rng.randint(7, 14))
+        status = rng.randrange(len(config.orderStatusList))
+        price = round(rng.uniform(90, 900), 2)
+        paid = rng.choice(config.orderPaymentStatusList)
+        rx_type = rng.choice(config.lensStyleList)
+        pd = rng.randint(54, 72) + rng.choice([0, 0.5])
+        order = (job, mrn, names[mrn - 1], name_keys[mrn - 1], created.isoformat(), due.isoformat(), status >= 2,
+            due.isoformat() if status >= 3 else "", job, rng.randint(1, frames), rng.randint(1, lenses),
+            rng.choice(config.lensAugmentList), None, None, None, rng.choice(EDGES), False, False,
+            rng.choice(config.lensCoatList), pd, "Lab " + str(rng.randint(1, 9)), job, price, round(price * 0.4, 2),
+            status, rng.choice(config.orderTypeList), paid, created.isoformat() if paid == "Paid" else "",
+            price if paid == "Paid" else 0.0, rng.choice(config.orderPaymentList), None, "", "", "", None, None)
+        od_sph, od_cyl, od_axis, od_add = refraction(rng, rx_type)
+        os_cyl, os_axis = refraction(rng, rx_type)[1:3]
+        os_sph = quarter_steps(od_sph + rng.gauss(0, 0.5), -12, 8)   # both eyes alike, and the same add
+        prescription = (job, job, mrn, names[mrn - 1], created.isoformat(), \
+            (created + datetime.timedelta(days=730)).isoformat(), rx_type, None, rng.choice(DOCTORS), phone(rng), None,
+            od_sph, od_cyl, od_axis, od_add, "0.5 BI" if rng.random() < 0.02 else None, os_sph, os_cyl, os_axis, od_add)
+        yield order, prescription
+
+
+ORDER_COLUMNS = ["job", "patient_mrn", "patient_name", "patient_name_key", "creation_date", "due_date", "notified",
+    "dispense_date", "rx_num", "frame_id", "lens_id", "lens_color", "tint_color_id", "tint_intensity", "treatment",
+    "edge_treatment", "uncut", "iof", "coating_id", "pd", "origin_lab", "invoice_num", "price", "cost", "status",
+    "order_type", "order_paymentstatus", "order_paymentdate", "order_paymentamount", "order_paymentmethod",
+    "order_paymentnotes", "order_shipdate", "order_shipmethod", "order_shiptracking", "order_shipnotes", "notes"]
+PRESCRIPTION_COLUMNS = ["rx_num", "rxorder_job", "patient_mrn", "patient_name", "date", "expiration", "rx_type",
+    "notes", "doctor", "doctor_phone", "doctor_address", "rx_od_sph", "rx_od_cyl", "rx_od_axis", "rx_od_add",
+    "rx_od_prism", "rx_os_sph", "rx_os_cyl", "rx_os_axis", "rx_os_add"]
+TABLES = [("'optidrome.vendor'", ["vendor_num", "name", "address", "phone", "fax", "email", "website", "notes",
+                "billing_address", "estimated_billing", "billing_date", "billing_terms", "is_lab"]),
+          ("'optidrome.frame'", ["sku", "vendor_id", "make", "model", "color", "material", "edge_type", "a", "b", "ed",
+                "dbl", "temple", "cost", "price"]),
+          ("'optidrome.lens'", ["sku", "type", "design", "material", "origin_lab_num", "cost", "price"]),
+          ("'optidrome.patient'", ["mrn", "name", "name_key", "name_fold", "dob", "phone", "email", "address", "notes"]),
+          ("'optidrome.rxorder'", ORDER_COLUMNS),
+          ("'optidrome.prescription'", PRESCRIPTION_COLUMNS)
+          ]
+
+
+def sizes(rows):
+    "Rows of every table for a number of patients: one order (with its prescription) per patient."
+    vendors = max(6, rows // 2000)
+    return {"'optidrome.vendor'": vendors,
+            "'optidrome.frame'": max(20, rows // 100),
+            "'optidrome.lens'": max(20, rows // 200),
+            "'optidrome.patient'": rows,
+            "'optidrome.rxorder'": rows,
+            "'optidrome.prescription'": rows
+            }
+
+def insert_rows(conn, tablename, columns, rows):
+    "executemany() in batches, in the current transaction."
+    sqlQuery = "INSERT INTO " + tablename + " (" + ",".join(columns) + ") VALUES (" + ",".join("?" * len(columns)) + ")"
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            conn.executemany(sqlQuery, batch)
+            batch = []
+    if batch:
+        conn.executemany(sqlQuery, batch)
+
+def generate(conn, rows, seed=SEED):
+    """ adds the fake rows to a migrated database, in one transaction
+    :param rows: number of patients, orders and prescriptions; the other tables are sized from it
+    :return: {table: rows added}
+    """
+    rng = random.Random(seed)
+    count = sizes(rows)
+    (vendorTable, vendorColumns), (frameTable, frameColumns), (lensTable, lensColumns), \
+        (patientTable, patientColumns), (orderTable, orderColumns), (prescriptionTable, prescriptionColumns) = TABLES
+    vendors = count[vendorTable]
+    names = list(patient_names(rows))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        insert_rows(conn, vendorTable, vendorColumns, vendor_rows(rng, vendors))
+        insert_rows(conn, frameTable, frameColumns, frame_rows(rng, count[frameTable], vendors))
+        insert_rows(conn, lensTable, lensColumns, lens_rows(rng, count[lensTable], list(range(3, vendors + 1, 3))))
+        insert_rows(conn, patientTable, patientColumns, patient_rows(rng, rows))
+        name_keys = [collation.sort_key(name) for name in names]
+        prescriptions = []      # written after the orders, which they point to
+        def orders():
+            for order, prescription in order_and_prescription_rows(rng, rows, rows, count[frameTable], \
+                    count[lensTable], names, name_keys):
+                prescriptions.append(prescription)
+                yield order
+        insert_rows(conn, orderTable, orderColumns, orders())
+        insert_rows(conn, prescriptionTable, prescriptionColumns, prescriptions)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a new " + config.pname + " database with fake test records.")
+    parser.add_argument("--rows", type=int, default=1000, help="patients, orders and prescriptions")
+    parser.add_argument("--seed", type=int, default=SEED, help="random seed: the same seed gives the same rows")
+    parser.add_argument("--db", default=config.dataPath + config.dbname, help="database file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(args.db, isolation_level=None)  # transactions by hand
+    dbInitialize.migrate(conn)
+    try:
+        count = generate(conn, args.rows, args.seed)
+    except (sqlite3.Error, ValueError) as e:   # like keys already taken
+        print(config.pname + ": " + str(e), file=sys.stderr)
+        sys.exit(2)
+    findIndex.set_up(conn)      # Find's index, as the program would build it at startup
+    conn.close()
+    for tablename, rows in count.items():
+        print(tablename.strip("'").ljust(24) + str(rows))
+    print(str(round(time.perf_counter() - start, 1)) + " s")
+
+
+if __name__ == '__main__':
+    main()
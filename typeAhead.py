@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     typeAhead.py - Chooser values read from the database as you type
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# A Chooser given a valueSource= instead of values= doesn't hold the whole
+# list: it asks its source for the first LIMIT values starting with what was
+# typed, or for the ones from the field's value on when its popup opens.
+# The source reads them from the table's folded column (see collation.py
+# FOLD_KEYS: lowercase, no accents, like prefixIndex.fold()) through its
+# index: a range scan that stops after LIMIT rows, whatever the table's size.
+# The lists read are kept by valueLists.py, so going back to a prefix
+# (backspace) doesn't query again while the table is unchanged. The chooser
+# waits DELAY ms after a keystroke, and doesn't query if another key comes.
+#   source = typeAhead.QueryValues(PATIENT, "name", "name_fold", "name_key")
+#   self.add(bs.TitleChooser, name="Patient:", valueSource=source, ...)
+##############################################################################
+
+import config
+import prefixIndex
+import valueLists
+
+LIMIT = config.TYPE_AHEAD_LIMIT     # values read per lookup
+DELAY = config.TYPE_AHEAD_DELAY     # ms the chooser waits for the next key before a lookup
+
+END = "\U0010ffff"  # after any text that starts with the same prefix
+
+
+class QueryValues():
+    "A chooser's values, read LIMIT at a time from a table's indexed folded column."
+    def __init__(self, tablename, column, fold_column, order_column, limit=LIMIT):
+        self.tablename = tablename
+        self.limit = limit
+        self.name = tablename + " " + column     # of the lists kept by valueLists
+        # the index on (fold_column, order_column) gives the rows in order: no sort
+        self.sqlQuery = "SELECT " + column + " FROM " + tablename + " WHERE " + fold_column + " >= ? AND " + \
+            fold_column + " < ? ORDER BY " + fold_column + ", " + order_column + " LIMIT ?"
+
+    def read(self, first, last):
+        "The values whose folded form is in [first, last), as a Chooser 'complex' list: [('value',)]"
+        cur = config.conn.execute(self.sqlQuery, (first, last, self.limit))
+        return [(row[0],) for row in cur]
+
+    def starting_with(self, prefix):
+        "The first values that start with prefix, case and accents ignored."
+        first = prefixIndex.fold(prefix)
+        return valueLists.get(self.name + " starting with", self.tablename, self.read, first, first + END)
+
+    def from_value(self, value):
+        "The values from this one on, in order: the popup's list."
+        return valueLists.get(self.name + " from", self.tablename, self.read, prefixIndex.fold(value or ""), END)
@@ -10,7 +10,6 @@
 # (http://www.freebsd.org/copyright/freebsd-license.html)
 ##############################################################################
 
-import base64
 import curses
 import sqlite3
 import time
@@ -20,6 +19,8 @@ from npyscreen import wgwidget as widget
 
 import bsWidgets as bs
 import config
+import dbLocking
+import records
 
 DATEFORMAT = config.dateFormat
 DBTABLENAME = "'optidrome.user'"
@@ -45,6 +46,11 @@ class UserForm(npyscreen.FormBaseNew):
 
         self.selectorForm = self.parentApp._Forms['USERSELECTOR']
 
+    @property
+    def rowSet(self):
+        "The row set of the selector this form is opened from: its rows and the record read (see rowSetCache.py)."
+        return self.selectorForm.rowSet
+
     def create(self):
         """The standard constructor will call the method .create(), which you should override to create the Form widgets."""
         self.framed = True   # framed form
@@ -77,20 +83,15 @@ class UserForm(npyscreen.FormBaseNew):
         self.bu_password = self.passwordFld.value  
 
     def update_fileRow(self):
-        "Updates config.fileRow."
+        "Updates self.rowSet.fileRow."
         if self.current_option != "Delete":
-            id = config.fileRow[0]
-            for row in config.fileRows:
-                if row[0] == id:
-                    config.fileRow = []
-                    config.fileRow.append(row[0])
-                    config.fileRow.append(int(self.numeralFld.value))
-                    config.fileRow.append(self.userFld.value)
-                    config.fileRow.append(self.usernameFld.value)
-                    config.fileRow.append(self.userlevelFld.value)
-                    config.fileRow.append(self.creationDateFld.value)
-                    config.fileRow.append(self.passwordFld.value)
-                    break
+            self.rowSet.fileRow = [self.rowSet.fileRow[0]]   # the same id: no need to look for the row in self.rowSet.rows
+            self.rowSet.fileRow.append(int(self.numeralFld.value))
+            self.rowSet.fileRow.append(self.userFld.value)
+            self.rowSet.fileRow.append(self.usernameFld.value)
+            self.rowSet.fileRow.append(self.userlevelFld.value)
+            self.rowSet.fileRow.append(self.creationDateFld.value)
+            self.rowSet.fileRow.append(self.passwordFld.value)
 
     def exit_user(self):
         "Only for escape-exit, handler version."
@@ -106,9 +107,7 @@ class UserForm(npyscreen.FormBaseNew):
             self.backup_fields()
         self.selectorForm.grid.update()
 
-        # To unlock the database (for Create) we must disconnect and re-connect:
-        config.conn.close()
-        self.parentApp.connect_database()
+        dbLocking.end_editing(self.parentApp)  # unlock the database, if it was locked
 
         config.parentApp.setNextForm("USERSELECTOR")
         config.parentApp.switchFormNow()
@@ -128,14 +127,7 @@ class UserForm(npyscreen.FormBaseNew):
         "Setting the user form to create a new record."
         global form
         conn = config.conn
-        while True:     # for Creation, we must set the locking here
-            try:
-                conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite only allows a single writer per database
-                conn.execute('PRAGMA locking_mode = EXCLUSIVE')
-                conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
-                break
-            except sqlite3.OperationalError:
-                bs.notify_OK("\n    Database is locked, please wait.", "Message")
+        dbLocking.lock_for_editing(conn, create=True)  # for Creation, we must set the locking here (see WAL_MODE)
         form.current_option = "Create"
         form.numeralFld.editable = True
         form.numeralFld.maximum_string_length = 3
@@ -182,8 +174,8 @@ class UserForm(npyscreen.FormBaseNew):
         "Setting the user form for update editing."
         global form
         conn = config.conn
-        conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite3 admits just one writing process
-        conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+        dbLocking.lock_for_editing(conn)   # exclusive access in the old mode, nothing in WAL_MODE
+        form.bu_version = dbLocking.row_version(conn, DBTABLENAME, form.rowSet.fileRow[0])    # checked at Save
         form.current_option = "Update"
         form.convertDBtoFields()
         form.numeralFld.editable = True
@@ -208,8 +200,7 @@ class UserForm(npyscreen.FormBaseNew):
         "Setting the user form for deleting."
         global form
         conn = config.conn
-        conn.isolation_level = 'EXCLUSIVE'  # Database locking: SQLite3 admits just one writing process
-        conn.execute('BEGIN EXCLUSIVE TRANSACTION')     # exclusive access starts here. Nothing else can r/w the DB.
+        dbLocking.lock_for_editing(conn)   # exclusive access in the old mode, nothing in WAL_MODE
         form.current_option = "Delete"
         form.convertDBtoFields()
         form.numeralFld.editable = False
@@ -228,12 +219,12 @@ class UserForm(npyscreen.FormBaseNew):
 
     def convertDBtoFields(self):
         "Convert DB fields into screen fields (strings)."
-        self.numeralFld.value = str(config.fileRow[1])
-        self.userFld.value = config.fileRow[2]
-        self.usernameFld.value = config.fileRow[3]
-        self.userlevelFld.value = str(config.fileRow[4])
-        self.creationDateFld.value = self.DBtoScreenDate(config.fileRow[5], DATEFORMAT)
-        self.passwordFld.value = config.fileRow[6]
+        self.numeralFld.value = str(self.rowSet.fileRow[1])
+        self.userFld.value = self.rowSet.fileRow[2]
+        self.usernameFld.value = self.rowSet.fileRow[3]
+        self.userlevelFld.value = str(self.rowSet.fileRow[4])
+        self.creationDateFld.value = self.DBtoScreenDate(self.rowSet.fileRow[5], DATEFORMAT)
+        self.passwordFld.value = self.rowSet.fileRow[6]
 
     def strip_fields(self):
         "Required trimming of leading and trailing spaces."
@@ -246,14 +237,14 @@ class UserForm(npyscreen.FormBaseNew):
     
     def save_mem_record(self):
         "Save new record (from Create) in global variable."
-        config.fileRow = []
-        config.fileRow.append(None)    # ID field is incremental, fulfilled later
-        config.fileRow.append(int(self.numeralFld.value))
-        config.fileRow.append(self.userFld.value)
-        config.fileRow.append(self.usernameFld.value)
-        config.fileRow.append(int(self.userlevelFld.value))
-        config.fileRow.append(self.creationDateFld.value)
-        config.fileRow.append(self.passwordFld.value)
+        self.rowSet.fileRow = []
+        self.rowSet.fileRow.append(None)    # ID field is incremental, fulfilled later
+        self.rowSet.fileRow.append(int(self.numeralFld.value))
+        self.rowSet.fileRow.append(self.userFld.value)
+        self.rowSet.fileRow.append(self.usernameFld.value)
+        self.rowSet.fileRow.append(int(self.userlevelFld.value))
+        self.rowSet.fileRow.append(self.creationDateFld.value)
+        self.rowSet.fileRow.append(self.passwordFld.value)
     
     def createOKbtn_function(self):
         "OK button function under Create mode."
@@ -265,8 +256,8 @@ class UserForm(npyscreen.FormBaseNew):
         else:
             if self.exist_changes():
                 self.save_mem_record()  # backup record in config variable
-                self.encrypt_password()
-                self.save_created_user()
+                if not self.save_created_user():
+                    return  # back to the form, password as typed
                 self.selectorForm.grid.set_highlight_row(int(self.numeralFld.value))
             else:
                 self.exitUser(modified=False)
@@ -295,25 +286,23 @@ class UserForm(npyscreen.FormBaseNew):
         "Button based Delete function for D=Delete."
         conn = config.conn
         cur = conn.cursor()
-        id = config.fileRow[0]
-        sqlQuery = "DELETE FROM " + DBTABLENAME + " WHERE id = " + str(id)
-        cur.execute(sqlQuery)
-        conn.commit()
+        id = self.rowSet.fileRow[0]
+        index = self.rowSet.rows.position_of_id(id)     # for positioning, while the row is still there
+        with dbLocking.write_transaction(conn):
+            records.delete_record(cur, DBTABLENAME, id)
         bs.notify("\n       Record deleted", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        # update config.fileRows:
-        index = 0           # for positioning
-        for row in config.fileRows:
-            if row[0] == id:
-                config.fileRows.remove(row)
-                break
-            index += 1
-        # update config.fileRow to the previous record in list:
+        # update self.rowSet.rows:
+        if index is None:
+            index = len(self.rowSet.rows)
+        else:
+            self.rowSet.rows.remove(self.rowSet.rows[index])
+        # update self.rowSet.fileRow to the previous record in list:
         if index > 0:
             index -= 1
         try:
-            config.fileRow = config.fileRows[index]
+            self.rowSet.fileRow = self.rowSet.rows[index]
         except IndexError:  # there are no rows in the table
-            config.fileRow = []
+            self.rowSet.fileRow = []
         self.exitUser(modified=True)
 
     def deleteOKbtn_function(self):
@@ -323,7 +312,7 @@ class UserForm(npyscreen.FormBaseNew):
         if bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
             self.delete_user()
             try:
-                numeral = config.fileRow[1]
+                numeral = self.rowSet.fileRow[1]
             except IndexError:
                 numeral = None            
             self.selectorForm.grid.set_highlight_row(numeral)
@@ -346,94 +335,31 @@ class UserForm(npyscreen.FormBaseNew):
             if self._widgets_by_id[w].name == fieldName:
                 return w
 
+    def field_values(self, DBdate=True):
+        "The fields as a dict of column values, for records.py. The creation date in DB format, once it's been checked."
+        creationDate = self.creationDateFld.value
+        if DBdate:
+            creationDate = self.screenToDBDate(creationDate, self.creationDateFld.format)
+        return {"numeral": self.numeralFld.value, "user": self.userFld.value, "user_name": self.usernameFld.value, \
+            "user_level": self.userlevelFld.value, "creation_date": creationDate, "password": self.passwordFld.value}
+
     def check_fields_values(self):
-        "Checking for wrong values in the fields."
+        "Checking for wrong values in the fields: the record rules (records.py), then the screen's."
         errorMsg = None
-
-        # Mandatory values check:
-        emptyField = False
-        if self.numeralFld.value == "":
-            emptyField = True
-            self.editw = self.get_editw_number("Numeral:") - 1
-        elif self.userFld.value == "":  
-            emptyField = True
-            self.editw = self.get_editw_number("User:") - 1
-        elif self.creationDateFld.value == "":
-            emptyField = True
-            self.editw = self.get_editw_number("Creation date:") - 1
-        elif self.passwordFld.value == "":
-            emptyField = True
-            self.editw = self.get_editw_number("Encrypted password:") - 1
-        if emptyField:
-            self.ok_button.editing = False
-            errorMsg = "Error:  Mandatory field is empty"
-            return errorMsg
-
-        # wrong value check: numeral field
+        id = None if self.current_option == "Create" else self.rowSet.fileRow[0]
         try:
-            a = int(self.numeralFld.value)
-        except ValueError:
-            self.editw = self.get_editw_number("Numeral:") - 1
+            records.check_user(config.conn, self.field_values(DBdate=False), id)
+        except records.ValidationError as e:
+            self.editw = self.get_editw_number(e.field) - 1
             self.ok_button.editing = False
-            errorMsg = "Error: Numeral must be an integer"
-            return errorMsg
+            return e.message
+
         if len(self.numeralFld.value) > self.numeralFld.maximum_string_length:
             self.editw = self.get_editw_number("Numeral:") - 1
             self.ok_button.editing = False
             errorMsg = "Error: Numeral maximum length exceeded"
             return errorMsg
 
-        # wrong value check: user field
-        if " " in self.userFld.value:
-            self.editw = self.get_editw_number("User:") - 1
-            self.ok_button.editing = False
-            errorMsg = "Error: User must be a single word"
-            return errorMsg
-
-        # wrong value check: userlevel field
-        try:
-            a = int(self.userlevelFld.value)
-        except ValueError:
-            self.editw = self.get_editw_number("User level:") - 1
-            self.ok_button.editing = False
-            errorMsg = "Error: User level must be integer"
-            return errorMsg
-
-        # wrong value check: password field
-        if " " in self.passwordFld.value:
-            self.editw = self.get_editw_number("Encrypted password:") - 1
-            self.ok_button.editing = False
-            errorMsg = "Error: Password must be a single word"
-            return errorMsg            
-
-        # repeated value check: numeral and user fields
-        if self.numeralFld.value != self.bu_numeral or self.userFld.value != self.bu_user:
-            for row in config.fileRows:
-                self.ok_button.editing = False
-                # Ya existe y no es él mismo
-                if row[1] == int(self.numeralFld.value) and self.numeralFld.value != self.bu_numeral:
-                    self.editw = self.get_editw_number("Numeral:") - 1
-                    errorMsg = "Error:  Numeral already exists"
-                    return errorMsg
-                # Ya existe y no es él mismo
-                if row[2] == self.userFld.value and self.userFld.value != self.bu_user:
-                    self.editw = self.get_editw_number("User:") - 1
-                    errorMsg = "Error:  User already exists"
-                    return errorMsg
-
-        # wrong value check: user field
-        if not self.userFld.value[0].isalpha():
-            self.ok_button.editing = False
-            self.editw = self.get_editw_number("User:") - 1
-            errorMsg = "Error: User field must start with a letter"
-            return errorMsg
-        else:
-            if not self.userFld.value.isalnum():
-                self.ok_button.editing = False
-                self.editw = self.get_editw_number("User:") - 1
-                errorMsg = "Error: User field must be alphanumeric"
-                return errorMsg
-
         # check de fecha errónea:
         if not self.creationDateFld.check_value_is_ok():
             self.ok_button.editing = False
@@ -455,58 +381,85 @@ class UserForm(npyscreen.FormBaseNew):
         self.statusLine.display()
         curses.beep()
 
-    def encrypt_password(self):
-        "Quick'n'dirty encryption of the password when saving record."
-        dataBytes = base64.b64encode(self.passwordFld.value.encode('utf-8'))
-        self.passwordFld.value = repr(dataBytes)[2:-1]
+    def encrypted_values(self):
+        "The field values to save, with the password encrypted; the field itself keeps what was typed."
+        values = self.field_values()
+        values["password"] = records.encrypt_password(values["password"])
+        return values
+
+    def show_encrypted(self, password):
+        "Put the saved (encrypted) password in its field, once the record is written."
+        self.passwordFld.value = password
         form.editw = form.get_editw_number("Encrypted password:") - 1
     
     def save_created_user(self):
         "Button based Save function for C=Create."
         conn = config.conn
         cur = conn.cursor()
-        DBcreationDate = self.screenToDBDate(self.creationDateFld.value, self.creationDateFld.format)
-        sqlQuery = "INSERT INTO " + DBTABLENAME + " (numeral,user,user_name,user_level,creation_date,password) VALUES (?,?,?,?,?,?)"
-        values = (self.numeralFld.value, self.userFld.value, self.usernameFld.value, self.userlevelFld.value, DBcreationDate, self.passwordFld.value)
-        cur.execute(sqlQuery, values)
-        conn.commit()
-        conn.isolation_level = None     # free the multiuser lock
-        config.fileRow[0] = cur.lastrowid
+        values = self.encrypted_values()
+        try:
+            with dbLocking.write_transaction(conn):     # the only write lock, and just for the INSERT
+                id = records.create_user(cur, values)
+        except sqlite3.IntegrityError:  # another terminal may have just taken the same numeral
+            bs.notify_OK("\n     Numeral or user already exists. ", "Message")
+            return False
+        self.show_encrypted(values["password"])
+        self.rowSet.fileRow[0] = id
         bs.notify("\n       Record created", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-        # update config.fileRows:
+        # update self.rowSet.rows:
         new_record = []
-        new_record.append(config.fileRow[0])
+        new_record.append(self.rowSet.fileRow[0])
         new_record.append(int(self.numeralFld.value))
         new_record.append(self.userFld.value)
         new_record.append(self.usernameFld.value)
         new_record.append(int(self.userlevelFld.value))
         new_record.append(self.creationDateFld.value)
         new_record.append(self.passwordFld.value)
-        config.fileRows.append(new_record)
+        self.rowSet.rows.append(new_record)
         self.exitUser(modified=True)
+        return True
 
     def save_updated_user(self):
         "Button based Save function for U=Update."
         if self.password_changed:   # we've changed the password
-            self.encrypt_password()
+            values = self.encrypted_values()
             bs.notify("\n    Encrypting password", title="Message", form_color='STANDOUT', wrap=True, wide=False)
-            self.password_changed = False
+        else:
+            values = self.field_values()    # already stored encrypted
         cur = config.conn.cursor()
-        DBcreationDate   = self.screenToDBDate(self.creationDateFld.value, self.creationDateFld.format)
-        sqlQuery = "UPDATE " + DBTABLENAME + " SET numeral=?, user=?, user_name=?, user_level=?, creation_date=?, \
-            password=? WHERE id=?"
-        values = (str(self.numeralFld.value), self.userFld.value, self.usernameFld.value, self.userlevelFld.value, \
-            DBcreationDate, self.passwordFld.value, config.fileRow[0])
         try:
-            cur.execute(sqlQuery, values)
-            config.conn.commit()
+            with dbLocking.write_transaction(config.conn):
+                self.bu_version = records.update_user(cur, self.rowSet.fileRow[0], values, self.bu_version)
         except sqlite3.IntegrityError:
             bs.notify_OK("\n     Numeral or user already exists. ", "Message")
-            return
+            return False
+        except dbLocking.RowVersionConflict:
+            if self.resolve_conflict():
+                return self.save_updated_user()
+            return False
+        if self.password_changed:
+            self.show_encrypted(values["password"])
+            self.password_changed = False
 
         bs.notify("\n       Record saved", title="Message", form_color='STANDOUT', wrap=True, wide=False)
         self.exitUser(modified=True)
+        return True
         
+    def resolve_conflict(self):
+        "Another terminal saved this user meanwhile: show the differences and ask whether to save over them."
+        row, version = dbLocking.read_row(config.conn, DBTABLENAME, self.rowSet.fileRow[0])
+        if row is None:
+            bs.notify_OK("\n     This user was deleted by another terminal. ", "Message")
+            return False
+        fields = [("Numeral:", self.numeralFld.value, row[1]), ("User:", self.userFld.value, row[2]), \
+            ("Full name:", self.usernameFld.value, row[3]), ("User level:", self.userlevelFld.value, row[4]), \
+            ("Creation date:", self.creationDateFld.value, self.DBtoScreenDate(row[5], DATEFORMAT))]   # no passwords on screen
+        message = dbLocking.conflict_message(fields) + "\n  Save your values over them?"
+        if not bs.notify_ok_cancel(message, title="", wrap=True, editw = 1,):
+            return False    # back to the form
+        self.bu_version = version
+        return True
+
     def updateOKbtn_function(self):
         "OK button function under Update mode."
         self.strip_fields()     # Get rid of spaces
@@ -516,7 +469,8 @@ class UserForm(npyscreen.FormBaseNew):
             return
         else:
             if self.exist_changes():
-                self.save_updated_user()
+                if not self.save_updated_user():
+                    return  # back to the form
                 self.selectorForm.grid.set_highlight_row(int(self.numeralFld.value))
             else:
                 self.selectorForm.grid.set_highlight_row(int(self.numeralFld.value))
@@ -120,7 +120,7 @@ class UtilitiesMenuForm(npyscreen.FormBaseNew):
         "User control info and selector."
         App = config.parentApp
         selectorForm = App._Forms['USERSELECTOR']
-        selectorForm.update_grid()  # must be read here to get config.fileRows right
+        selectorForm.update_grid()  # must be read here to get its row set right
         selectorForm.ask_option()
         App.switchForm("USERSELECTOR")
 
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# encoding: utf-8
+##############################################################################
+#     valueLists.py - The chooser fields' value lists, kept between forms
+#
+##############################################################################
+# Copyright (c) 2023, 2024 Chad Sobodash
+# All rights reserved.
+# Licensed under the New BSD License
+# (http://www.freebsd.org/copyright/freebsd-license.html)
+##############################################################################
+# A record form's reload() used to read the whole list of a chooser field
+# (like every patient name) each time the form was opened. get() keeps the
+# lists it reads, by name and parameters, and gives back the very same list
+# until a record of its table changes, here or in another terminal (see
+# rowSetCache.unchanged()): Chooser.load_values() then has nothing to do.
+# The lists kept hold MAX_VALUES values at most, all together; the least
+# recently used ones are dropped first.
+#   values = valueLists.get("patient names", PATIENT, read_patient_names)
+##############################################################################
+
+from collections import OrderedDict
+
+import config
+import rowSetCache
+
+MAX_VALUES = config.VALUE_LIST_CACHE   # values kept, all the lists together
+
+_lists = OrderedDict()  # (name, parameters) -> ValueList, in LRU order
+_size = 0               # values in _lists, all together
+
+
+class ValueList():
+    "A value list and the position of its table's changes when it was read."
+    def __init__(self, tablename, values, position):
+        self.tablename = tablename
+        self.values = values
+        self.stamp, self.seq = position
+
+
+def get(name, tablename, read, *parameters):
+    """ a chooser value list: the one kept, or read(*parameters)
+    :param name: the list's name, like "patient names"
+    :param tablename: the table it comes from: a change to its records makes it stale
+    :return: the list of values, the same object while it is up to date
+    """
+    global _size
+    key = (name, parameters)
+    valueList = _lists.get(key)
+    if valueList is not None and rowSetCache.unchanged(valueList):
+        _lists.move_to_end(key)
+        return valueList.values
+    if valueList is not None:   # stale
+        del _lists[key]
+        _size -= len(valueList.values)
+    position = rowSetCache.position(tablename)
+    valueList = _lists[key] = ValueList(tablename, read(*parameters), position)
+    _size += len(valueList.values)
+    while _size > MAX_VALUES and len(_lists) > 1:   # but the one just read
+        oldest, kept = _lists.popitem(last=False)
+        _size -= len(kept.values)
+    return valueList.values